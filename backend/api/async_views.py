@@ -0,0 +1,255 @@
+"""
+Асинхронные представления для самых нагруженных запросов на чтение:
+лента и страница рецепта, поиск ингредиентов.
+
+Подключаются при запуске через ASGI (ASYNC_VIEWS=true). Токен, строки
+страницы и рецепт читаются асинхронным ORM Django, поиск ингредиентов
+идет по справочнику в памяти. Синхронная часть — фильтры, подсчет
+количества, сериализатор с кэшем представлений — выполняется в пуле
+из ASYNC_SYNC_THREADS потоков с постоянными соединениями, поэтому
+число потоков и соединений с базой на процесс ограничено. Все, что
+быстрый путь не берет (запись, курсорная пагинация, HTML-версия API,
+ошибки), обрабатывает обычное представление DRF в том же пуле.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+from math import ceil
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.db import connections
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from foodgram.querycheck import query_budget
+from recipes.catalog import catalog
+from recipes.models import Ingredient, Recipe
+from .authentication import aget_token
+from .filters import RecipeFilter
+from .pagination import RecipePagination
+from .serializers import RecipeReadSerializer
+from .views import IngredientViewSet, RecipeViewSet, catalog_cache_decorators
+
+executor = ThreadPoolExecutor(
+    max_workers=settings.ASYNC_SYNC_THREADS, thread_name_prefix='sync-db'
+)
+renderer = JSONRenderer()
+
+
+def release_connections():
+    """
+    Потоков в пуле мало и они живут долго, поэтому их соединения
+    с базой остаются открытыми между вызовами независимо от
+    CONN_MAX_AGE. Закрываются только сломанные, а соединения из пула
+    базы возвращаются в него: они нужны и другим потокам.
+    """
+    for connection in connections.all(initialized_only=True):
+        if getattr(connection, 'pooled', False):
+            connection.close()
+        elif connection.errors_occurred:
+            if connection.is_usable():
+                connection.errors_occurred = False
+            else:
+                connection.close()
+
+
+@sync_to_async
+def return_request_connections():
+    """
+    Возвращает в пул базы соединения, которые асинхронный ORM открыл
+    в потоке запроса. Иначе запрос держал бы два соединения сразу, и при
+    полном пуле запросы ждали бы друг друга до таймаута.
+    """
+    for connection in connections.all(initialized_only=True):
+        if getattr(connection, 'pooled', False):
+            connection.close()
+
+
+def in_pool(func):
+    """Синхронная функция, которую корутина вызывает в пуле потоков."""
+    def run(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            release_connections()
+    call = sync_to_async(run, thread_sensitive=False, executor=executor)
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        await return_request_connections()
+        return await call(*args, **kwargs)
+    return wrapper
+
+
+def drf_fallback(view):
+    """Представление DRF, которое корутина вызывает в пуле потоков."""
+    def run(request, *args, **kwargs):
+        # в потоках пула нет сигнала request_started
+        catalog.expire()
+        return view(request, *args, **kwargs)
+    return in_pool(run)
+
+
+async def authenticate(request):
+    """
+    Пользователь по заголовку Authorization: Token <ключ>, как
+    в CachedTokenAuthentication. None, если токен есть, но не подходит:
+    такой запрос отдается DRF, чтобы ответ 401 был тем же.
+    """
+    header = request.headers.get('Authorization', '').split()
+    if not header or header[0].lower() != 'token':
+        return AnonymousUser()
+    if len(header) != 2:
+        return None
+    token = await aget_token(header[1])
+    if token is None or not token.user.is_active:
+        return None
+    return token.user
+
+
+def json_response(data):
+    response = HttpResponse(
+        renderer.render(data), content_type=renderer.media_type
+    )
+    patch_vary_headers(response, ('Accept',))
+    return response
+
+
+def fast_read(drf_view):
+    """
+    Отдает GET корутине, остальное — представлению DRF drf_view.
+    Если корутина вернула None, запрос тоже уходит в DRF.
+    """
+    fallback = drf_fallback(drf_view)
+
+    def decorator(coroutine):
+        @csrf_exempt
+        @wraps(coroutine)
+        async def view(request, *args, **kwargs):
+            if (
+                request.method in ('GET', 'HEAD')
+                and 'text/html' not in request.headers.get('Accept', '')
+            ):
+                user = await authenticate(request)
+                if user is not None:
+                    request.user = user
+                    await catalog.acheck()
+                    response = await coroutine(request, *args, **kwargs)
+                    if response is not None:
+                        return response
+            return await fallback(request, *args, **kwargs)
+        return view
+    return decorator
+
+
+def recipe_queryset(user):
+    return RecipeViewSet.queryset.all().with_user_flags(user)
+
+
+@in_pool
+def represent(request, recipes):
+    return RecipeReadSerializer(
+        recipes, many=True,
+        context={'request': request, 'recipe_cache': True},
+    ).data
+
+
+@in_pool
+def filter_recipes(request):
+    """Отфильтрованная лента и ее размер или None, если фильтры неверны."""
+    filterset = RecipeFilter(
+        request.GET, queryset=recipe_queryset(request.user), request=request
+    )
+    if not filterset.is_valid():
+        return None
+    queryset = filterset.qs
+    paginator_class = RecipePagination.get_paginator_class(request.GET)
+    return queryset, paginator_class(queryset, 1).count
+
+
+def page_links(url, page, pages):
+    """Ссылки next и previous как у PageNumberPagination."""
+    param = RecipePagination.page_query_param
+    next_url = replace_query_param(url, param, page + 1) if (
+        page < pages
+    ) else None
+    if page == 1:
+        previous_url = None
+    elif page == 2:
+        previous_url = remove_query_param(url, param)
+    else:
+        previous_url = replace_query_param(url, param, page - 1)
+    return next_url, previous_url
+
+
+@fast_read(RecipeViewSet.as_view({'get': 'list', 'post': 'create'}))
+@query_budget(10)
+async def recipe_list(request):
+    """Постраничная лента рецептов."""
+    if RecipePagination.cursor_query_param in request.GET:
+        return None
+    page = request.GET.get(RecipePagination.page_query_param, '1')
+    if not page.isdigit() or int(page) < 1:
+        return None
+    page = int(page)
+    filtered = await filter_recipes(request)
+    if filtered is None:
+        return None
+    queryset, count = filtered
+    page_size = RecipePagination().get_page_size(Request(request))
+    pages = max(1, ceil(count / page_size))
+    if page > pages:
+        return None
+    offset = (page - 1) * page_size
+    recipes = [
+        recipe async for recipe in queryset[offset:offset + page_size]
+    ]
+    next_url, previous_url = page_links(
+        request.build_absolute_uri(), page, pages
+    )
+    return json_response({
+        'count': count,
+        'next': next_url,
+        'previous': previous_url,
+        'results': await represent(request, recipes),
+    })
+
+
+@fast_read(RecipeViewSet.as_view({
+    'get': 'retrieve', 'put': 'update', 'patch': 'partial_update',
+    'delete': 'destroy',
+}))
+@query_budget(8)
+async def recipe_detail(request, pk):
+    """Страница рецепта."""
+    try:
+        recipe = await recipe_queryset(request.user).aget(pk=pk)
+    except (Recipe.DoesNotExist, ValueError):
+        return None
+    return json_response((await represent(request, [recipe]))[0])
+
+
+async def search_ingredients(request):
+    name = request.GET.get('name', '')
+    return json_response(catalog.ingredients.search(
+        name, settings.INGREDIENT_SEARCH_LIMIT if name else None
+    ))
+
+
+for view_decorator in catalog_cache_decorators(Ingredient):
+    search_ingredients = view_decorator(search_ingredients)
+
+
+@fast_read(IngredientViewSet.as_view({'get': 'list'}))
+async def ingredient_list(request):
+    """
+    Поиск ингредиентов по справочнику в памяти. Справочник и его
+    версия для ETag готовятся до условного GET.
+    """
+    await catalog.aget(Ingredient)
+    return await search_ingredients(request)
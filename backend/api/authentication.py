@@ -0,0 +1,92 @@
+"""
+Аутентификация по токену с кэшем.
+
+TokenAuthentication на каждый запрос читает токен вместе с
+пользователем из базы. Здесь токен вместе с пользователем хранится
+в кэше TOKEN_CACHE_TIMEOUT секунд, и запрос с закэшированным токеном
+не обращается к базе. Сохранение пользователя (смена пароля,
+деактивация, новый аватар) сбрасывает записи его токенов через
+forget_user_tokens (api/signals.py). Поля, которые меняются
+UPDATE-запросом в обход save (счетчики, копии аватара), в request.user
+могут отставать на время жизни записи.
+
+При удалении токена (выход через djoser, удаление пользователя) запись
+в кэше заменяется меткой REVOKED на то же время. Запрос, который
+прочитал токен из базы до удаления, кладет его в кэш через cache.add
+и не перезаписывает метку, поэтому отозванный токен не вернется
+в кэш. Пока метка жива, токен проверяется по базе. Несуществующие
+токены не кэшируются, новый токен начинает работать сразу.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+REVOKED = 'revoked'
+
+
+def token_cache_key(key):
+    return 'auth-token:' + hashlib.sha256(key.encode()).hexdigest()
+
+
+def forget_tokens(*keys):
+    """Ставит в кэш метки отозванных токенов."""
+    cache.set_many(
+        {token_cache_key(key): REVOKED for key in keys},
+        settings.TOKEN_CACHE_TIMEOUT,
+    )
+
+
+def forget_user_tokens(user):
+    """Сбрасывает кэш всех токенов пользователя."""
+    keys = Token.objects.filter(user=user).values_list('key', flat=True)
+    if keys:
+        forget_tokens(*keys)
+
+
+def get_token(key):
+    """Токен с пользователем из кэша или базы, None — если его нет."""
+    tokens = Token.objects.select_related('user').filter(key=key)
+    if not settings.TOKEN_CACHE_TIMEOUT:
+        return tokens.first()
+    cache_key = token_cache_key(key)
+    cached = cache.get(cache_key)
+    if cached is None or cached == REVOKED:
+        token = tokens.first()
+        if token is not None and cached is None:
+            cache.add(cache_key, token, settings.TOKEN_CACHE_TIMEOUT)
+        return token
+    return cached
+
+
+async def aget_token(key):
+    """Асинхронный вариант get_token."""
+    tokens = Token.objects.select_related('user').filter(key=key)
+    if not settings.TOKEN_CACHE_TIMEOUT:
+        return await tokens.afirst()
+    cache_key = token_cache_key(key)
+    cached = await cache.aget(cache_key)
+    if cached is None or cached == REVOKED:
+        token = await tokens.afirst()
+        if token is not None and cached is None:
+            await cache.aadd(cache_key, token, settings.TOKEN_CACHE_TIMEOUT)
+        return token
+    return cached
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication, который берет токен через get_token."""
+
+    def authenticate_credentials(self, key):
+        token = get_token(key)
+        if token is None:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(
+                _('User inactive or deleted.')
+            )
+        return token.user, token
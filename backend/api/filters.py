@@ -1,24 +1,39 @@
 from django_filters.rest_framework import FilterSet, filters
 
-from recipes.models import Ingredient, Recipe, Tag, User
+from recipes.catalog import catalog
+from recipes.models import Recipe, User
+from recipes.search import search_recipes
+
+
+def tag_slug_choices():
+    return [(slug, slug) for slug in catalog.tags.by_slug]
 
 
 class RecipeFilter(FilterSet):
     """Фильтр для рецептов."""
-    tags = filters.ModelMultipleChoiceFilter(
-        field_name="tags__slug",
-        to_field_name="slug",
-        queryset=Tag.objects.all(),
+    tags = filters.MultipleChoiceFilter(
+        choices=tag_slug_choices, method="filter_tags"
     )
     author = filters.ModelChoiceFilter(queryset=User.objects.all())
     is_favorited = filters.BooleanFilter(method="filter_is_favorited")
     is_in_shopping_cart = filters.BooleanFilter(
         method="filter_is_in_shopping_cart"
     )
+    search = filters.CharFilter(method="filter_search")
 
     class Meta:
         model = Recipe
-        fields = ("tags", "author", "is_favorited", "is_in_shopping_cart")
+        fields = (
+            "tags", "author", "is_favorited", "is_in_shopping_cart", "search"
+        )
+
+    def filter_tags(self, queryset, name, value):
+        if not value:
+            return queryset
+        tags_by_slug = catalog.tags.by_slug
+        return queryset.filter(
+            tags__in=[tags_by_slug[slug]["id"] for slug in value]
+        ).distinct()
 
     def filter_is_favorited(self, queryset, name, value):
         if value and self.request.user.is_authenticated:
@@ -30,14 +45,7 @@ class RecipeFilter(FilterSet):
             return queryset.filter(shopping_carts__user=self.request.user)
         return queryset
 
-
-class IngredientFilter(FilterSet):
-    """
-    Фильтр для поиска ингредиентов по частичному вхождению
-    в начале названия.
-    """
-    name = filters.CharFilter(field_name="name", lookup_expr="istartswith")
-
-    class Meta:
-        model = Ingredient
-        fields = ("name",)
+    def filter_search(self, queryset, name, value):
+        if not value.strip():
+            return queryset
+        return search_recipes(queryset, value)
@@ -0,0 +1,14 @@
+from rest_framework.negotiation import BaseContentNegotiation
+
+
+class ExportContentNegotiation(BaseContentNegotiation):
+    """
+    Для выгрузок файлов: параметр format выбирает формат файла,
+    а не рендерер DRF, ошибки всегда отдаются первым рендерером (JSON).
+    """
+
+    def select_parser(self, request, parsers):
+        return parsers[0] if parsers else None
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
@@ -0,0 +1,86 @@
+from django.conf import settings
+from django.core.paginator import Paginator
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+from recipes.utils import EstimatedCountPaginator, estimated_count
+
+
+class LimitPageNumberPagination(PageNumberPagination):
+    """
+    Постраничная пагинация с размером страницы из параметра limit.
+
+    Общее количество точное. С параметром count=estimate для больших
+    выборок берется оценка PostgreSQL: ответ дешевле, но count и число
+    страниц приблизительны, последние страницы могут оказаться пустыми
+    или не найтись.
+    """
+    page_size_query_param = 'limit'
+    max_page_size = settings.MAX_PAGE_SIZE
+    count_query_param = 'count'
+
+    @classmethod
+    def get_paginator_class(cls, query_params):
+        if query_params.get(cls.count_query_param) == 'estimate':
+            return EstimatedCountPaginator
+        return Paginator
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.django_paginator_class = self.get_paginator_class(
+            request.query_params
+        )
+        return super().paginate_queryset(queryset, request, view)
+
+
+class RecipeCursorPagination(CursorPagination):
+    """
+    Курсорная (keyset) пагинация ленты по (-pub_date, -id).
+
+    Общее количество не считается, пока клиент не попросит его
+    параметром count=exact или count=estimate.
+    """
+    ordering = ('-pub_date', '-id')
+    page_size_query_param = 'limit'
+    max_page_size = settings.MAX_PAGE_SIZE
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = self.get_count(queryset, request)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_count(self, queryset, request):
+        mode = request.query_params.get('count')
+        if mode == 'estimate':
+            estimate = estimated_count(queryset)
+            if estimate is not None:
+                return estimate
+        if mode in ('exact', 'estimate'):
+            return queryset.count()
+        return None
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if self.count is not None:
+            response.data = {'count': self.count, **response.data}
+        return response
+
+
+class RecipePagination(LimitPageNumberPagination):
+    """
+    Пагинация ленты рецептов: постраничная по умолчанию
+    и курсорная, если в запросе есть параметр cursor.
+    """
+
+    cursor_query_param = RecipeCursorPagination.cursor_query_param
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_pagination = None
+        if self.cursor_query_param in request.query_params:
+            self.cursor_pagination = RecipeCursorPagination()
+            return self.cursor_pagination.paginate_queryset(
+                queryset, request, view
+            )
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_pagination is not None:
+            return self.cursor_pagination.get_paginated_response(data)
+        return super().get_paginated_response(data)
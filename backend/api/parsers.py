@@ -0,0 +1,50 @@
+import json
+import mimetypes
+
+from django.utils.datastructures import MultiValueDict
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import (DataAndFiles, FileUploadParser,
+                                    MultiPartParser)
+
+
+class MultiPartJSONParser(MultiPartParser):
+    """
+    multipart/form-data, в котором поля, кроме файлов, можно передать
+    одной частью data в JSON: так передаются вложенные ingredients.
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        result = super().parse(stream, media_type, parser_context)
+        if 'data' not in result.data:
+            return result
+        try:
+            data = json.loads(result.data['data'])
+        except ValueError as error:
+            raise ParseError(f'Часть data не является JSON: {error}')
+        if not isinstance(data, dict):
+            raise ParseError('Часть data должна быть JSON-объектом.')
+        # файлы кладем в сами данные: DRF объединил бы обычный dict
+        # с MultiValueDict файлов, подставив вместо файлов их списки
+        data.update(result.files.dict())
+        return DataAndFiles(data, MultiValueDict())
+
+
+class ImageUploadParser(FileUploadParser):
+    """
+    Тело запроса — сама картинка (Content-Type: image/*). Файл пишется
+    на диск частями обработчиками загрузки Django и попадает в поле
+    upload_field представления.
+    """
+    media_type = 'image/*'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        result = super().parse(stream, media_type, parser_context)
+        field = getattr(parser_context['view'], 'upload_field', 'file')
+        return DataAndFiles({}, {field: result.files['file']})
+
+    def get_filename(self, stream, media_type, parser_context):
+        filename = super().get_filename(stream, media_type, parser_context)
+        if filename:
+            return filename
+        extension = mimetypes.guess_extension(media_type.split(';')[0])
+        return f'upload{extension or ""}'
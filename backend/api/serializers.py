@@ -1,73 +1,201 @@
 import base64
+import binascii
+from collections import Counter
 
+from django.conf import settings
+from django.core.cache import cache
 from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import prefetch_related_objects
 from djoser.serializers import UserSerializer as DjoserUserSerializer
+from PIL import Image
 from rest_framework import serializers
 
+from recipes.catalog import catalog
 from recipes.constants import MIN_COOKING_TIME, MIN_INGREDIENT_AMOUNT
-from recipes.models import (Follow, Ingredient, Recipe,
-                            RecipeIngredient, Tag, User)
+from recipes.counters import change_counter
+from recipes.image_variants import IMAGE_FIELDS, is_actual
+from recipes.models import (Follow, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingListItem, Tag, User, bump_recipe_versions)
+from recipes.shopping_list import cart_users, change_shopping_lists
+
+RECIPE_CACHE_PREFIX = "recipe:v1"
+
+
+def validate_image_limits(file):
+    """
+    Проверяет размер файла и число пикселей по заголовку картинки,
+    не распаковывая ее целиком.
+    """
+    if file.size > settings.MAX_IMAGE_SIZE:
+        raise serializers.ValidationError(
+            'Размер изображения больше {} МБ.'.format(
+                settings.MAX_IMAGE_SIZE // (1024 * 1024)
+            )
+        )
+    try:
+        with Image.open(file) as image:
+            width, height = image.size
+    except (OSError, Image.DecompressionBombError):
+        raise serializers.ValidationError('Неверный формат изображения.')
+    finally:
+        file.seek(0)
+    if width * height > settings.MAX_IMAGE_PIXELS:
+        raise serializers.ValidationError(
+            'Изображение больше {} мегапикселей.'.format(
+                settings.MAX_IMAGE_PIXELS // 1_000_000
+            )
+        )
+
+
+def decode_base64_image(data, name):
+    """
+    Декодирует картинку из data URI. Длина строки проверяется
+    до декодирования base64, пиксели — по заголовку картинки.
+    """
+    try:
+        format, imgstr = data.split(";base64,")
+    except ValueError:
+        raise serializers.ValidationError("Неверный формат изображения.")
+    if len(imgstr) * 3 // 4 > settings.MAX_IMAGE_SIZE:
+        raise serializers.ValidationError(
+            "Размер изображения больше {} МБ.".format(
+                settings.MAX_IMAGE_SIZE // (1024 * 1024)
+            )
+        )
+    ext = format.split("/")[-1]
+    try:
+        decoded_file = base64.b64decode(imgstr)
+    except binascii.Error:
+        raise serializers.ValidationError("Ошибка декодирования.")
+    image = ContentFile(decoded_file, name=f"{name}.{ext}")
+    validate_image_limits(image)
+    return image
 
 
 class Base64ImageField(serializers.ImageField):
-    """Кастомное поле для изображений в base64."""
+    """
+    Кастомное поле для изображений в base64. Принимает и обычный файл
+    из multipart/form-data или тела запроса image/*.
+    """
+
+    def __init__(self, *args, filename="temp", **kwargs):
+        self.filename = filename
+        super().__init__(*args, **kwargs)
 
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith("data:image"):
-            format, imgstr = data.split(";base64,")
-            ext = format.split("/")[-1]
-            data = ContentFile(base64.b64decode(imgstr), name=f"temp.{ext}")
+            data = decode_base64_image(data, self.filename)
+        elif hasattr(data, "size"):
+            validate_image_limits(data)
         return super().to_internal_value(data)
 
 
+class ImageVariantsField(serializers.ReadOnlyField):
+    """
+    Ссылки на уменьшенные копии картинки. Пока копии не готовы,
+    вместо них отдается ссылка на оригинал.
+    """
+
+    def __init__(self, image_field, **kwargs):
+        self.image_field = image_field
+        super().__init__(source="*", **kwargs)
+
+    def to_representation(self, instance):
+        # у анонимного пользователя (GET /api/users/me/) поля нет
+        image = getattr(instance, self.image_field, None)
+        if not image:
+            return None
+        variants = getattr(instance, f"{self.image_field}_variants")
+        if not is_actual(image, variants):
+            variants = {}
+        request = self.context.get("request")
+        result = {}
+        for variant in IMAGE_FIELDS[type(instance)][1]:
+            url = image.storage.url(variants.get(variant, image.name))
+            if request is not None:
+                url = request.build_absolute_uri(url)
+            result[variant] = url
+        return result
+
+
 class AvatarSerializer(serializers.Serializer):
     """Сериализатор для валидации и декодирования аватара."""
-    avatar = serializers.CharField()
+    avatar = Base64ImageField(
+        filename="avatar",
+        error_messages={"invalid": "Неверный формат изображения."},
+    )
 
-    def validate_avatar(self, avatar_data):
-        if not avatar_data.startswith('data:image'):
-            raise serializers.ValidationError('Неверный формат изображения.')
+
+class CatalogPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    Первичный ключ тега или ингредиента.
+
+    Проверяется по справочнику в памяти процесса без запроса к базе,
+    валидированное значение — сам первичный ключ.
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, bool):
+            self.fail("incorrect_type", data_type=type(data).__name__)
         try:
-            format, imgstr = avatar_data.split(';base64,')
-            ext = format.split('/')[-1]
-            decoded_file = base64.b64decode(imgstr)
-            return ContentFile(decoded_file, name=f'avatar.{ext}')
-        except Exception:
-            raise serializers.ValidationError('Ошибка декодирования.')
+            pk = int(data)
+        except (TypeError, ValueError):
+            self.fail("incorrect_type", data_type=type(data).__name__)
+        if pk not in catalog.get(self.queryset.model):
+            self.fail("does_not_exist", pk_value=data)
+        return pk
 
 
 class UserReadSerializer(DjoserUserSerializer):
     """Сериализатор для безопасного просмотра профилей пользователей."""
     is_subscribed = serializers.SerializerMethodField(read_only=True)
     avatar = Base64ImageField(read_only=True)
+    avatar_variants = ImageVariantsField("avatar")
 
     class Meta:
         model = User
         fields = (
             "email", "id", "username", "first_name", "last_name",
-            "is_subscribed", "avatar"
+            "is_subscribed", "avatar", "avatar_variants"
         )
         read_only_fields = fields
 
     def get_is_subscribed(self, author):
         user = self.context.get("request").user
-        return (
-            user.is_authenticated
-            and user != author
-            and Follow.objects.filter(user=user, author=author).exists()
-        )
+        if not user.is_authenticated or user == author:
+            return False
+        if hasattr(author, "is_subscribed"):
+            return author.is_subscribed
+        return Follow.objects.filter(user=user, author=author).exists()
 
 
 class TagSerializer(serializers.ModelSerializer):
     class Meta:
         model = Tag
-        fields = "__all__"
+        fields = ("id", "name", "color", "slug")
 
 
 class IngredientSerializer(serializers.ModelSerializer):
     class Meta:
         model = Ingredient
-        fields = "__all__"
+        fields = ("id", "name", "measurement_unit")
+
+
+class ShoppingListItemSerializer(serializers.ModelSerializer):
+    """Строка сводного списка покупок."""
+    id = serializers.ReadOnlyField(source="ingredient_id")
+    name = serializers.ReadOnlyField(source="ingredient.name")
+    measurement_unit = serializers.ReadOnlyField(
+        source="ingredient.measurement_unit"
+    )
+
+    class Meta:
+        model = ShoppingListItem
+        fields = (
+            "id", "name", "measurement_unit", "total_amount", "recipe_count"
+        )
+        read_only_fields = fields
 
 
 class RecipeIngredientReadSerializer(serializers.ModelSerializer):
@@ -82,36 +210,131 @@ class RecipeIngredientReadSerializer(serializers.ModelSerializer):
         fields = ("id", "name", "measurement_unit", "amount")
 
 
+class RecipeListSerializer(serializers.ListSerializer):
+    """Список рецептов, читающий кэш представлений одним get_many."""
+
+    def to_representation(self, data):
+        if hasattr(data, "all"):
+            data = data.all()
+        return self.child.to_representation_many(list(data))
+
+
 class RecipeReadSerializer(serializers.ModelSerializer):
-    """Сериализатор для чтения рецептов."""
+    """
+    Сериализатор для чтения рецептов.
+
+    Если в контексте передан recipe_cache, общая для всех пользователей
+    часть представления берется из кэша по id и версии рецепта,
+    а признаки конкретного пользователя подставляются поверх.
+    """
     tags = TagSerializer(many=True, read_only=True)
     author = UserReadSerializer(read_only=True)
     ingredients = RecipeIngredientReadSerializer(
         source="recipe_ingredients", many=True
     )
+    image_variants = ImageVariantsField("image")
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
 
+    personal_fields = ("is_favorited", "is_in_shopping_cart")
+    prefetch_fields = ("tags", "recipe_ingredients__ingredient")
+
     class Meta:
         model = Recipe
         fields = (
-            'id', 'tags', 'author', 'ingredients', 'name', 'image', 'text',
-            'cooking_time', 'is_favorited', 'is_in_shopping_cart'
+            'id', 'tags', 'author', 'ingredients', 'name', 'image',
+            'image_variants', 'text', 'cooking_time', 'is_favorited',
+            'is_in_shopping_cart'
         )
+        list_serializer_class = RecipeListSerializer
+
+    def get_cache_key(self, recipe):
+        request = self.context["request"]
+        tags_version, _ = catalog.get_version(Tag)
+        ingredients_version, _ = catalog.get_version(Ingredient)
+        return (
+            f"{RECIPE_CACHE_PREFIX}:{request.scheme}://{request.get_host()}:"
+            f"{recipe.id}:{recipe.version}:"
+            f"{tags_version}.{ingredients_version}"
+        )
+
+    def to_representation(self, recipe):
+        return self.to_representation_many([recipe])[0]
+
+    def to_representation_many(self, recipes):
+        if not self.context.get("recipe_cache"):
+            prefetch_related_objects(recipes, *self.prefetch_fields)
+            return [
+                self.build_representation(recipe) for recipe in recipes
+            ]
+        keys = [self.get_cache_key(recipe) for recipe in recipes]
+        cached = cache.get_many(keys)
+        missing = [
+            recipe for key, recipe in zip(keys, recipes) if key not in cached
+        ]
+        prefetch_related_objects(missing, *self.prefetch_fields)
+        built = {}
+        result = []
+        for key, recipe in zip(keys, recipes):
+            if key in cached:
+                result.append(self.add_personal_fields(recipe, cached[key]))
+                continue
+            data = self.build_representation(recipe)
+            built[key] = self.strip_personal_fields(data)
+            result.append(data)
+        if built:
+            cache.set_many(built, settings.RECIPE_CACHE_TIMEOUT)
+        return result
+
+    def build_representation(self, recipe):
+        if hasattr(recipe, "is_author_subscribed"):
+            recipe.author.is_subscribed = recipe.is_author_subscribed
+        return super().to_representation(recipe)
+
+    def strip_personal_fields(self, data):
+        shared = {
+            key: value for key, value in data.items()
+            if key not in self.personal_fields
+        }
+        shared["author"] = {
+            key: value for key, value in data["author"].items()
+            if key != "is_subscribed"
+        }
+        return shared
+
+    def add_personal_fields(self, recipe, shared):
+        if hasattr(recipe, "is_author_subscribed"):
+            recipe.author.is_subscribed = recipe.is_author_subscribed
+        data = dict(shared)
+        data["author"] = {
+            **shared["author"],
+            "is_subscribed": self.fields["author"].get_is_subscribed(
+                recipe.author
+            ),
+        }
+        data["is_favorited"] = self.get_is_favorited(recipe)
+        data["is_in_shopping_cart"] = self.get_is_in_shopping_cart(recipe)
+        return data
 
     def get_is_favorited(self, recipe):
         request = self.context.get("request")
-        return (request and request.user.is_authenticated
-                and recipe.favorites.filter(user=request.user).exists())
+        if not (request and request.user.is_authenticated):
+            return False
+        if hasattr(recipe, "is_favorited"):
+            return recipe.is_favorited
+        return recipe.favorites.filter(user=request.user).exists()
 
     def get_is_in_shopping_cart(self, recipe):
         request = self.context.get("request")
-        return (request and request.user.is_authenticated
-                and recipe.shopping_carts.filter(user=request.user).exists())
+        if not (request and request.user.is_authenticated):
+            return False
+        if hasattr(recipe, "is_in_shopping_cart"):
+            return recipe.is_in_shopping_cart
+        return recipe.shopping_carts.filter(user=request.user).exists()
 
 
 class RecipeIngredientWriteSerializer(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
+    id = CatalogPrimaryKeyRelatedField(queryset=Ingredient.objects.all())
     amount = serializers.IntegerField(min_value=MIN_INGREDIENT_AMOUNT)
 
     class Meta:
@@ -121,7 +344,7 @@ class RecipeIngredientWriteSerializer(serializers.ModelSerializer):
 
 class RecipeWriteSerializer(serializers.ModelSerializer):
     """Сериализатор для создания и обновления рецептов."""
-    tags = serializers.PrimaryKeyRelatedField(
+    tags = CatalogPrimaryKeyRelatedField(
         queryset=Tag.objects.all(), many=True
     )
     ingredients = RecipeIngredientWriteSerializer(many=True)
@@ -134,31 +357,111 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
             "ingredients", "tags", "image", "name", "text", "cooking_time"
         )
 
+    @staticmethod
+    def _check_duplicates(ids, message):
+        duplicates = sorted(pk for pk, count in Counter(ids).items()
+                            if count > 1)
+        if duplicates:
+            raise serializers.ValidationError(
+                message.format(", ".join(map(str, duplicates)))
+            )
+
+    def validate_ingredients(self, ingredients):
+        self._check_duplicates(
+            [item["id"] for item in ingredients],
+            "Ингредиенты повторяются: {}.",
+        )
+        return ingredients
+
+    def validate_tags(self, tags):
+        self._check_duplicates(tags, "Теги повторяются: {}.")
+        return tags
+
+    def _set_ingredients(self, recipe, ingredients):
+        """
+        Сравнивает новый состав рецепта с текущим и записывает только
+        разницу: новые строки, измененные количества и удаленные строки.
+        """
+        current = {
+            ingredient_id: (pk, amount)
+            for pk, ingredient_id, amount in
+            recipe.recipe_ingredients.values_list(
+                "pk", "ingredient_id", "amount"
+            )
+        }
+        wanted = {item["id"]: item["amount"] for item in ingredients}
+        removed = [
+            pk for ingredient_id, (pk, _) in current.items()
+            if ingredient_id not in wanted
+        ]
+        if removed:
+            # счетчики и списки покупок при удалении правят сигналы
+            RecipeIngredient.objects.filter(pk__in=removed).delete()
+        added = {
+            ingredient_id: amount for ingredient_id, amount in wanted.items()
+            if ingredient_id not in current
+        }
+        changed = {
+            ingredient_id: amount for ingredient_id, amount in wanted.items()
+            if ingredient_id in current
+            and current[ingredient_id][1] != amount
+        }
+        if added:
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(
+                    recipe=recipe, ingredient_id=ingredient_id, amount=amount
+                )
+                for ingredient_id, amount in added.items()
+            )
+            change_counter(
+                Ingredient, "recipes_count", 1, pk__in=list(added)
+            )
+        if changed:
+            RecipeIngredient.objects.bulk_update(
+                [
+                    RecipeIngredient(pk=current[ingredient_id][0],
+                                     amount=amount)
+                    for ingredient_id, amount in changed.items()
+                ],
+                ["amount"],
+            )
+        change_shopping_lists(cart_users(recipe.pk), {
+            **{
+                ingredient_id: (amount - current[ingredient_id][1], 0)
+                for ingredient_id, amount in changed.items()
+            },
+            **{
+                ingredient_id: (amount, 1)
+                for ingredient_id, amount in added.items()
+            },
+        })
+
     def _add_ingredients_and_tags(self, recipe, ingredients, tags):
         if tags is not None:
             recipe.tags.set(tags)
         if ingredients is not None:
-            recipe.recipe_ingredients.all().delete()
-            RecipeIngredient.objects.bulk_create(
-                (RecipeIngredient(
-                    recipe=recipe,
-                    ingredient=item["id"],
-                    amount=item["amount"]
-                ) for item in ingredients)
-            )
+            self._set_ingredients(recipe, ingredients)
 
+    @transaction.atomic
     def create(self, validated_data):
         tags = validated_data.pop("tags")
         ingredients = validated_data.pop("ingredients")
         recipe = super().create(validated_data)
         self._add_ingredients_and_tags(recipe, ingredients, tags)
+        bump_recipe_versions([recipe.pk])
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         tags = validated_data.pop("tags", None)
         ingredients = validated_data.pop("ingredients", None)
-        instance = super().update(instance, validated_data)
+        for field, value in validated_data.items():
+            setattr(instance, field, value)
+        # только переданные поля: полное сохранение перезаписало бы
+        # счетчики избранного и корзин значениями, прочитанными до запроса
+        instance.save(update_fields=validated_data)
         self._add_ingredients_and_tags(instance, ingredients, tags)
+        bump_recipe_versions([instance.pk])
         return instance
 
     def to_representation(self, instance):
@@ -167,29 +470,52 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
 
 class RecipeShortSerializer(serializers.ModelSerializer):
     """Короткий сериализатор для рецептов."""
+    image_variants = ImageVariantsField("image")
+
     class Meta:
         model = Recipe
-        fields = ("id", "name", "image", "cooking_time")
+        fields = ("id", "name", "image", "image_variants", "cooking_time")
         read_only_fields = fields
 
 
+class BatchIdsSerializer(serializers.Serializer):
+    """Список id для пакетных операций, повторы отбрасываются."""
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.BATCH_MAX_IDS,
+        error_messages={
+            "max_length": "Не больше {max_length} id за один запрос."
+        },
+    )
+
+    def validate_ids(self, ids):
+        return list(dict.fromkeys(ids))
+
+
+def get_recipes_limit(request):
+    """Достает из запроса параметр recipes_limit, если он корректен."""
+    try:
+        recipes_limit = int(request.query_params.get("recipes_limit"))
+    except (ValueError, TypeError):
+        return None
+    return recipes_limit if recipes_limit >= 0 else None
+
+
 class AuthorSubscriptionSerializer(UserReadSerializer):
     """Сериализатор для отображения авторов в подписках с рецептами."""
-    recipes_count = serializers.ReadOnlyField(source="recipes.count")
+    recipes_count = serializers.ReadOnlyField()
     recipes = serializers.SerializerMethodField()
 
     class Meta(UserReadSerializer.Meta):
         fields = (*UserReadSerializer.Meta.fields, "recipes_count", "recipes")
 
     def get_recipes(self, author):
-        recipes_limit_str = self.context["request"].query_params.get(
-            "recipes_limit"
-        )
-        recipes = author.recipes.all()
-        if recipes_limit_str:
-            try:
-                recipes_limit = int(recipes_limit_str)
+        if hasattr(author, "limited_recipes"):
+            recipes = author.limited_recipes
+        else:
+            recipes = author.recipes.all()
+            recipes_limit = get_recipes_limit(self.context["request"])
+            if recipes_limit is not None:
                 recipes = recipes[:recipes_limit]
-            except (ValueError, TypeError):
-                pass
         return RecipeShortSerializer(recipes, many=True).data
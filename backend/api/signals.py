@@ -0,0 +1,27 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .authentication import forget_tokens, forget_user_tokens
+
+
+@receiver(post_delete, sender=Token)
+def forget_deleted_token(sender, instance, **kwargs):
+    """Выход через djoser и удаление пользователя удаляют токен."""
+    forget_tokens(instance.key)
+
+
+@receiver(post_save, sender=get_user_model())
+def forget_saved_user_tokens(sender, instance, created, raw, update_fields,
+                             **kwargs):
+    """
+    В кэше токенов лежит пользователь: после смены пароля, деактивации
+    и других изменений записи его токенов сбрасываются. Вход обновляет
+    только last_login, этого поля в ответах нет.
+    """
+    if raw or created:
+        return
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    forget_user_tokens(instance)
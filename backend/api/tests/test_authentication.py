@@ -0,0 +1,90 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework.authtoken.models import Token
+
+from api.authentication import aget_token, get_token, token_cache_key
+from recipes.models import User
+
+
+@override_settings(TOKEN_CACHE_TIMEOUT=60)
+class TokenCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user(
+            username='reader', email='reader@example.com',
+            password='Pass-12345!', first_name='A', last_name='B',
+        )
+        self.token = Token.objects.create(user=self.user)
+
+    def test_cached_token_authenticates_without_queries(self):
+        get_token(self.token.key)
+        with self.assertNumQueries(0):
+            token = get_token(self.token.key)
+        self.assertEqual(token.user.pk, self.user.pk)
+
+    def test_user_save_forgets_cached_token(self):
+        get_token(self.token.key)
+        self.user.is_active = False
+        self.user.save()
+        self.assertFalse(get_token(self.token.key).user.is_active)
+
+    def test_password_change_forgets_cached_token(self):
+        get_token(self.token.key)
+        self.user.set_password('Other-12345!')
+        self.user.save(update_fields=['password'])
+        token = get_token(self.token.key)
+        self.assertTrue(token.user.check_password('Other-12345!'))
+
+    def test_saving_cached_user_keeps_counters(self):
+        """djoser set_password сохраняет request.user целиком."""
+        user = get_token(self.token.key).user
+        User.objects.filter(pk=self.user.pk).update(followers_count=3)
+        user.set_password('Other-12345!')
+        user.save()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.followers_count, 3)
+        self.assertTrue(self.user.check_password('Other-12345!'))
+
+    def test_login_keeps_cached_token(self):
+        get_token(self.token.key)
+        self.user.save(update_fields=['last_login'])
+        with self.assertNumQueries(0):
+            get_token(self.token.key)
+
+    def test_deleted_user_token_is_forgotten(self):
+        key = self.token.key
+        get_token(key)
+        self.user.delete()
+        self.assertIsNone(get_token(key))
+
+    def test_deleted_token_is_not_cached(self):
+        key = self.token.key
+        get_token(key)
+        self.token.delete()
+        self.assertIsNone(get_token(key))
+
+    def test_token_deleted_after_read_is_not_cached_again(self):
+        """Выход между чтением токена из базы и записью в кэш."""
+        key = self.token.key
+        add = cache.add
+
+        def logout_then_add(*args, **kwargs):
+            self.token.delete()
+            return add(*args, **kwargs)
+
+        with mock.patch.object(cache, 'add', logout_then_add):
+            self.assertIsNotNone(get_token(key))
+        self.assertIsNone(get_token(key))
+
+    async def test_async_token_is_cached_with_user(self):
+        key = self.token.key
+        first = await aget_token(key)
+        second = await aget_token(key)
+        self.assertEqual(first.user.pk, self.user.pk)
+        self.assertEqual(second.user.pk, self.user.pk)
+        cached = await cache.aget(token_cache_key(key))
+        self.assertEqual(cached.user.pk, self.user.pk)
@@ -0,0 +1,51 @@
+from rest_framework.test import APITestCase
+
+from api.serializers import RecipeWriteSerializer
+from api.tests.test_media import png_data_url
+from recipes.models import Recipe, User
+
+
+class StaleCountersTests(APITestCase):
+    """Сохранение объекта не перезаписывает денормализованные счетчики."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='author', email='author@example.com',
+            password='Pass-12345!', first_name='A', last_name='B',
+        )
+        cls.recipe = Recipe.objects.create(
+            author=cls.user, name='Суп', image='recipes/images/test.png',
+            text='Суп', cooking_time=1,
+        )
+
+    def test_avatar_keeps_user_counters(self):
+        self.client.force_authenticate(self.user)
+        User.objects.filter(pk=self.user.pk).update(
+            followers_count=5, following_count=3
+        )
+        response = self.client.put(
+            '/api/users/me/avatar/', {'avatar': png_data_url()},
+            format='json',
+        )
+        self.assertEqual(response.status_code, 200)
+        response = self.client.delete('/api/users/me/avatar/')
+        self.assertEqual(response.status_code, 204)
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.avatar)
+        self.assertEqual(self.user.followers_count, 5)
+        self.assertEqual(self.user.following_count, 3)
+
+    def test_recipe_update_keeps_list_counters(self):
+        Recipe.objects.filter(pk=self.recipe.pk).update(
+            favorites_count=4, in_carts_count=2
+        )
+        serializer = RecipeWriteSerializer(
+            self.recipe, data={'name': 'Борщ'}, partial=True
+        )
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.name, 'Борщ')
+        self.assertEqual(self.recipe.favorites_count, 4)
+        self.assertEqual(self.recipe.in_carts_count, 2)
@@ -0,0 +1,39 @@
+import base64
+import io
+from pathlib import Path
+
+from django.conf import settings
+from PIL import Image
+from rest_framework.test import APITestCase
+
+from recipes.models import User
+
+
+def png_data_url():
+    buffer = io.BytesIO()
+    Image.new('RGB', (4, 4), 'red').save(buffer, format='PNG')
+    encoded = base64.b64encode(buffer.getvalue()).decode()
+    return f'data:image/png;base64,{encoded}'
+
+
+class TestMediaRootTests(APITestCase):
+    """Файлы, загруженные в тестах, не попадают в media/ проекта."""
+
+    def test_uploads_go_to_temporary_media_root(self):
+        user = User.objects.create_user(
+            username='uploader', email='uploader@example.com',
+            password='Pass-12345!', first_name='A', last_name='B',
+        )
+        self.client.force_authenticate(user)
+        response = self.client.put(
+            '/api/users/me/avatar/', {'avatar': png_data_url()},
+            format='json',
+        )
+        self.assertEqual(response.status_code, 200)
+        user.refresh_from_db()
+        path = Path(user.avatar.path)
+        self.assertTrue(path.is_file())
+        self.assertNotEqual(
+            Path(settings.MEDIA_ROOT), settings.BASE_DIR / 'media'
+        )
+        self.assertTrue(path.is_relative_to(settings.MEDIA_ROOT))
@@ -0,0 +1,29 @@
+from unittest import mock
+
+from rest_framework.test import APITestCase
+
+from recipes.models import User
+
+
+class PageNumberCountTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for number in range(3):
+            User.objects.create_user(
+                username=f'user{number}', email=f'user{number}@example.com',
+                password='Pass-12345!', first_name='A', last_name='B',
+            )
+
+    @mock.patch('recipes.utils.estimated_count', return_value=100_000)
+    def test_count_is_exact_by_default(self, estimated_count):
+        response = self.client.get('/api/users/', {'limit': 2})
+        self.assertEqual(response.json()['count'], 3)
+        estimated_count.assert_not_called()
+
+    @mock.patch('recipes.utils.estimated_count', return_value=100_000)
+    def test_estimate_is_opt_in(self, estimated_count):
+        response = self.client.get(
+            '/api/users/', {'limit': 2, 'count': 'estimate'}
+        )
+        self.assertEqual(response.json()['count'], 100_000)
@@ -0,0 +1,67 @@
+from unittest import mock
+
+from rest_framework.test import APITransactionTestCase
+
+from recipes.models import Ingredient, Recipe, RecipeIngredient, Tag, User
+
+
+class RecipeUpdateTests(APITransactionTestCase):
+    """Настоящие коммиты: версии рецептов меняются после них."""
+
+    def setUp(self):
+        # копии картинки строятся в пуле после коммита и сами меняют
+        # версию рецепта
+        patcher = mock.patch('recipes.signals.schedule_variants')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        cls = self
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com',
+            password='Pass-12345!', first_name='A', last_name='B',
+        )
+        cls.tags = [
+            Tag.objects.create(name=name, color=color, slug=slug)
+            for name, color, slug in (
+                ('Завтрак', '#E26C2D', 'breakfast'),
+                ('Обед', '#49B64E', 'lunch'),
+            )
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('мука', 'сахар', 'соль')
+        ]
+        cls.recipe = Recipe.objects.create(
+            author=cls.author, name='Пирог', image='recipes/images/test.png',
+            text='Пирог', cooking_time=30,
+        )
+        cls.recipe.tags.set([cls.tags[0]])
+        for ingredient in cls.ingredients[:2]:
+            RecipeIngredient.objects.create(
+                recipe=cls.recipe, ingredient=ingredient, amount=100
+            )
+
+    def test_patch_ingredients_and_tags_bumps_version_once(self):
+        self.client.force_authenticate(self.author)
+        version = Recipe.objects.get(pk=self.recipe.pk).version
+        response = self.client.patch(
+            f'/api/recipes/{self.recipe.pk}/', {
+                'tags': [self.tags[1].pk],
+                'ingredients': [
+                    {'id': self.ingredients[0].pk, 'amount': 150},
+                    {'id': self.ingredients[2].pk, 'amount': 5},
+                ],
+            }, format='json',
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        recipe = Recipe.objects.get(pk=self.recipe.pk)
+        self.assertEqual(recipe.version, version + 1)
+        self.assertEqual(
+            list(recipe.tags.values_list('pk', flat=True)),
+            [self.tags[1].pk],
+        )
+        self.assertEqual(
+            dict(recipe.recipe_ingredients.values_list(
+                'ingredient_id', 'amount'
+            )),
+            {self.ingredients[0].pk: 150, self.ingredients[2].pk: 5},
+        )
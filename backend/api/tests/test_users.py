@@ -0,0 +1,10 @@
+from rest_framework.test import APITestCase
+
+
+class CurrentUserTests(APITestCase):
+
+    def test_anonymous_me_is_not_server_error(self):
+        response = self.client.get('/api/users/me/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.json()['id'])
+        self.assertIsNone(response.json()['avatar_variants'])
@@ -1,7 +1,10 @@
-from django.urls import include, path
+from django.conf import settings
+from django.urls import include, path, re_path
 from rest_framework.routers import DefaultRouter
 
-from .views import IngredientViewSet, RecipeViewSet, TagViewSet, UserViewSet
+from .async_views import ingredient_list, recipe_detail, recipe_list
+from .views import (IngredientViewSet, RecipeViewSet, TagViewSet,
+                    UserViewSet, catalog_bundle)
 
 router = DefaultRouter()
 router.register('tags', TagViewSet, basename='tags')
@@ -10,6 +13,19 @@ router.register('recipes', RecipeViewSet, basename='recipes')
 router.register('users', UserViewSet, basename='users')
 
 urlpatterns = [
+    path('catalog/', catalog_bundle, name='catalog-bundle-latest'),
+    path('catalog/<str:version>/', catalog_bundle, name='catalog-bundle'),
+]
+
+if settings.ASYNC_VIEWS:
+    # раньше роутера: остальные методы эти представления отдают вьюсетам
+    urlpatterns += [
+        path('ingredients/', ingredient_list),
+        path('recipes/', recipe_list),
+        re_path(r'^recipes/(?P<pk>\d+)/$', recipe_detail),
+    ]
+
+urlpatterns += [
     path('', include(router.urls)),
     path('auth/', include('djoser.urls.authtoken')),
 ]
@@ -1,30 +1,78 @@
-from django.http import FileResponse
-from django.shortcuts import get_object_or_404
+import hashlib
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Prefetch, Value
+from django.http import HttpResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404, redirect
+from django.urls import reverse
+from django.utils.cache import (get_conditional_response, patch_cache_control,
+                                patch_vary_headers)
+from django.utils.decorators import method_decorator
+from django.utils.http import content_disposition_header
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_safe
+from django.views.decorators.vary import vary_on_headers
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet as DjoserUserViewSet
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
 from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import FormParser, JSONParser
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 
-from recipes.utils import format_shopping_list
+from foodgram.querycheck import query_budget
+from recipes.catalog import catalog
 from recipes.models import (Favorite, Follow, Ingredient,
-                            Recipe, ShoppingCart, Tag, User)
-from .filters import IngredientFilter, RecipeFilter
+                            Recipe, ShoppingCart, ShoppingListItem, Tag,
+                            User)
+from recipes.shopping_list import EXPORT_FORMATS, ShoppingList
+from recipes.user_lists import (add_recipes, follow_authors, remove_recipes,
+                                unfollow_authors)
+from .filters import RecipeFilter
+from .negotiation import ExportContentNegotiation
+from .parsers import ImageUploadParser, MultiPartJSONParser
+from .pagination import RecipePagination
 from .permissions import IsAuthorOrReadOnly
 from .serializers import (
-    AuthorSubscriptionSerializer, AvatarSerializer, IngredientSerializer,
-    RecipeReadSerializer, RecipeShortSerializer, RecipeWriteSerializer,
-    TagSerializer, UserReadSerializer
+    AuthorSubscriptionSerializer, AvatarSerializer, BatchIdsSerializer,
+    IngredientSerializer, RecipeReadSerializer, RecipeShortSerializer,
+    RecipeWriteSerializer, ShoppingListItemSerializer, TagSerializer,
+    UserReadSerializer, get_recipes_limit
 )
 
 
+def get_batch_ids(request):
+    serializer = BatchIdsSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    return serializer.validated_data['ids']
+
+
+def batch_response(results):
+    """Ответ пакетной операции: статус по каждому id в порядке запроса."""
+    return Response({'results': [
+        {'id': pk, 'status': result} for pk, result in results.items()
+    ]})
+
+
+@method_decorator(query_budget(5), name='list')
+@method_decorator(query_budget(5), name='retrieve')
 class UserViewSet(DjoserUserViewSet):
     """Вьюсет для работы с пользователями."""
     queryset = User.objects.all()
     serializer_class = UserReadSerializer
     permission_classes = [AllowAny]
+    upload_field = 'avatar'
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        user = self.request.user
+        if self.action in ('list', 'retrieve') and user.is_authenticated:
+            queryset = queryset.annotate(is_subscribed=Exists(
+                Follow.objects.filter(user=user, author=OuterRef('pk'))
+            ))
+        return queryset
 
     @action(detail=True, methods=['post', 'delete'],
             permission_classes=[IsAuthenticated])
@@ -52,15 +100,37 @@ class UserViewSet(DjoserUserViewSet):
             status=status.HTTP_201_CREATED
         )
 
+    @action(detail=False, methods=['post', 'delete'],
+            permission_classes=[IsAuthenticated], url_path='subscribe/batch')
+    def subscribe_batch(self, request):
+        """Подписка на несколько авторов (POST) или отписка (DELETE)."""
+        ids = get_batch_ids(request)
+        with transaction.atomic():
+            if request.method == 'POST':
+                results = follow_authors(request.user, ids)
+            else:
+                results = unfollow_authors(request.user, ids)
+        return batch_response(results)
+
     @action(detail=False, methods=['get'],
             permission_classes=[IsAuthenticated])
+    @query_budget(6)
     def subscriptions(self, request):
         """Список авторов, на которых подписан текущий пользователь."""
+        recipes = Recipe.objects.all()
+        recipes_limit = get_recipes_limit(request)
+        if recipes_limit is not None:
+            recipes = recipes[:recipes_limit]
+        authors = User.objects.filter(
+            following__user=request.user
+        ).annotate(
+            is_subscribed=Value(True),
+        ).prefetch_related(
+            Prefetch('recipes', queryset=recipes, to_attr='limited_recipes')
+        )
         return self.get_paginated_response(
             AuthorSubscriptionSerializer(
-                self.paginate_queryset(
-                    User.objects.filter(following__user=request.user)
-                ),
+                self.paginate_queryset(authors),
                 many=True,
                 context={'request': request}
             ).data
@@ -70,24 +140,95 @@ class UserViewSet(DjoserUserViewSet):
         detail=False,
         methods=['put', 'delete'],
         permission_classes=[IsAuthenticated],
+        parser_classes=[JSONParser, MultiPartJSONParser, ImageUploadParser],
         url_path='me/avatar'
     )
     def avatar(self, request):
         """Обновить или удалить аватар текущего пользователя."""
         user = request.user
+        # только поле аватара: полное сохранение перезаписало бы
+        # счетчики подписок и рецептов значениями из request.user
         if request.method == 'DELETE':
-            user.avatar.delete(save=True)
+            user.avatar.delete(save=False)
+            user.save(update_fields=['avatar'])
             return Response(status=status.HTTP_204_NO_CONTENT)
 
         serializer = AvatarSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         user.avatar = serializer.validated_data['avatar']
-        user.save()
+        user.save(update_fields=['avatar'])
         return Response(
             {'avatar': user.avatar.url}, status=status.HTTP_200_OK
         )
 
 
+def catalog_cache_decorators(model):
+    """
+    Кэширование ответов справочника по его версии.
+
+    Ставит ETag и Last-Modified, отвечает 304 на условный GET
+    до обращения к сериализаторам и разрешает кэширование прокси.
+    """
+    def etag(request, *args, **kwargs):
+        version, _ = catalog.get_version(model)
+        digest = hashlib.md5(
+            f'{request.get_full_path()} {request.META.get("HTTP_ACCEPT")}'
+            .encode()
+        ).hexdigest()
+        return f'{model._meta.model_name}-{version}-{digest}'
+
+    def last_modified(request, *args, **kwargs):
+        return catalog.get_version(model)[1]
+
+    return (
+        condition(etag_func=etag, last_modified_func=last_modified),
+        cache_control(public=True, max_age=settings.CATALOG_CACHE_MAX_AGE),
+        vary_on_headers('Accept'),
+    )
+
+
+def catalog_cache(model):
+    """Декоратор вьюсета справочника с catalog_cache_decorators."""
+    def decorator(view_class):
+        for name in ('list', 'retrieve'):
+            for view_decorator in catalog_cache_decorators(model):
+                view_class = method_decorator(
+                    view_decorator, name=name
+                )(view_class)
+        return view_class
+    return decorator
+
+
+@require_safe
+def catalog_bundle(request, version=None):
+    """
+    Полный справочник тегов и ингредиентов одним сжатым файлом.
+
+    Адрес без версии перенаправляет на адрес с текущей версией,
+    который можно кэшировать навсегда.
+    """
+    bundle = catalog.bundle()
+    if version != bundle.version:
+        response = redirect(
+            reverse('catalog-bundle', kwargs={'version': bundle.version})
+        )
+        patch_cache_control(response, no_cache=True)
+        return response
+    response = HttpResponse(
+        bundle.content, content_type='application/json; charset=utf-8'
+    )
+    if 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', ''):
+        response.content = bundle.gzipped
+        response.headers['Content-Encoding'] = 'gzip'
+    response.headers['ETag'] = f'"{bundle.version}"'
+    patch_vary_headers(response, ('Accept-Encoding',))
+    patch_cache_control(response, public=True, max_age=31536000,
+                        immutable=True)
+    return response
+
+
+@catalog_cache(Tag)
+@method_decorator(query_budget(3), name='list')
 class TagViewSet(viewsets.ReadOnlyModelViewSet):
     """Вьюсет для тегов."""
     queryset = Tag.objects.all()
@@ -95,29 +236,56 @@ class TagViewSet(viewsets.ReadOnlyModelViewSet):
     pagination_class = None
 
 
+@catalog_cache(Ingredient)
+@method_decorator(query_budget(3), name='list')
 class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
-    """Вьюсет для ингредиентов с поиском."""
+    """
+    Вьюсет для ингредиентов с поиском по началу названия.
+
+    Список отдается из справочника в памяти процесса,
+    поиск ограничен настройкой INGREDIENT_SEARCH_LIMIT.
+    """
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     pagination_class = None
-    filter_backends = (DjangoFilterBackend,)
-    filterset_class = IngredientFilter
 
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get('name', '')
+        return Response(catalog.ingredients.search(
+            name, settings.INGREDIENT_SEARCH_LIMIT if name else None
+        ))
 
+
+@method_decorator(query_budget(10), name='list')
+@method_decorator(query_budget(8), name='retrieve')
 class RecipeViewSet(viewsets.ModelViewSet):
     """Вьюсет для рецептов."""
-    queryset = Recipe.objects.select_related('author').prefetch_related(
-        'tags', 'recipe_ingredients__ingredient'
+    queryset = Recipe.objects.select_related('author').order_by(
+        '-pub_date', '-id'
     )
     permission_classes = (IsAuthorOrReadOnly,)
+    parser_classes = (
+        JSONParser, FormParser, MultiPartJSONParser, ImageUploadParser
+    )
+    upload_field = 'image'
+    pagination_class = RecipePagination
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
 
+    def get_queryset(self):
+        return super().get_queryset().with_user_flags(self.request.user)
+
     def get_serializer_class(self):
         if self.action in ('create', 'update', 'partial_update'):
             return RecipeWriteSerializer
         return RecipeReadSerializer
 
+    def get_serializer_context(self):
+        return {
+            **super().get_serializer_context(),
+            'recipe_cache': self.action in ('list', 'retrieve'),
+        }
+
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
@@ -140,6 +308,16 @@ class RecipeViewSet(viewsets.ModelViewSet):
         get_object_or_404(model, user=user, recipe_id=pk).delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    def _change_list_batch(self, model, request):
+        """Добавление (POST) или удаление (DELETE) нескольких рецептов."""
+        ids = get_batch_ids(request)
+        with transaction.atomic():
+            if request.method == 'POST':
+                results = add_recipes(model, request.user, ids)
+            else:
+                results = remove_recipes(model, request.user, ids)
+        return batch_response(results)
+
     @action(detail=True, methods=['post', 'delete'],
             permission_classes=[IsAuthenticated])
     def favorite(self, request, pk=None):
@@ -154,14 +332,60 @@ class RecipeViewSet(viewsets.ModelViewSet):
             return self._add_to_list(ShoppingCart, request.user, pk)
         return self._remove_from_list(ShoppingCart, request.user, pk)
 
+    @action(detail=False, methods=['post', 'delete'],
+            permission_classes=[IsAuthenticated], url_path='favorite/batch')
+    def favorite_batch(self, request):
+        return self._change_list_batch(Favorite, request)
+
+    @action(detail=False, methods=['post', 'delete'],
+            permission_classes=[IsAuthenticated],
+            url_path='shopping_cart/batch')
+    def shopping_cart_batch(self, request):
+        return self._change_list_batch(ShoppingCart, request)
+
     @action(detail=False, methods=['get'],
             permission_classes=[IsAuthenticated])
-    def download_shopping_cart(self, request):
-        """Отдает пользователю .txt файл со списком покупок."""
-        shopping_list_text = format_shopping_list(request.user)
-        return FileResponse(
-            shopping_list_text,
-            as_attachment=True,
-            filename='shopping_list.txt',
-            content_type='text/plain'
+    @query_budget(3)
+    def shopping_list(self, request):
+        """Сводный список покупок по всем рецептам из корзины."""
+        items = ShoppingListItem.objects.filter(
+            user=request.user
+        ).select_related('ingredient').order_by(
+            'ingredient__name', 'ingredient__measurement_unit'
         )
+        return Response(ShoppingListItemSerializer(items, many=True).data)
+
+    @action(detail=False, methods=['get'],
+            permission_classes=[IsAuthenticated],
+            content_negotiation_class=ExportContentNegotiation)
+    @query_budget(6)
+    def download_shopping_cart(self, request):
+        """
+        Отдает файл со списком покупок в формате из параметра format
+        (txt, csv, json, md). Повторная выгрузка той же корзины берется
+        из кеша, а при совпадении If-None-Match возвращается 304.
+        """
+        export_format = request.query_params.get('format', 'txt')
+        if export_format not in EXPORT_FORMATS:
+            raise ValidationError({'format': [
+                'Допустимые форматы: {}.'.format(', '.join(EXPORT_FORMATS))
+            ]})
+        shopping_list = ShoppingList(request.user, export_format)
+        response = get_conditional_response(request, etag=shopping_list.etag)
+        if response is None:
+            content = shopping_list.get_cached()
+            if content is None:
+                response = StreamingHttpResponse(
+                    shopping_list.stream(),
+                    content_type=shopping_list.content_type,
+                )
+            else:
+                response = HttpResponse(
+                    content, content_type=shopping_list.content_type
+                )
+            response['Content-Disposition'] = content_disposition_header(
+                True, shopping_list.filename
+            )
+        response['ETag'] = shopping_list.etag
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
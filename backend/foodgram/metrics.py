@@ -0,0 +1,527 @@
+"""
+Метрики производительности запросов.
+
+MetricsMiddleware замеряет для каждого запроса время целиком, число
+и время запросов к базе, время кода представления без базы (в основном
+сериализация) и рендеринга ответа DRF, размер ответа. Персоналу они
+отдаются в заголовке Server-Timing, а для всех запросов складываются
+в гистограммы с метками представления (RecipeViewSet.list,
+RecipeViewSet.download_shopping_cart) и метода.
+
+Гистограммы каждого процесса фоновый поток раз в METRICS_FLUSH_SECONDS
+секунд записывает в файл <pid>-<метка запуска>.json в каталоге
+METRICS_DIR: воркер, получивший pid завершенного, пишет в свой файл
+и не затирает чужие счетчики. Эндпоинт /metrics складывает файлы всех
+воркеров gunicorn и отдает сумму в текстовом формате Prometheus,
+внешний сервис для этого не нужен. Файлы завершенных воркеров при этом
+переносятся в retired.json, чтобы счетчики не сбрасывались и каталог
+не рос. Доступ к эндпоинту — по заголовку Authorization: Bearer
+<METRICS_TOKEN> или персоналу.
+"""
+import hmac
+import json
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.core.files import locks
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.functional import SimpleLazyObject, empty
+from rest_framework.exceptions import AuthenticationFailed
+
+from api.authentication import CachedTokenAuthentication
+
+SECONDS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+QUERIES = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+BYTES = (512, 2048, 8192, 32768, 131072, 524288, 2097152, 8388608)
+HISTOGRAMS = {
+    'duration_seconds': ('Время обработки запроса', SECONDS),
+    'db_queries': ('Число запросов к базе', QUERIES),
+    'db_duration_seconds': ('Время запросов к базе', SECONDS),
+    'app_duration_seconds': (
+        'Время кода представления без базы', SECONDS
+    ),
+    'render_duration_seconds': ('Время рендеринга ответа DRF', SECONDS),
+    'response_size_bytes': ('Размер ответа', BYTES),
+}
+PREFIX = 'foodgram_http_request_'
+RETIRED = 'retired.json'
+LOCK = 'collect.lock'
+REQUESTS_TOTAL = 'foodgram_http_requests_total'
+
+
+class RequestTimings:
+    """Замеры одного запроса."""
+
+    __slots__ = ('started', 'view_started', 'view_finished', 'rendered',
+                 'queries', 'db')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.view_started = self.view_finished = self.rendered = None
+        self.queries = 0
+        self.db = 0.0
+
+
+current = ContextVar('request_timings', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    timings = current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.queries += 1
+        timings.db += time.perf_counter() - started
+
+
+def add_query_recorder(sender, connection, **kwargs):
+    # execute_wrappers живут в объекте соединения Django и переживают
+    # переподключения, поэтому обертка добавляется один раз
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def to_json(histograms, requests):
+    return {
+        'histograms': {
+            name: [[list(labels), row] for labels, row in rows.items()]
+            for name, rows in histograms.items()
+        },
+        'requests': [
+            [list(labels), count] for labels, count in requests.items()
+        ],
+    }
+
+
+class Registry:
+    """
+    Гистограммы и счетчик запросов процесса. Для гистограммы
+    по меткам хранятся [число попаданий в каждую корзину и выше
+    последней, сумма].
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.histograms = {name: {} for name in HISTOGRAMS}
+        self.requests = {}
+        self.changed = False
+        self.flusher_pid = None
+        self.instance = None
+
+    def observe(self, labels, status, values):
+        with self.lock:
+            self.changed = True
+            key = labels + (str(status),)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            for name, value in values.items():
+                if value is None:
+                    continue
+                buckets = HISTOGRAMS[name][1]
+                row = self.histograms[name].get(labels)
+                if row is None:
+                    row = self.histograms[name][labels] = (
+                        [0] * (len(buckets) + 2)
+                    )
+                row[bisect_left(buckets, value)] += 1
+                row[-1] += value
+        if self.flusher_pid != os.getpid():
+            self.start_flusher()
+
+    def start_flusher(self):
+        """
+        Поток процесса, который раз в METRICS_FLUSH_SECONDS записывает
+        изменившиеся метрики. Запускается в каждом воркере после fork.
+        """
+        with self.flush_lock:
+            if self.flusher_pid == os.getpid():
+                return
+            self.flusher_pid = os.getpid()
+        threading.Thread(
+            target=self.flush_periodically, name='metrics-flush', daemon=True
+        ).start()
+
+    def flush_periodically(self):
+        while True:
+            time.sleep(settings.METRICS_FLUSH_SECONDS)
+            if self.changed:
+                self.flush()
+
+    def dump(self):
+        with self.lock:
+            self.changed = False
+            return to_json(self.histograms, self.requests)
+
+    def file_name(self):
+        """Имя файла процесса, новое после fork."""
+        pid = os.getpid()
+        if self.instance is None or self.instance[0] != pid:
+            self.instance = (pid, uuid.uuid4().hex[:12])
+        return '{}-{}.json'.format(*self.instance)
+
+    def flush(self):
+        """Записывает метрики процесса в METRICS_DIR."""
+        with self.flush_lock:
+            os.makedirs(settings.METRICS_DIR, exist_ok=True)
+            write_json(
+                os.path.join(settings.METRICS_DIR, self.file_name()),
+                self.dump(),
+            )
+
+
+registry = Registry()
+
+
+def write_json(path, data):
+    with open(f'{path}.tmp', 'w') as file:
+        json.dump(data, file)
+    os.replace(f'{path}.tmp', path)
+
+
+def read_json(path):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def merge(histograms, requests, data):
+    """Прибавляет метрики из файла data к суммам."""
+    for metric, rows in data['histograms'].items():
+        for labels, row in rows:
+            total = histograms[metric].setdefault(
+                tuple(labels), [0] * len(row)
+            )
+            for index, value in enumerate(row):
+                total[index] += value
+    for labels, count in data['requests']:
+        requests[tuple(labels)] = requests.get(tuple(labels), 0) + count
+
+
+def is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def finished_workers(names):
+    """
+    Файлы завершенных процессов: pid не существует или у pid есть файл
+    новее (pid достался другому процессу). Проверка pid есть только
+    на POSIX: на Windows os.kill завершил бы процесс.
+    """
+    if os.name != 'posix':
+        return []
+    own = registry.file_name()
+    by_pid = {}
+    for name in names:
+        pid = name.split('-', 1)[0].removesuffix('.json')
+        if name != own and pid.isdigit():
+            by_pid.setdefault(int(pid), []).append(name)
+    finished = []
+    for pid, pid_names in by_pid.items():
+        if pid != os.getpid() and is_alive(pid):
+            # самый свежий файл pid принадлежит живому процессу
+            pid_names.sort(key=lambda name: os.path.getmtime(
+                os.path.join(settings.METRICS_DIR, name)
+            ))
+            pid_names.pop()
+        finished += pid_names
+    return finished
+
+
+def retire(names):
+    """Переносит метрики завершенных процессов в retired.json."""
+    histograms = {name: {} for name in HISTOGRAMS}
+    requests = {}
+    retired = read_json(os.path.join(settings.METRICS_DIR, RETIRED))
+    if retired is not None:
+        merge(histograms, requests, retired)
+    for name in names:
+        data = read_json(os.path.join(settings.METRICS_DIR, name))
+        if data is not None:
+            merge(histograms, requests, data)
+    write_json(
+        os.path.join(settings.METRICS_DIR, RETIRED),
+        to_json(histograms, requests),
+    )
+    for name in names:
+        os.remove(os.path.join(settings.METRICS_DIR, name))
+
+
+def collect():
+    """
+    Метрики всех процессов, сложенные по меткам. Перенос файлов
+    завершенных воркеров и чтение идут под блокировкой файла, чтобы
+    параллельный /metrics не посчитал перенесенный файл дважды.
+    """
+    registry.flush()
+    histograms = {name: {} for name in HISTOGRAMS}
+    requests = {}
+    with open(os.path.join(settings.METRICS_DIR, LOCK), 'w') as lock:
+        locks.lock(lock, locks.LOCK_EX)
+        names = [
+            name for name in os.listdir(settings.METRICS_DIR)
+            if name.endswith('.json')
+        ]
+        finished = finished_workers(set(names) - {RETIRED})
+        if finished:
+            retire(finished)
+            names = set(names) - set(finished) | {RETIRED}
+        for name in names:
+            data = read_json(os.path.join(settings.METRICS_DIR, name))
+            if data is not None:
+                merge(histograms, requests, data)
+    return histograms, requests
+
+
+def label_text(**labels):
+    return ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', r'\\').replace(
+            '"', r'\"'
+        ).replace('\n', r'\n'))
+        for name, value in labels.items()
+    )
+
+
+def render_metrics(histograms, requests):
+    """Текстовый формат Prometheus."""
+    lines = [
+        f'# HELP {REQUESTS_TOTAL} Число запросов',
+        f'# TYPE {REQUESTS_TOTAL} counter',
+    ]
+    for (view, method, status), count in sorted(requests.items()):
+        labels = label_text(view=view, method=method, status=status)
+        lines.append(f'{REQUESTS_TOTAL}{{{labels}}} {count}')
+    for name, (help_text, buckets) in HISTOGRAMS.items():
+        metric = PREFIX + name
+        lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} histogram']
+        for (view, method), row in sorted(histograms[name].items()):
+            labels = label_text(view=view, method=method)
+            cumulative = 0
+            for bound, count in zip(buckets + ('+Inf',), row):
+                cumulative += count
+                lines.append(
+                    f'{metric}_bucket{{{labels},le="{bound}"}} {cumulative}'
+                )
+            lines.append(f'{metric}_sum{{{labels}}} {row[-1]}')
+            lines.append(f'{metric}_count{{{labels}}} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+def view_name(request):
+    """
+    Метка представления: Класс.действие для DRF, иначе имя маршрута
+    или функции.
+    """
+    match = request.resolver_match
+    if match is None:
+        return 'unmatched'
+    view_class = getattr(match.func, 'cls', None)
+    if view_class is not None:
+        method = request.method.lower()
+        actions = getattr(match.func, 'actions', None) or {}
+        return f'{view_class.__name__}.{actions.get(method, method)}'
+    return match.view_name if match.url_name else match.func.__name__
+
+
+def is_staff(request):
+    """
+    Персонал ли пользователь, которого определило представление.
+    Ленивый пользователь сессии не вычисляется: это лишний запрос
+    к базе, а в асинхронном режиме — синхронный вызов ORM.
+    """
+    user = getattr(request, 'user', None)
+    if isinstance(user, SimpleLazyObject) and user._wrapped is empty:
+        return False
+    return bool(user is not None and user.is_staff)
+
+
+def server_timing(timings, total, app, render):
+    parts = [
+        f'total;dur={total * 1000:.1f}',
+        f'db;dur={timings.db * 1000:.1f};desc="{timings.queries} queries"',
+    ]
+    if app is not None:
+        parts.append(f'app;dur={app * 1000:.1f}')
+    if render is not None:
+        parts.append(f'render;dur={render * 1000:.1f}')
+    return ', '.join(parts)
+
+
+def durations(timings):
+    """Время запроса целиком, кода представления и рендеринга."""
+    finished = time.perf_counter()
+    app = render = None
+    if timings.view_started is not None:
+        app = max(
+            (timings.view_finished or finished)
+            - timings.view_started - timings.db, 0.0
+        )
+    if timings.rendered is not None:
+        render = timings.rendered - timings.view_finished
+    return finished - timings.started, app, render
+
+
+def observe(request, response, timings, size):
+    total, app, render = durations(timings)
+    registry.observe(
+        (view_name(request), request.method), response.status_code, {
+            'duration_seconds': total,
+            'db_queries': timings.queries,
+            'db_duration_seconds': timings.db,
+            'app_duration_seconds': app,
+            'render_duration_seconds': render,
+            'response_size_bytes': size,
+        }
+    )
+
+
+def stream_measured(content, timings, done):
+    """Части потокового ответа с замером запросов к базе и размера."""
+    size = 0
+    token = current.set(timings)
+    try:
+        for chunk in content:
+            size += len(chunk)
+            yield chunk
+    finally:
+        current.reset(token)
+    done(size)
+
+
+class MetricsMiddleware:
+    """
+    Замеряет запрос. Хуки process_view и process_template_response
+    выбираются под режим работы, чтобы под ASGI Django не переключался
+    ради них в поток.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+            self.process_view = self.aprocess_view
+            self.process_template_response = self.aprocess_template_response
+        connection_created.connect(add_query_recorder)
+        for connection in connections.all(initialized_only=True):
+            add_query_recorder(None, connection)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        timings = RequestTimings()
+        token = current.set(timings)
+        try:
+            response = self.get_response(request)
+        finally:
+            current.reset(token)
+        return self.finish(request, response, timings)
+
+    async def __acall__(self, request):
+        timings = RequestTimings()
+        token = current.set(timings)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current.reset(token)
+        return self.finish(request, response, timings)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        self.view_started()
+
+    async def aprocess_view(self, request, view_func, view_args,
+                            view_kwargs):
+        self.view_started()
+
+    def process_template_response(self, request, response):
+        return self.view_finished(response)
+
+    async def aprocess_template_response(self, request, response):
+        return self.view_finished(response)
+
+    def view_started(self):
+        timings = current.get()
+        if timings is not None:
+            timings.view_started = time.perf_counter()
+
+    def view_finished(self, response):
+        timings = current.get()
+        if timings is not None:
+            timings.view_finished = time.perf_counter()
+            response.add_post_render_callback(
+                lambda rendered: setattr(
+                    timings, 'rendered', time.perf_counter()
+                )
+            )
+        return response
+
+    def finish(self, request, response, timings):
+        """
+        Записывает замеры запроса. Потоковый ответ выполняет запросы
+        к базе и отдает данные уже после выхода из представления,
+        поэтому его замеры продолжаются в итераторе и записываются
+        после последней части. Server-Timing уходит в заголовках
+        раньше тела и для него содержит время до начала отдачи.
+        """
+        if response.streaming and not response.is_async:
+            response.streaming_content = stream_measured(
+                response.streaming_content, timings,
+                lambda size: observe(request, response, timings, size),
+            )
+        else:
+            size = None
+            if not response.streaming:
+                size = len(response.content)
+            elif response.has_header('Content-Length'):
+                size = int(response['Content-Length'])
+            observe(request, response, timings, size)
+        if is_staff(request):
+            response['Server-Timing'] = server_timing(
+                timings, *durations(timings)
+            )
+        return response
+
+
+def can_read_metrics(request):
+    header = request.headers.get('Authorization', '')
+    if settings.METRICS_TOKEN and hmac.compare_digest(
+        header, f'Bearer {settings.METRICS_TOKEN}'
+    ):
+        return True
+    if request.user.is_staff:
+        return True
+    try:
+        authenticated = CachedTokenAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        return False
+    return authenticated is not None and authenticated[0].is_staff
+
+
+def metrics_view(request):
+    """Метрики всех воркеров в текстовом формате Prometheus."""
+    if not can_read_metrics(request):
+        return HttpResponseForbidden()
+    return HttpResponse(
+        render_metrics(*collect()),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
@@ -0,0 +1,94 @@
+"""
+Бэкенд PostgreSQL с пулом соединений на процесс.
+
+Вместо открытия соединения на каждый запрос Django берет его из пула,
+а при закрытии возвращает обратно. Пул создается в каждом воркере
+после fork, отдельный на каждый набор параметров подключения, по
+настройке POOL базы: min_size и max_size — границы числа соединений
+воркера, timeout — сколько ждать свободного соединения, max_lifetime —
+после скольких секунд соединение закрывается при возврате, check_idle —
+после скольких секунд простоя оно проверяется перед выдачей.
+"""
+import os
+import threading
+from functools import partial
+
+from django.db.backends.postgresql import base, creation
+from django.db.backends.postgresql.psycopg_any import IsolationLevel
+
+from .pool import ConnectionPool
+
+pools = {}
+pools_lock = threading.Lock()
+
+
+def get_pool(key, options):
+    pool = pools.get(key)
+    if pool is None or pool.pid != os.getpid():
+        with pools_lock:
+            pool = pools.get(key)
+            if pool is None or pool.pid != os.getpid():
+                pool = pools[key] = ConnectionPool(**options)
+    return pool
+
+
+def drain_pools():
+    """Закрывает свободные соединения всех пулов процесса."""
+    for pool in list(pools.values()):
+        pool.drain()
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+    """
+    Тестовую базу нельзя удалить или скопировать, пока к ней есть
+    подключения, поэтому свободные соединения пулов сначала закрываются.
+    """
+
+    def _destroy_test_db(self, test_database_name, verbosity):
+        drain_pools()
+        super()._destroy_test_db(test_database_name, verbosity)
+
+    def _clone_test_db(self, suffix, verbosity, keepdb=False):
+        drain_pools()
+        super()._clone_test_db(suffix, verbosity, keepdb)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+    pooled = True
+    connection_pool = None
+
+    def get_pool(self, conn_params):
+        key = (self.alias, tuple(sorted(
+            (name, str(value)) for name, value in conn_params.items()
+        )))
+        return get_pool(key, self.settings_dict.get('POOL', {}))
+
+    def open_connection(self, conn_params):
+        return super().get_new_connection(conn_params)
+
+    def get_new_connection(self, conn_params):
+        # у соединений из пула уровень изоляции уже выставлен
+        # при создании, здесь он только запоминается как в базовом методе
+        self.isolation_level = IsolationLevel(self.settings_dict[
+            'OPTIONS'
+        ].get('isolation_level', IsolationLevel.READ_COMMITTED))
+        self.connection_pool = self.get_pool(conn_params)
+        return self.connection_pool.acquire(
+            partial(self.open_connection, conn_params)
+        )
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self.connection_pool.release(
+                    self.connection, check=self.errors_occurred
+                )
+
+    def warm_pool(self):
+        """Открывает min_size соединений пула заранее."""
+        conn_params = self.get_connection_params()
+        with self.wrap_database_errors:
+            self.get_pool(conn_params).warm(
+                partial(self.open_connection, conn_params)
+            )
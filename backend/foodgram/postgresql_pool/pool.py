@@ -0,0 +1,138 @@
+"""
+Пул соединений psycopg2 одного процесса.
+
+Свободные соединения выдаются в порядке LIFO: чаще используются
+недавно возвращенные, а лишние дольше простаивают и закрываются
+по max_lifetime. Число выданных и свободных соединений вместе
+не превышает max_size; если все заняты, acquire ждет timeout секунд.
+"""
+import os
+import select
+import threading
+import time
+from collections import deque
+
+from psycopg2 import Error, OperationalError
+from psycopg2.extensions import (TRANSACTION_STATUS_IDLE,
+                                 TRANSACTION_STATUS_UNKNOWN)
+
+
+def has_input(connection):
+    """
+    Пришли ли данные в простаивающее соединение. Так выглядят
+    завершение backend-процесса сервером и закрытие сокета.
+    """
+    readable, _, _ = select.select([connection.fileno()], [], [], 0)
+    return bool(readable)
+
+
+def reset(connection, ping=False):
+    """
+    Готовит соединение к повторной выдаче: откатывает незавершенную
+    транзакцию, при ping или пришедших данных проверяет его запросом.
+    False — соединение сломано.
+    """
+    if connection.closed:
+        return False
+    if connection.info.transaction_status == TRANSACTION_STATUS_UNKNOWN:
+        return False
+    try:
+        if ping or has_input(connection):
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+        if connection.info.transaction_status != TRANSACTION_STATUS_IDLE:
+            connection.rollback()
+    except Error:
+        return False
+    return True
+
+
+class ConnectionPool:
+
+    def __init__(self, min_size=1, max_size=10, timeout=10.0,
+                 max_lifetime=1800.0, check_idle=10.0):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.check_idle = check_idle
+        self.pid = os.getpid()
+        self.idle = deque()
+        self.created = {}
+        self.slots = threading.BoundedSemaphore(max_size)
+        self.lock = threading.Lock()
+
+    def new(self, connect):
+        connection = connect()
+        self.created[id(connection)] = time.monotonic()
+        return connection
+
+    def discard(self, connection):
+        self.created.pop(id(connection), None)
+        try:
+            connection.close()
+        except Error:
+            pass
+
+    def acquire(self, connect):
+        """Свободное соединение или новое, открытое функцией connect."""
+        if not self.slots.acquire(timeout=self.timeout):
+            raise OperationalError(
+                f'Все {self.max_size} соединений пула заняты дольше '
+                f'{self.timeout} с.'
+            )
+        try:
+            while True:
+                with self.lock:
+                    entry = self.idle.pop() if self.idle else None
+                if entry is None:
+                    return self.new(connect)
+                connection, released = entry
+                # простоявшее соединение мог закрыть сервер или прокси
+                if reset(
+                    connection,
+                    ping=time.monotonic() - released >= self.check_idle,
+                ):
+                    return connection
+                self.discard(connection)
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def release(self, connection, check=False):
+        """
+        Возвращает соединение в пул. Сломанные, с незавершенной
+        транзакцией, которую не удалось откатить, и старше max_lifetime
+        закрываются. check — проверить соединение запросом (после ошибок).
+        """
+        try:
+            created = self.created.get(id(connection), 0)
+            if (
+                time.monotonic() - created > self.max_lifetime
+                or not reset(connection, ping=check)
+            ):
+                self.discard(connection)
+                return
+            with self.lock:
+                self.idle.append((connection, time.monotonic()))
+        finally:
+            self.slots.release()
+
+    def warm(self, connect):
+        """Открывает соединения до min_size свободных."""
+        for _ in range(self.min_size - len(self.idle)):
+            if not self.slots.acquire(blocking=False):
+                return
+            try:
+                connection = self.new(connect)
+            except BaseException:
+                self.slots.release()
+                raise
+            self.release(connection)
+
+    def drain(self):
+        """Закрывает свободные соединения."""
+        with self.lock:
+            idle, self.idle = self.idle, deque()
+        for connection, _ in idle:
+            self.discard(connection)
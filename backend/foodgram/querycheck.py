@@ -0,0 +1,232 @@
+"""
+Проверка формы запросов к базе для разработки и тестов.
+
+Включается настройкой QUERY_CHECK: warn — предупреждения
+QueryCheckWarning, raise — исключение QueryCheckError, которое роняет
+тест. В рабочем окружении проверка выключена и ничего не стоит.
+
+querycheck_middleware приводит SQL каждого запроса к отпечатку
+(литералы и списки параметров заменяются) и сообщает об отпечатках,
+которые повторились в одном HTTP-запросе больше QUERY_REPEAT_LIMIT раз,
+— признаке N+1 — вместе со стеком вызова кода проекта, который сделал
+лишний запрос. Декоратор query_budget задает представлению или
+действию вьюсета предел числа запросов. Запросы потокового ответа
+(выгрузка списка покупок) учитываются при отдаче его частей.
+
+Тесты (foodgram/test_runner.py) идут с QUERY_CHECK=raise.
+"""
+import re
+import traceback
+import warnings
+from contextvars import ContextVar
+from functools import partial, wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.utils.decorators import sync_and_async_middleware
+
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+PARAMETER_LISTS = re.compile(r'\((?:\s*(?:%s|\?)\s*,)*\s*(?:%s|\?)\s*\)')
+STACK_DEPTH = 8
+
+active_logs = ContextVar('query_logs', default=())
+
+
+class QueryCheckError(AssertionError):
+    """Запросы к базе превысили предел."""
+
+
+class QueryCheckWarning(UserWarning):
+    """Запросы к базе превысили предел (режим warn)."""
+
+
+def fingerprint(sql):
+    """SQL без литералов: одинаков у запросов, отличающихся значениями."""
+    sql = LITERALS.sub('?', sql)
+    sql = PARAMETER_LISTS.sub('(...)', sql)
+    return ' '.join(sql.split())
+
+
+def project_stack():
+    """Кадры стека из кода проекта, без библиотек и этого модуля."""
+    base = str(settings.BASE_DIR)
+    return ''.join(traceback.format_list([
+        frame for frame in traceback.extract_stack()
+        if frame.filename.startswith(base)
+        and 'site-packages' not in frame.filename
+        and frame.filename != __file__
+    ][-STACK_DEPTH:]))
+
+
+class QueryLog:
+    """Запросы, сделанные за время записи, по отпечаткам."""
+
+    def __init__(self, repeat_limit=None):
+        self.repeat_limit = repeat_limit
+        self.total = 0
+        self.counts = {}
+        self.stacks = {}
+
+    def add(self, sql):
+        self.total += 1
+        key = fingerprint(sql)
+        count = self.counts[key] = self.counts.get(key, 0) + 1
+        if count == (self.repeat_limit or 0) + 1:
+            # стек нужен только первому лишнему повтору
+            self.stacks[key] = project_stack()
+
+    def repeated(self):
+        return {
+            key: count for key, count in self.counts.items()
+            if self.repeat_limit is not None and count > self.repeat_limit
+        }
+
+    def start(self):
+        install()
+        return active_logs.set(active_logs.get() + (self,))
+
+    def stop(self, token):
+        active_logs.reset(token)
+
+
+def log_query(execute, sql, params, many, context):
+    for log in active_logs.get():
+        log.add(sql)
+    return execute(sql, params, many, context)
+
+
+def add_query_logger(sender, connection, **kwargs):
+    if log_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(log_query)
+
+
+def install():
+    """
+    Подключает запись запросов ко всем соединениям: уже открытым
+    в этом потоке и всем, которые откроются потом.
+    """
+    connection_created.connect(add_query_logger)
+    for connection in connections.all(initialized_only=True):
+        add_query_logger(None, connection)
+
+
+def report(message):
+    if settings.QUERY_CHECK == 'raise':
+        raise QueryCheckError(message)
+    warnings.warn(message, QueryCheckWarning, stacklevel=3)
+
+
+def check_repeats(log, where):
+    for key, count in log.repeated().items():
+        report(
+            f'{where}: запрос повторился {count} раз (N+1?):\n'
+            f'{key}\n{log.stacks[key]}'
+        )
+
+
+def stream_logged(content, log, check):
+    token = log.start()
+    try:
+        yield from content
+    finally:
+        log.stop(token)
+    check(log)
+
+
+def checked(response, log, check):
+    """
+    Проверяет лог после ответа. Запросы потокового ответа выполняются
+    уже после выхода из представления, при отдаче частей, поэтому для
+    него запись продолжается в итераторе и проверка идет после
+    последней части.
+    """
+    if getattr(response, 'streaming', False) and not response.is_async:
+        response.streaming_content = stream_logged(
+            response.streaming_content, log, check
+        )
+    else:
+        check(log)
+    return response
+
+
+def query_budget(limit):
+    """
+    Предел числа запросов к базе за вызов представления или действия
+    вьюсета. Проверяется, только если включен QUERY_CHECK.
+    """
+    def decorator(func):
+        def check(log):
+            if log.total > limit:
+                repeated = ''.join(
+                    f'\n{count} × {key}'
+                    for key, count in sorted(
+                        log.counts.items(), key=lambda item: -item[1]
+                    )
+                )
+                report(
+                    f'{func.__qualname__}: {log.total} запросов к базе '
+                    f'при пределе {limit}:{repeated}'
+                )
+
+        if iscoroutinefunction(func):
+            @wraps(func)
+            async def wrapper(*args, **kwargs):
+                if not settings.QUERY_CHECK:
+                    return await func(*args, **kwargs)
+                log = QueryLog()
+                token = log.start()
+                try:
+                    result = await func(*args, **kwargs)
+                finally:
+                    log.stop(token)
+                return checked(result, log, check)
+            return wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not settings.QUERY_CHECK:
+                return func(*args, **kwargs)
+            log = QueryLog()
+            token = log.start()
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                log.stop(token)
+            return checked(result, log, check)
+        return wrapper
+    return decorator
+
+
+@sync_and_async_middleware
+def querycheck_middleware(get_response):
+    """Ищет повторяющиеся запросы в каждом HTTP-запросе."""
+    if not settings.QUERY_CHECK:
+        raise MiddlewareNotUsed
+
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            log = QueryLog(settings.QUERY_REPEAT_LIMIT)
+            token = log.start()
+            try:
+                response = await get_response(request)
+            finally:
+                log.stop(token)
+            return checked(response, log, partial(
+                check_repeats, where=f'{request.method} {request.path}'
+            ))
+        return middleware
+
+    def middleware(request):
+        log = QueryLog(settings.QUERY_REPEAT_LIMIT)
+        token = log.start()
+        try:
+            response = get_response(request)
+        finally:
+            log.stop(token)
+        return checked(response, log, partial(
+            check_repeats, where=f'{request.method} {request.path}'
+        ))
+    return middleware
@@ -0,0 +1,130 @@
+"""
+Чтение с реплик базы.
+
+ReplicaRouter отправляет запись в основную базу default, а чтение —
+в базу, выбранную для текущего запроса. replica_middleware выбирает
+для безопасных запросов (GET, HEAD, OPTIONS) случайную реплику из
+DATABASE_REPLICAS, для остальных — основную базу. Вне HTTP-запросов
+(команды, прогрев, фоновые потоки) чтение тоже идет в основную базу.
+
+Реплики отстают от основной базы, поэтому после записи пользователь
+REPLICA_STICKY_SECONDS секунд читает из основной и видит свои
+изменения. Метка ставится в подписанную cookie и в кэш по токену:
+cookie работает для браузера, метка в кэше — для клиентов API без
+cookie, если кэш общий для воркеров.
+"""
+import hashlib
+import random
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.decorators import sync_and_async_middleware
+
+PRIMARY_COOKIE = 'use_primary'
+PRIMARY_COOKIE_SALT = 'foodgram.replicas'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# ContextVar, а не threading.local: выбор базы должен переходить вместе
+# с запросом в потоки sync_to_async и пула асинхронных представлений
+read_database = ContextVar('read_database', default=DEFAULT_DB_ALIAS)
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        return read_database.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # реплики содержат те же данные, что и основная база
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        # схема реплик приходит из основной базы репликацией
+        return db == DEFAULT_DB_ALIAS
+
+
+def primary_marker_key(request):
+    """Ключ метки в кэше по токену из заголовка Authorization."""
+    header = request.headers.get('Authorization', '').split()
+    if len(header) != 2 or header[0].lower() != 'token':
+        return None
+    return 'use-primary:' + hashlib.sha256(header[1].encode()).hexdigest()
+
+
+def has_primary_cookie(request):
+    return PRIMARY_COOKIE in request.COOKIES and request.get_signed_cookie(
+        PRIMARY_COOKIE, default=None, salt=PRIMARY_COOKIE_SALT,
+        max_age=settings.REPLICA_STICKY_SECONDS,
+    ) is not None
+
+
+def set_primary_cookie(request, response):
+    response.set_signed_cookie(
+        PRIMARY_COOKIE, '1', salt=PRIMARY_COOKIE_SALT,
+        max_age=settings.REPLICA_STICKY_SECONDS,
+        secure=request.is_secure(), httponly=True, samesite='Lax',
+    )
+
+
+def choose_database(request, marked):
+    """
+    База для чтения в запросе: основная для записи и после нее
+    (marked — метка из кэша), иначе случайная реплика.
+    """
+    if (
+        request.method not in SAFE_METHODS
+        or marked or has_primary_cookie(request)
+    ):
+        return DEFAULT_DB_ALIAS
+    return random.choice(settings.DATABASE_REPLICAS)
+
+
+@sync_and_async_middleware
+def replica_middleware(get_response):
+    """
+    Выбирает базу для чтения на время запроса и помечает пользователя
+    после записи. Подключается, только если настроены реплики.
+    """
+    if not settings.DATABASE_REPLICAS:
+        raise MiddlewareNotUsed
+    timeout = settings.REPLICA_STICKY_SECONDS
+
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            key = primary_marker_key(request)
+            write = request.method not in SAFE_METHODS
+            marked = bool(key) and not write and await cache.aget(key)
+            token = read_database.set(choose_database(request, marked))
+            try:
+                response = await get_response(request)
+            finally:
+                read_database.reset(token)
+            if write:
+                set_primary_cookie(request, response)
+                if key:
+                    await cache.aset(key, True, timeout)
+            return response
+        return middleware
+
+    def middleware(request):
+        key = primary_marker_key(request)
+        write = request.method not in SAFE_METHODS
+        marked = bool(key) and not write and cache.get(key)
+        token = read_database.set(choose_database(request, marked))
+        try:
+            response = get_response(request)
+        finally:
+            read_database.reset(token)
+        if write:
+            set_primary_cookie(request, response)
+            if key:
+                cache.set(key, True, timeout)
+        return response
+    return middleware
@@ -1,4 +1,5 @@
 import os
+import tempfile
 from pathlib import Path
 
 from dotenv import load_dotenv
@@ -21,6 +22,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework.authtoken',
     'djoser',
@@ -31,7 +33,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'foodgram.metrics.MetricsMiddleware',
+    'foodgram.querycheck.querycheck_middleware',
     'django.middleware.security.SecurityMiddleware',
+    'foodgram.replicas.replica_middleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -53,7 +58,7 @@ ROOT_URLCONF = 'foodgram.urls'
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
-        'DIRS': [os.path.join(BASE_DIR, 'api/templates')],
+        'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
@@ -83,8 +88,89 @@ else:
             'PASSWORD': os.getenv('POSTGRES_PASSWORD'),
             'HOST': os.getenv('DB_HOST'),
             'PORT': os.getenv('DB_PORT'),
+            'CONN_HEALTH_CHECKS': True,
         }
     }
+    if os.getenv('DB_POOL', 'True').lower() == 'true':
+        # пул соединений на воркер (foodgram/postgresql_pool); соединение
+        # возвращается в пул в конце запроса, поэтому CONN_MAX_AGE=0.
+        # Всего соединений: WEB_CONCURRENCY * DB_POOL_MAX_SIZE
+        DATABASES['default'].update({
+            'ENGINE': 'foodgram.postgresql_pool',
+            'CONN_MAX_AGE': 0,
+            'POOL': {
+                'min_size': int(os.getenv('DB_POOL_MIN_SIZE', 2)),
+                'max_size': int(os.getenv('DB_POOL_MAX_SIZE', 10)),
+                'timeout': float(os.getenv('DB_POOL_TIMEOUT', 10)),
+                'max_lifetime': float(
+                    os.getenv('DB_POOL_MAX_LIFETIME', 30 * 60)
+                ),
+                'check_idle': float(os.getenv('DB_POOL_CHECK_IDLE', 10)),
+            },
+        })
+    else:
+        DATABASES['default']['CONN_MAX_AGE'] = int(
+            os.getenv('CONN_MAX_AGE', 60)
+        )
+
+# реплики для чтения: файлы SQLite или host[:port] серверов PostgreSQL
+# через запятую; остальные настройки подключения как у основной базы
+for number, replica in enumerate(
+    filter(None, os.getenv('DB_REPLICAS', '').split(',')), start=1
+):
+    DATABASES[f'replica_{number}'] = {
+        **DATABASES['default'],
+        'TEST': {'MIRROR': 'default'},
+    }
+    if 'sqlite3' in DATABASES['default']['ENGINE']:
+        DATABASES[f'replica_{number}']['NAME'] = BASE_DIR / replica.strip()
+    else:
+        host, _, port = replica.strip().partition(':')
+        DATABASES[f'replica_{number}'].update(
+            HOST=host, PORT=port or DATABASES['default']['PORT']
+        )
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+if DATABASE_REPLICAS:
+    DATABASE_ROUTERS = ['foodgram.replicas.ReplicaRouter']
+# сколько секунд после записи пользователь читает из основной базы
+REPLICA_STICKY_SECONDS = int(os.getenv('REPLICA_STICKY_SECONDS', 10))
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+# отзыв токена сбрасывает кэш только в своем воркере, если кэш
+# локальный, поэтому с ним запись живет несколько секунд
+TOKEN_CACHE_TIMEOUT = int(os.getenv(
+    'TOKEN_CACHE_TIMEOUT',
+    5 if 'locmem' in CACHES['default']['BACKEND'] else 60
+))
+# проверка запросов к базе (foodgram/querycheck.py): warn или raise;
+# по умолчанию предупреждения при DEBUG
+QUERY_CHECK = os.getenv('QUERY_CHECK', 'warn' if DEBUG else '').lower()
+QUERY_REPEAT_LIMIT = int(os.getenv('QUERY_REPEAT_LIMIT', 3))
+# метрики запросов: каталог, общий для воркеров, и токен Prometheus
+METRICS_DIR = os.getenv(
+    'METRICS_DIR', os.path.join(tempfile.gettempdir(), 'foodgram-metrics')
+)
+METRICS_FLUSH_SECONDS = float(os.getenv('METRICS_FLUSH_SECONDS', 5))
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+RECIPE_CACHE_TIMEOUT = int(os.getenv('RECIPE_CACHE_TIMEOUT', 24 * 60 * 60))
+MAX_IMAGE_SIZE = int(os.getenv('MAX_IMAGE_SIZE', 10 * 1024 * 1024))
+MAX_IMAGE_PIXELS = int(os.getenv('MAX_IMAGE_PIXELS', 40_000_000))
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', 2))
+IMAGE_WEBP_QUALITY = int(os.getenv('IMAGE_WEBP_QUALITY', 80))
+
+SHOPPING_LIST_CACHE_TIMEOUT = int(
+    os.getenv('SHOPPING_LIST_CACHE_TIMEOUT', 24 * 60 * 60)
+)
+SHOPPING_LIST_CACHE_MAX_SIZE = int(
+    os.getenv('SHOPPING_LIST_CACHE_MAX_SIZE', 1024 * 1024)
+)
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -123,6 +209,9 @@ STATIC_ROOT = BASE_DIR / 'collected_static'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# тесты пишут файлы во временный MEDIA_ROOT (foodgram/test_runner.py)
+TEST_RUNNER = 'foodgram.test_runner.TestRunner'
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 AUTH_USER_MODEL = 'recipes.User'
 
@@ -131,13 +220,22 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
-    'DEFAULT_PAGINATION_CLASS': (
-        'rest_framework.pagination.PageNumberPagination'
-    ),
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.LimitPageNumberPagination',
     'PAGE_SIZE': 6
 }
+MAX_PAGE_SIZE = int(os.getenv('MAX_PAGE_SIZE', 100))
+BATCH_MAX_IDS = int(os.getenv('BATCH_MAX_IDS', 100))
+
+INGREDIENT_SEARCH_LIMIT = int(os.getenv('INGREDIENT_SEARCH_LIMIT', 50))
+CATALOG_CACHE_MAX_AGE = int(os.getenv('CATALOG_CACHE_MAX_AGE', 300))
+
+# асинхронные представления для ленты, рецептов и поиска ингредиентов;
+# включаются при запуске через ASGI (gunicorn.conf.py)
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', 'False').lower() == 'true'
+# потоков для синхронного кода асинхронных представлений на процесс
+ASYNC_SYNC_THREADS = int(os.getenv('ASYNC_SYNC_THREADS', 8))
 
 DJOSER = {
     'PASSWORD_RESET_CONFIRM_URL': '#/password/reset/confirm/{uid}/{token}',
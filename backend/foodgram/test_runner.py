@@ -0,0 +1,27 @@
+import shutil
+import tempfile
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Прогон тестов с временным MEDIA_ROOT: загруженные картинки и их
+    варианты не попадают в media/ проекта и удаляются после прогона.
+    Проверка запросов к базе (foodgram/querycheck.py) включена в режиме
+    raise: N+1 и превышение query_budget роняют тест.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.media_root = tempfile.mkdtemp(prefix='foodgram-test-media-')
+        self.test_settings = override_settings(
+            MEDIA_ROOT=self.media_root, QUERY_CHECK='raise'
+        )
+        self.test_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.test_settings.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
@@ -0,0 +1,79 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from unittest import mock
+
+from django.http import StreamingHttpResponse
+from django.test import (RequestFactory, SimpleTestCase, TestCase,
+                         override_settings)
+
+from foodgram.metrics import RETIRED, MetricsMiddleware, collect, registry
+from recipes.models import Tag
+
+
+def worker_data(count):
+    return {
+        'histograms': {},
+        'requests': [[['RecipeViewSet.list', 'GET', '200'], count]],
+    }
+
+
+def finished_pid():
+    process = subprocess.Popen([sys.executable, '-c', ''])
+    process.wait()
+    return process.pid
+
+
+class CollectTests(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='foodgram-test-metrics-')
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        settings = override_settings(METRICS_DIR=self.directory)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def write(self, name, count):
+        with open(os.path.join(self.directory, name), 'w') as file:
+            json.dump(worker_data(count), file)
+
+    def requests_total(self):
+        _, requests = collect()
+        return requests.get(('RecipeViewSet.list', 'GET', '200'), 0)
+
+    def test_finished_workers_are_retired_once(self):
+        self.write(f'{finished_pid()}-old.json', 3)
+        # файл прошлого процесса с тем же pid, что у текущего
+        self.write(f'{os.getpid()}-previous.json', 2)
+        self.assertEqual(self.requests_total(), 5)
+        self.assertEqual(
+            sorted(os.listdir(self.directory)),
+            sorted([RETIRED, registry.file_name(), 'collect.lock']),
+        )
+        self.assertEqual(self.requests_total(), 5)
+        self.write(f'{finished_pid()}-other.json', 1)
+        self.assertEqual(self.requests_total(), 6)
+
+
+class MetricsMiddlewareTests(TestCase):
+
+    def test_streaming_response_is_measured_to_the_last_chunk(self):
+        def content():
+            yield b'tags: '
+            yield str(Tag.objects.count()).encode()
+
+        middleware = MetricsMiddleware(
+            lambda request: StreamingHttpResponse(content())
+        )
+        with mock.patch.object(registry, 'observe') as observe:
+            response = middleware(RequestFactory().get('/stream/'))
+            observe.assert_not_called()
+            self.assertEqual(b''.join(response.streaming_content), b'tags: 0')
+        _, status, values = observe.call_args.args
+        self.assertEqual(status, 200)
+        self.assertEqual(values['db_queries'], 1)
+        self.assertGreater(values['db_duration_seconds'], 0)
+        self.assertEqual(values['response_size_bytes'], 7)
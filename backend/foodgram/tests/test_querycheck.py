@@ -0,0 +1,73 @@
+from django.contrib.auth import get_user_model
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+
+from foodgram.querycheck import (QueryCheckError, fingerprint, query_budget,
+                                 querycheck_middleware)
+
+User = get_user_model()
+
+
+def read_users(count):
+    for pk in range(count):
+        list(User.objects.filter(pk=pk + 1))
+
+
+class FingerprintTests(TestCase):
+
+    def test_literals_are_replaced(self):
+        self.assertEqual(
+            fingerprint("SELECT * FROM t WHERE id = 12 AND name = 'it''s'"),
+            'SELECT * FROM t WHERE id = ? AND name = ?',
+        )
+
+    def test_parameter_lists_are_collapsed(self):
+        self.assertEqual(
+            fingerprint('SELECT * FROM t WHERE id IN (%s, %s, %s)'),
+            fingerprint('SELECT * FROM t WHERE id IN (%s)'),
+        )
+        self.assertEqual(
+            fingerprint('SELECT * FROM t WHERE id IN (1, 2, 3)'),
+            'SELECT * FROM t WHERE id IN (...)',
+        )
+
+
+@override_settings(QUERY_CHECK='raise', QUERY_REPEAT_LIMIT=3)
+class QueryCheckTests(TestCase):
+
+    def test_repeated_query_raises(self):
+        def view(request):
+            read_users(4)
+            return HttpResponse()
+
+        middleware = querycheck_middleware(view)
+        with self.assertRaises(QueryCheckError):
+            middleware(RequestFactory().get('/'))
+
+    def test_repeats_under_limit_pass(self):
+        def view(request):
+            read_users(3)
+            return HttpResponse()
+
+        querycheck_middleware(view)(RequestFactory().get('/'))
+
+    def test_budget_raises_over_limit(self):
+        @query_budget(1)
+        def view():
+            read_users(2)
+
+        with self.assertRaises(QueryCheckError):
+            view()
+
+    def test_budget_counts_streaming_content(self):
+        def content():
+            read_users(2)
+            yield b''
+
+        @query_budget(1)
+        def view():
+            return StreamingHttpResponse(content())
+
+        response = view()
+        with self.assertRaises(QueryCheckError):
+            b''.join(response.streaming_content)
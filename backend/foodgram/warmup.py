@@ -0,0 +1,16 @@
+from django.db import connections
+
+from recipes.catalog import catalog
+
+
+def warm_up():
+    """
+    Прогрев воркера до приема запросов: открывает соединения пулов
+    и загружает справочники в память процесса, чтобы первые запросы
+    не платили за подключение к базе и сборку индексов.
+    """
+    for connection in connections.all():
+        if getattr(connection, 'pooled', False):
+            connection.warm_pool()
+    catalog.bundle()
+    connections.close_all()
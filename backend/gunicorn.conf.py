@@ -0,0 +1,51 @@
+"""
+Настройки gunicorn.
+
+По умолчанию приложение работает через WSGI на синхронных воркерах.
+С ASYNC_VIEWS=true оно запускается через ASGI на воркерах uvicorn:
+лента, рецепты и поиск ингредиентов обслуживаются асинхронными
+представлениями, синхронный код — в пуле из ASYNC_SYNC_THREADS
+потоков на воркер. Число воркеров задается WEB_CONCURRENCY.
+
+Перед приемом запросов воркер открывает соединения пула и загружает
+справочники (foodgram.warmup). Метрики запросов воркеры пишут в общий
+каталог METRICS_DIR (foodgram.metrics), при старте сервера он очищается,
+при остановке воркер дописывает в него свои метрики.
+"""
+import os
+import shutil
+
+bind = os.getenv('GUNICORN_BIND', '0:8000')
+
+if os.getenv('ASYNC_VIEWS', 'False').lower() == 'true':
+    wsgi_app = 'foodgram.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    wsgi_app = 'foodgram.wsgi:application'
+
+
+def on_starting(server):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
+    from django.conf import settings
+
+    shutil.rmtree(settings.METRICS_DIR, ignore_errors=True)
+
+
+def post_worker_init(worker):
+    from django.db import DatabaseError
+
+    from foodgram.warmup import warm_up
+
+    try:
+        warm_up()
+    except DatabaseError as error:
+        # воркер все равно запускается: база может подняться позже
+        worker.log.warning('Прогрев воркера не удался: %s', error)
+
+
+def worker_exit(server, worker):
+    # воркер uvicorn завершается повторно поднятым сигналом и сюда
+    # не доходит: теряются метрики не больше чем за METRICS_FLUSH_SECONDS
+    from foodgram.metrics import registry
+
+    registry.flush()
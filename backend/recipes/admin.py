@@ -1,11 +1,21 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import Group
+from django.utils.decorators import method_decorator
 from django.utils.safestring import mark_safe
 from django import forms
 
+from foodgram.querycheck import query_budget
+
 from .models import (Favorite, Follow, Ingredient, Recipe, RecipeIngredient,
                      ShoppingCart, Tag, User)
+from .utils import EstimatedCountPaginator
+
+
+class LargeTableAdminMixin:
+    """Настройки списка для таблиц с миллионами строк."""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
 class ImagePreviewWidget(forms.FileInput):
@@ -29,11 +39,12 @@ class ImagePreviewWidget(forms.FileInput):
 class RecipeCountAdminMixin:
     @admin.display(description="В рецептах")
     def get_recipe_count(self, obj):
-        return obj.recipes.count()
+        return obj.recipes_count
 
 
 @admin.register(User)
-class UserAdmin(BaseUserAdmin, RecipeCountAdminMixin):
+@method_decorator(query_budget(6), name='changelist_view')
+class UserAdmin(LargeTableAdminMixin, BaseUserAdmin, RecipeCountAdminMixin):
     """Кастомизация админ-панели для пользователей."""
     list_display = (
         'id', 'username', 'get_full_name', 'email', 'get_image_preview',
@@ -70,21 +81,24 @@ class UserAdmin(BaseUserAdmin, RecipeCountAdminMixin):
 
     @admin.display(description='Подписчиков')
     def get_followers_count(self, user):
-        return user.following.count()
+        return user.followers_count
 
     @admin.display(description='Подписок')
     def get_following_count(self, user):
-        return user.followers.count()
+        return user.following_count
 
 
 @admin.register(Ingredient)
-class IngredientAdmin(admin.ModelAdmin, RecipeCountAdminMixin):
+@method_decorator(query_budget(6), name='changelist_view')
+class IngredientAdmin(LargeTableAdminMixin, admin.ModelAdmin,
+                      RecipeCountAdminMixin):
     list_display = ('id', 'name', 'measurement_unit', 'get_recipe_count')
     search_fields = ('name', 'measurement_unit')
     list_filter = ('measurement_unit',)
 
 
 @admin.register(Tag)
+@method_decorator(query_budget(6), name='changelist_view')
 class TagAdmin(admin.ModelAdmin, RecipeCountAdminMixin):
     list_display = ('id', 'name', 'slug', 'get_recipe_count')
     search_fields = ('name', 'slug')
@@ -95,19 +109,32 @@ class RecipeIngredientInline(admin.TabularInline):
     model = RecipeIngredient
     extra = 1
     min_num = 1
+    autocomplete_fields = ('ingredient',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related(
+            'recipe', 'ingredient'
+        )
 
 
 @admin.register(Recipe)
-class RecipeAdmin(admin.ModelAdmin):
+@method_decorator(query_budget(8), name='changelist_view')
+class RecipeAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = (
         'id', 'name', 'author', 'get_tags_display', 'get_ingredients_display',
         'get_favorites_count', 'get_image_preview'
     )
-    list_filter = ('author', 'tags')
-    search_fields = ('name', 'author__username')
+    list_filter = ('tags',)
+    search_fields = ('name', 'author__username__exact')
+    autocomplete_fields = ('author',)
     inlines = (RecipeIngredientInline,)
     readonly_fields = ('get_favorites_count',)
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related(
+            'author'
+        ).prefetch_related('tags', 'recipe_ingredients__ingredient')
+
     def get_form(self, request, obj=None, **kwargs):
         form = super().get_form(request, obj, **kwargs)
         form.base_fields['image'].widget = ImagePreviewWidget()
@@ -119,17 +146,16 @@ class RecipeAdmin(admin.ModelAdmin):
 
     @admin.display(description='Ингредиенты')
     def get_ingredients_display(self, recipe):
-        ingredients = recipe.recipe_ingredients.select_related('ingredient')
         display_text = (
             f'{item.ingredient.name} '
             f'({item.amount} {item.ingredient.measurement_unit})'
-            for item in ingredients
+            for item in recipe.recipe_ingredients.all()
         )
         return mark_safe("<br>".join(display_text))
 
     @admin.display(description='В избранном')
     def get_favorites_count(self, recipe):
-        return recipe.favorites.count()
+        return recipe.favorites_count
 
     @admin.display(description='Превью')
     def get_image_preview(self, recipe):
@@ -138,28 +164,41 @@ class RecipeAdmin(admin.ModelAdmin):
         return ""
 
 
+# Поиск по связям идет точным совпадением юзернейма (уникальный индекс),
+# по части названия рецепта и по началу названия ингредиента. icontains
+# и istartswith на PostgreSQL сравнивают UPPER(name) LIKE UPPER(%s),
+# поэтому им служат индексы по UPPER(name) из миграции 0009:
+# триграммный у рецепта и text_pattern_ops у ингредиента.
 @admin.register(Favorite)
-class FavoriteAdmin(admin.ModelAdmin):
+class FavoriteAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = ("id", "user", "recipe")
-    search_fields = ("user__username", "recipe__name")
+    list_select_related = ("user", "recipe")
+    search_fields = ("user__username__exact", "recipe__name")
+    autocomplete_fields = ("user", "recipe")
 
 
 @admin.register(Follow)
-class FollowAdmin(admin.ModelAdmin):
+class FollowAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = ("id", "user", "author")
-    search_fields = ("user__username", "author__username")
+    list_select_related = ("user", "author")
+    search_fields = ("user__username__exact", "author__username__exact")
+    autocomplete_fields = ("user", "author")
 
 
 @admin.register(ShoppingCart)
-class ShoppingCartAdmin(admin.ModelAdmin):
+class ShoppingCartAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = ("id", "user", "recipe")
-    search_fields = ("user__username", "recipe__name")
+    list_select_related = ("user", "recipe")
+    search_fields = ("user__username__exact", "recipe__name")
+    autocomplete_fields = ("user", "recipe")
 
 
 @admin.register(RecipeIngredient)
-class RecipeIngredientAdmin(admin.ModelAdmin):
+class RecipeIngredientAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = ("id", "recipe", "ingredient", "amount")
-    search_fields = ("recipe__name", "ingredient__name")
+    list_select_related = ("recipe", "ingredient")
+    search_fields = ("recipe__name", "ingredient__name__istartswith")
+    autocomplete_fields = ("recipe", "ingredient")
 
 
 admin.site.unregister(Group)
@@ -0,0 +1,219 @@
+"""
+Справочники тегов и ингредиентов в памяти процесса.
+
+Каждый процесс (воркер gunicorn) держит свою копию справочников
+и перечитывает ее, когда в таблице CatalogVersion меняется версия.
+Версия проверяется не чаще одного раза за запрос. Асинхронные
+представления проверяют ее через acheck и aget: они читают базу
+асинхронным ORM и не блокируют цикл событий.
+"""
+import gzip
+import json
+import threading
+from bisect import bisect_left
+
+from django.core.signals import request_started
+
+from .models import CatalogVersion, Ingredient, Tag
+
+
+class IngredientIndex:
+    """Отсортированный по названию индекс для поиска по префиксу."""
+
+    def __init__(self, ingredients):
+        rows = sorted(
+            (name.casefold(), measurement_unit.casefold(), pk,
+             name, measurement_unit)
+            for pk, name, measurement_unit in ingredients
+        )
+        self.keys = [row[0] for row in rows]
+        self.items = [
+            {'id': pk, 'name': name, 'measurement_unit': measurement_unit}
+            for _, _, pk, name, measurement_unit in rows
+        ]
+        self.by_id = {item['id']: item for item in self.items}
+
+    def __contains__(self, pk):
+        return pk in self.by_id
+
+    def search(self, prefix, limit=None):
+        """
+        Ингредиенты, название которых начинается с prefix (без учета
+        регистра). Точные совпадения идут первыми: при сортировке
+        по названию самая короткая строка с префиксом стоит раньше.
+        """
+        prefix = prefix.casefold()
+        start = bisect_left(self.keys, prefix)
+        stop = bisect_left(self.keys, prefix + '\U0010ffff', lo=start)
+        if limit is not None:
+            stop = min(stop, start + limit)
+        return self.items[start:stop]
+
+
+class TagIndex:
+    """Теги по id и по слагу."""
+
+    def __init__(self, tags):
+        self.by_id = {
+            pk: {'id': pk, 'name': name, 'color': color, 'slug': slug}
+            for pk, name, color, slug in tags
+        }
+        self.by_slug = {row['slug']: row for row in self.by_id.values()}
+
+    def __contains__(self, pk):
+        return pk in self.by_id
+
+
+class CatalogBundle:
+    """Полный справочник одним JSON, заранее сжатым gzip."""
+
+    def __init__(self, version, tags, ingredients):
+        self.version = version
+        self.content = json.dumps(
+            {
+                'version': version,
+                'tags': list(tags.by_id.values()),
+                'ingredients': ingredients.items,
+            },
+            ensure_ascii=False,
+            separators=(',', ':'),
+        ).encode()
+        self.gzipped = gzip.compress(self.content, mtime=0)
+
+
+class Catalog:
+    """Ленивая, сбрасываемая по версии копия справочников."""
+    # модель: (класс индекса, строки для него)
+    builders = {
+        Ingredient: (
+            IngredientIndex,
+            lambda: Ingredient.objects.values_list(
+                'id', 'name', 'measurement_unit'
+            ),
+        ),
+        Tag: (
+            TagIndex,
+            lambda: Tag.objects.values_list('id', 'name', 'color', 'slug'),
+        ),
+    }
+
+    def __init__(self):
+        self.indexes = {}
+        self.versions = None
+        self.bundles = {}
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def expire(self, **kwargs):
+        """Просит перепроверить версию при следующем обращении."""
+        self.local.checked = False
+
+    def invalidate(self):
+        """Сбрасывает справочники этого процесса."""
+        with self.lock:
+            self.indexes = {}
+            self.bundles = {}
+            self.versions = None
+        self.local.checked = False
+
+    @classmethod
+    def version_rows(cls):
+        # в таблице есть и версия рецептов для поиска (recipes/search.py)
+        return CatalogVersion.objects.filter(
+            name__in=[model._meta.model_name for model in cls.builders]
+        ).values_list('name', 'version', 'updated_at')
+
+    def get_versions(self):
+        """Текущие версии справочников и даты их изменения из базы."""
+        return {
+            name: (version, updated_at)
+            for name, version, updated_at in self.version_rows()
+        }
+
+    def is_checked(self):
+        return (
+            getattr(self.local, 'checked', False)
+            and self.versions is not None
+        )
+
+    def set_versions(self, versions):
+        if versions != self.versions:
+            with self.lock:
+                self.indexes = {}
+                self.bundles = {}
+                self.versions = versions
+        self.local.checked = True
+        return versions
+
+    def check(self):
+        """
+        Сбрасывает справочники, если версия в базе поменялась,
+        и возвращает актуальные версии.
+        """
+        if self.is_checked():
+            return self.versions
+        return self.set_versions(self.get_versions())
+
+    async def acheck(self):
+        """
+        check для асинхронных представлений. Все запросы одного цикла
+        событий идут в одном потоке, поэтому отметка о проверке
+        сбрасывается здесь же, а не по сигналу request_started.
+        """
+        self.expire()
+        return self.set_versions({
+            name: (version, updated_at)
+            async for name, version, updated_at in self.version_rows()
+        })
+
+    def get_version(self, model):
+        """Версия справочника модели и дата его изменения."""
+        return self.check().get(model._meta.model_name, (0, None))
+
+    @property
+    def bundle_version(self):
+        """Общая версия тегов и ингредиентов для URL полного справочника."""
+        return '{}.{}'.format(
+            self.get_version(Tag)[0], self.get_version(Ingredient)[0]
+        )
+
+    def bundle(self):
+        version = self.bundle_version
+        bundle = self.bundles.get(version)
+        if bundle is None:
+            bundle = self.bundles[version] = CatalogBundle(
+                version, self.tags, self.ingredients
+            )
+        return bundle
+
+    def get(self, model):
+        self.check()
+        index = self.indexes.get(model)
+        if index is None:
+            index_class, rows = self.builders[model]
+            index = self.indexes[model] = index_class(rows())
+        return index
+
+    async def aget(self, model):
+        """get для асинхронных представлений."""
+        if not self.is_checked():
+            await self.acheck()
+        index = self.indexes.get(model)
+        if index is None:
+            index_class, rows = self.builders[model]
+            index = self.indexes[model] = index_class(
+                [row async for row in rows()]
+            )
+        return index
+
+    @property
+    def ingredients(self):
+        return self.get(Ingredient)
+
+    @property
+    def tags(self):
+        return self.get(Tag)
+
+
+catalog = Catalog()
+request_started.connect(catalog.expire)
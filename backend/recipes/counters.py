@@ -0,0 +1,80 @@
+"""Денормализованные счетчики: атомарное изменение и пересчет."""
+from collections import defaultdict
+
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import (Favorite, Follow, Ingredient, Recipe, RecipeIngredient,
+                     ShoppingCart, Tag, User)
+
+# (модель со счетчиком, поле счетчика, модель связей, поле связи)
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (Recipe, 'in_carts_count', ShoppingCart, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'followers_count', Follow, 'author'),
+    (User, 'following_count', Follow, 'user'),
+    (Tag, 'recipes_count', Recipe.tags.through, 'tag'),
+    (Ingredient, 'recipes_count', RecipeIngredient, 'ingredient'),
+)
+
+
+def change_counter(model, field, delta, **lookup):
+    """Атомарно меняет счетчик на delta, не опуская его ниже нуля."""
+    if delta:
+        model.objects.filter(**lookup).update(
+            **{field: Greatest(F(field) + delta, 0)}
+        )
+
+
+def change_counters(model, field, deltas):
+    """
+    Меняет счетчики нескольких строк по словарю {pk: delta}:
+    один UPDATE на каждое различное значение delta.
+    """
+    pks_by_delta = defaultdict(list)
+    for pk, delta in deltas.items():
+        pks_by_delta[delta].append(pk)
+    for delta, pks in pks_by_delta.items():
+        change_counter(model, field, delta, pk__in=pks)
+
+
+def actual_count(source, source_field):
+    """Подзапрос с фактическим числом связей для каждой строки."""
+    return Coalesce(
+        Subquery(
+            source.objects.filter(
+                **{source_field: OuterRef('pk')}
+            ).order_by().values(source_field).annotate(
+                total=Count('pk')
+            ).values('total')
+        ),
+        0,
+    )
+
+
+def recount(model, field, source, source_field, batch_size, dry_run=False):
+    """
+    Находит и исправляет расхождения счетчика пачками по первичному ключу.
+    Возвращает число исправленных строк.
+    """
+    fixed = 0
+    last_pk = None
+    while True:
+        batch = model.objects.order_by('pk')
+        if last_pk is not None:
+            batch = batch.filter(pk__gt=last_pk)
+        pks = list(batch.values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return fixed
+        last_pk = pks[-1]
+        drifted = list(
+            model.objects.filter(pk__in=pks).annotate(
+                actual=actual_count(source, source_field)
+            ).exclude(**{field: F('actual')}).values_list('pk', flat=True)
+        )
+        if drifted and not dry_run:
+            model.objects.filter(pk__in=drifted).update(
+                **{field: actual_count(source, source_field)}
+            )
+        fixed += len(drifted)
@@ -0,0 +1,50 @@
+"""
+Копирование медиафайлов между каталогами.
+
+Модуль не импортирует Django, чтобы его функции можно было запускать
+в пуле процессов, созданном через spawn.
+"""
+import os
+import posixpath
+import shutil
+
+
+def is_safe_name(name):
+    """
+    Относительное имя файла хранилища без выхода из каталога:
+    без абсолютного пути, диска, обратной косой черты и «..».
+    """
+    return (
+        isinstance(name, str) and bool(name)
+        and '\\' not in name and ':' not in name
+        and not posixpath.isabs(name)
+        and '..' not in name.split('/')
+    )
+
+
+def media_path(root, name):
+    """Путь к файлу name внутри root; ValueError, если он вне root."""
+    root = os.path.realpath(root)
+    path = os.path.realpath(os.path.join(root, name))
+    if not is_safe_name(name) or os.path.commonpath([root, path]) != root:
+        raise ValueError(f'Недопустимое имя файла: {name!r}')
+    return path
+
+
+def copy_media_file(source_root, target_root, name):
+    """
+    Копирует файл name из source_root в target_root, если его там
+    еще нет или размер отличается. Возвращает True, если файл скопирован.
+    """
+    source = media_path(source_root, name)
+    target = media_path(target_root, name)
+    if (
+        os.path.exists(target)
+        and os.path.getsize(target) == os.path.getsize(source)
+    ):
+        return False
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    temporary = f'{target}.part'
+    shutil.copyfile(source, temporary)
+    os.replace(temporary, target)
+    return True
@@ -0,0 +1,121 @@
+"""
+Уменьшенные копии картинок рецептов и аватаров в WebP.
+
+Копии строятся в пуле потоков после коммита транзакции, в которой
+сохранили картинку, и записываются в поле <поле>_variants вместе
+с именем исходного файла (source). Пока копии не готовы или относятся
+к старому файлу, сериализаторы отдают ссылку на оригинал.
+"""
+import logging
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+from PIL import Image, ImageOps
+
+from .models import Recipe, User
+
+logger = logging.getLogger(__name__)
+
+# вариант: наибольшая сторона в пикселях (None — исходный размер)
+VARIANT_SIZES = {
+    'thumbnail': 320,
+    'medium': 960,
+    'webp': None,
+}
+# модель: (поле картинки, варианты)
+IMAGE_FIELDS = {
+    Recipe: ('image', ('thumbnail', 'medium', 'webp')),
+    User: ('avatar', ('thumbnail',)),
+}
+
+executor = ThreadPoolExecutor(
+    max_workers=settings.IMAGE_WORKERS, thread_name_prefix='image-variants'
+)
+
+
+def variant_name(name, variant):
+    directory, filename = posixpath.split(name)
+    stem, _ = posixpath.splitext(filename)
+    return posixpath.join(directory, 'variants', f'{stem}_{variant}.webp')
+
+
+def is_actual(image, variants):
+    """Копии сделаны из текущего файла картинки."""
+    return bool(image) and variants.get('source') == image.name
+
+
+def render_variant(image, size):
+    if size is not None:
+        image = image.copy()
+        image.thumbnail((size, size), Image.LANCZOS)
+    buffer = BytesIO()
+    image.save(
+        buffer, 'WEBP', quality=settings.IMAGE_WEBP_QUALITY, method=4
+    )
+    return buffer.getvalue()
+
+
+def build_variants(model, pk, name):
+    """Строит копии картинки name и сохраняет их, если она не сменилась."""
+    field, variant_names = IMAGE_FIELDS[model]
+    storage = model._meta.get_field(field).storage
+    variants = {'source': name}
+    with storage.open(name) as file, Image.open(file) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert(
+                'RGBA' if 'transparency' in image.info
+                or image.mode in ('LA', 'PA') else 'RGB'
+            )
+        for variant in variant_names:
+            path = variant_name(name, variant)
+            storage.delete(path)
+            variants[variant] = storage.save(
+                path,
+                ContentFile(render_variant(image, VARIANT_SIZES[variant])),
+            )
+    updated = model.objects.filter(pk=pk, **{field: name}).update(
+        **{f'{field}_variants': variants}
+    )
+    if not updated:
+        return
+    if model is Recipe:
+        Recipe.objects.filter(pk=pk).bump_version()
+    else:
+        Recipe.objects.filter(author_id=pk).bump_version()
+
+
+def run_build_variants(model, pk, name):
+    """
+    build_variants для пула. Результат future после коммита никто
+    не читает, поэтому ошибка пишется в лог, а вызывающему
+    (generate_image_variants) возвращается False.
+    """
+    try:
+        build_variants(model, pk, name)
+    except Exception:
+        logger.exception(
+            'Не удалось построить копии %s %s (%s)',
+            model._meta.model_name, pk, name,
+        )
+        return False
+    finally:
+        connections.close_all()
+    return True
+
+
+def schedule_variants(instance):
+    """
+    Ставит построение копий в пул после коммита, если картинка
+    сменилась с прошлого построения.
+    """
+    field, _ = IMAGE_FIELDS[type(instance)]
+    image = getattr(instance, field)
+    if not image or is_actual(image, getattr(instance, f'{field}_variants')):
+        return
+    args = (type(instance), instance.pk, image.name)
+    transaction.on_commit(lambda: executor.submit(run_build_variants, *args))
@@ -1,28 +1,428 @@
+"""
+Потоковая загрузка справочников с обновлением существующих записей.
+
+Файл (JSON-массив, NDJSON или CSV) читается по одной записи и пишется
+пачками: записи с новым естественным ключом добавляются, с измененными
+полями — обновляются, остальные пропускаются. На PostgreSQL записи
+копируются COPY во временную таблицу и переносятся одним
+INSERT ... ON CONFLICT.
+
+ON CONFLICT срабатывает только по естественному ключу. Если у модели
+есть другие уникальные поля (название и цвет тега), до записи
+проверяется, что их значения не заняты записями с другим ключом
+в базе или в файле, иначе команда завершается ошибкой без изменений.
+"""
+import csv
+import io
 import json
+from itertools import islice
+from operator import itemgetter
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils.functional import cached_property
+
+from recipes.catalog import catalog
+from recipes.models import CatalogVersion
+
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def read_json(file, fields):
+    """Элементы JSON-массива по одному, не читая файл целиком."""
+    decoder = json.JSONDecoder()
+    buffer = file.read(READ_CHUNK_SIZE).lstrip()
+    if not buffer.startswith('['):
+        raise CommandError('Ожидается JSON-массив.')
+    buffer = buffer[1:]
+    number = 0
+    while True:
+        buffer = buffer.lstrip()
+        if buffer.startswith(','):
+            buffer = buffer[1:].lstrip()
+        if buffer.startswith(']'):
+            return
+        try:
+            item, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError as error:
+            chunk = file.read(READ_CHUNK_SIZE)
+            if not chunk:
+                raise CommandError(f'Запись {number + 1}: {error}')
+            buffer += chunk
+            continue
+        number += 1
+        yield number, item
+        buffer = buffer[end:]
+
+
+def read_ndjson(file, fields):
+    for number, line in enumerate(file, 1):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError as error:
+            raise CommandError(f'Строка {number}: {error}')
+
+
+def read_csv(file, fields):
+    """CSV с колонками в порядке fields; строка заголовка необязательна."""
+    for number, row in enumerate(csv.reader(file), 1):
+        if not row or number == 1 and tuple(row) == fields:
+            continue
+        if len(row) != len(fields):
+            raise CommandError(
+                f'Строка {number}: ожидается {len(fields)} колонки '
+                f'({", ".join(fields)}).'
+            )
+        yield number, dict(zip(fields, row))
 
-from django.core.management.base import BaseCommand
+
+READERS = {
+    'json': read_json,
+    'ndjson': read_ndjson,
+    'jsonl': read_ndjson,
+    'csv': read_csv,
+}
 
 
 class BaseLoader(BaseCommand):
-    """Базовый класс для загрузки данных из JSON файлов."""
+    """Базовый класс для загрузки справочников из файлов."""
     model = None
     file_path = None
+    # поля записи в порядке колонок CSV
+    fields = ()
+    # естественный ключ: поля уникального ограничения модели
+    unique_fields = ()
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?', default=self.file_path,
+            help=f'Файл для загрузки, по умолчанию {self.file_path}.'
+        )
+        parser.add_argument(
+            '--format', choices=READERS,
+            help='Формат файла, по умолчанию — по расширению.'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=5_000,
+            help='Количество записей в одной пачке.'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Показать изменения, ничего не записывая.'
+        )
+        parser.add_argument(
+            '--no-copy', action='store_true',
+            help='Не использовать COPY на PostgreSQL.'
+        )
+
+    @property
+    def update_fields(self):
+        return [
+            field for field in self.fields
+            if field not in self.unique_fields
+        ]
+
+    @cached_property
+    def checked_unique_fields(self):
+        """Уникальные поля записи вне естественного ключа."""
+        return [
+            field for field in self.update_fields
+            if self.model._meta.get_field(field).unique
+        ]
 
-    def handle(self, *args, **kwargs):
+    @cached_property
+    def key(self):
+        """Функция, возвращающая естественный ключ записи."""
+        indexes = [self.fields.index(field) for field in self.unique_fields]
+        if len(indexes) == 1:
+            index, = indexes
+            return lambda row: (row[index],)
+        return itemgetter(*indexes)
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        file_format = options['format'] or path.suffix[1:].lower()
+        if file_format not in READERS:
+            raise CommandError(
+                f'Неизвестный формат файла {path}, укажите --format.'
+            )
+        if not path.is_file():
+            raise CommandError(f'Файл {path} не найден.')
+        self.dry_run = options['dry_run']
+        self.show_diff = self.dry_run or options['verbosity'] > 1
         self.stdout.write(
-            self.style.SUCCESS(f'Начинается загрузка из {self.file_path}')
+            self.style.SUCCESS(f'Начинается загрузка из {path}')
         )
-        try:
-            with open(self.file_path, 'r', encoding='utf-8') as file:
-                created_items = self.model.objects.bulk_create(
-                    (self.model(**item) for item in json.load(file)),
-                    ignore_conflicts=True
-                )
-            self.stdout.write(self.style.SUCCESS(
-                (f'Загрузка завершена. Добавлено {len(created_items)} '
-                 'новых записей.')
-            ))
-        except Exception as e:
-            self.stdout.write(self.style.ERROR(
-                f'Ошибка при загрузке {self.file_path}: {e}'
+        upsert = (
+            self.copy_upsert
+            if connection.vendor == 'postgresql' and not options['no_copy']
+            else self.batch_upsert
+        )
+        with path.open(encoding='utf-8', newline='') as file, \
+                transaction.atomic():
+            rows = self.clean(READERS[file_format](file, self.fields))
+            inserted, updated, skipped = upsert(rows, options['batch_size'])
+            if self.dry_run:
+                transaction.set_rollback(True)
+            elif inserted or updated:
+                CatalogVersion.bump(self.model)
+                transaction.on_commit(catalog.invalidate)
+        prefix = 'Пробный запуск. ' if self.dry_run else 'Загрузка завершена. '
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix}Добавлено {inserted}, обновлено {updated}, '
+            f'без изменений {skipped}.'
+        ))
+
+    def clean(self, items):
+        for number, item in items:
+            if not isinstance(item, dict):
+                raise CommandError(f'Запись {number}: ожидается объект.')
+            try:
+                yield tuple(str(item[field]).strip() for field in self.fields)
+            except KeyError as error:
+                raise CommandError(f'Запись {number}: нет поля {error}.')
+
+    def conflict(self, field, value, owner, key):
+        return CommandError(
+            f'Значение {field} «{value}» одновременно у записей '
+            f'{", ".join(owner)} и {", ".join(key)}, а поле уникально.'
+        )
+
+    def check_conflicts(self, rows):
+        """
+        Ошибка, если значение уникального поля вне ключа уже занято
+        записью с другим ключом.
+        """
+        for field in self.checked_unique_fields:
+            index = self.fields.index(field)
+            owners = {}
+            for row in rows:
+                owner = owners.setdefault(row[index], self.key(row))
+                if owner != self.key(row):
+                    raise self.conflict(
+                        field, row[index], owner, self.key(row)
+                    )
+            taken = self.model.objects.filter(**{
+                f'{field}__in': owners
+            }).values_list(field, *self.unique_fields)
+            for value, *owner in taken:
+                if tuple(owner) != owners[value]:
+                    raise self.conflict(
+                        field, value, owner, owners[value]
+                    )
+
+    def report(self, new, changed):
+        if not self.show_diff:
+            return
+        for row in new:
+            self.stdout.write(f'+ {", ".join(row)}')
+        for current, row in changed:
+            self.stdout.write(
+                f'~ {", ".join(current)} -> {", ".join(row)}'
+            )
+
+    def write(self, rows):
+        objects = [self.model(**dict(zip(self.fields, row))) for row in rows]
+        if self.update_fields:
+            self.model.objects.bulk_create(
+                objects,
+                update_conflicts=True,
+                unique_fields=self.unique_fields,
+                update_fields=self.update_fields,
+            )
+        else:
+            self.model.objects.bulk_create(objects, ignore_conflicts=True)
+
+    def batch_upsert(self, rows, batch_size):
+        """Пачка: один SELECT по ключам и один INSERT ... ON CONFLICT."""
+        inserted = updated = skipped = 0
+        rows = iter(rows)
+        while batch := list(islice(rows, batch_size)):
+            unique = {self.key(row): row for row in batch}
+            skipped += len(batch) - len(unique)
+            existing = {
+                self.key(row): row
+                for row in self.model.objects.filter(**{
+                    f'{self.unique_fields[0]}__in': {
+                        key[0] for key in unique
+                    }
+                }).values_list(*self.fields)
+            }
+            new, changed = [], []
+            for key, row in unique.items():
+                current = existing.get(key)
+                if current is None:
+                    new.append(row)
+                elif current != row:
+                    changed.append((current, row))
+                else:
+                    skipped += 1
+            self.check_conflicts(new + [row for _, row in changed])
+            self.report(new, changed)
+            if not self.dry_run and (new or changed):
+                self.write(new + [row for _, row in changed])
+            inserted += len(new)
+            updated += len(changed)
+        return inserted, updated, skipped
+
+    def copy_upsert(self, rows, batch_size):
+        """
+        COPY всех записей во временную таблицу, затем подсчет изменений
+        и один INSERT ... ON CONFLICT из нее.
+        """
+        quote = connection.ops.quote_name
+        opts = self.model._meta
+        table = quote(opts.db_table)
+
+        def column_list(fields, alias=''):
+            return ', '.join(
+                alias + quote(opts.get_field(field).column)
+                for field in fields
+            )
+
+        columns = column_list(self.fields)
+        keys = column_list(self.unique_fields)
+        key_match = ' AND '.join(
+            f't.{column} = u.{column}'
+            for column in map(quote, (
+                opts.get_field(field).column for field in self.unique_fields
             ))
+        )
+        new_rows = (
+            f'FROM loader_unique u WHERE NOT EXISTS '
+            f'(SELECT 1 FROM {table} t WHERE {key_match})'
+        )
+        changed_rows = (
+            f'FROM loader_unique u JOIN {table} t ON {key_match} '
+            f'WHERE ({column_list(self.update_fields, "t.")}) '
+            f'IS DISTINCT FROM ({column_list(self.update_fields, "u.")})'
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMP TABLE loader_rows (position bigserial, {}) '
+                'ON COMMIT DROP'.format(', '.join(
+                    f'{quote(opts.get_field(field).column)} text'
+                    for field in self.fields
+                ))
+            )
+            total = 0
+            rows = iter(rows)
+            while batch := list(islice(rows, batch_size)):
+                buffer = io.StringIO()
+                csv.writer(buffer).writerows(batch)
+                buffer.seek(0)
+                cursor.copy_expert(
+                    f'COPY loader_rows ({columns}) '
+                    'FROM STDIN WITH (FORMAT csv)',
+                    buffer,
+                )
+                total += len(batch)
+            cursor.execute(
+                f'CREATE TEMP TABLE loader_unique ON COMMIT DROP AS '
+                f'SELECT DISTINCT ON ({keys}) {columns} '
+                f'FROM loader_rows ORDER BY {keys}, position DESC'
+            )
+            self.check_copy_conflicts(cursor, table, key_match)
+            cursor.execute(f'SELECT count(*) {new_rows}')
+            inserted, = cursor.fetchone()
+            updated = 0
+            if self.update_fields:
+                cursor.execute(f'SELECT count(*) {changed_rows}')
+                updated, = cursor.fetchone()
+            if self.show_diff:
+                cursor.execute(
+                    f'SELECT {column_list(self.fields, "u.")} {new_rows}'
+                )
+                new = cursor.fetchall()
+                changed = []
+                if self.update_fields:
+                    cursor.execute(
+                        f'SELECT {column_list(self.fields, "t.")}, '
+                        f'{column_list(self.fields, "u.")} {changed_rows}'
+                    )
+                    size = len(self.fields)
+                    changed = [
+                        (row[:size], row[size:]) for row in cursor.fetchall()
+                    ]
+                self.report(new, changed)
+            if not self.dry_run and (inserted or updated):
+                self.insert_from_copy(cursor, table, columns, keys)
+        return inserted, updated, total - inserted - updated
+
+    def check_copy_conflicts(self, cursor, table, key_match):
+        """check_conflicts для записей во временной таблице."""
+        quote = connection.ops.quote_name
+        opts = self.model._meta
+        keys = [
+            quote(opts.get_field(field).column)
+            for field in self.unique_fields
+        ]
+        size = len(keys)
+        for field in self.checked_unique_fields:
+            column = quote(opts.get_field(field).column)
+            cursor.execute(
+                'SELECT a.{0}, {1}, {2} FROM loader_unique a '
+                'JOIN loader_unique b ON a.{0} = b.{0} AND ({3}) < ({4}) '
+                'LIMIT 1'.format(
+                    column,
+                    ', '.join(f'a.{key}' for key in keys),
+                    ', '.join(f'b.{key}' for key in keys),
+                    ', '.join(f'a.{key}' for key in keys),
+                    ', '.join(f'b.{key}' for key in keys),
+                )
+            )
+            row = cursor.fetchone()
+            if row is None:
+                cursor.execute(
+                    f'SELECT u.{column}, '
+                    + ', '.join(f't.{key}' for key in keys) + ', '
+                    + ', '.join(f'u.{key}' for key in keys)
+                    + f' FROM loader_unique u JOIN {table} t '
+                    f'ON t.{column} = u.{column} WHERE NOT ({key_match}) '
+                    'LIMIT 1'
+                )
+                row = cursor.fetchone()
+            if row is not None:
+                raise self.conflict(
+                    field, row[0], row[1:size + 1], row[size + 1:]
+                )
+
+    def insert_from_copy(self, cursor, table, columns, keys):
+        quote = connection.ops.quote_name
+        opts = self.model._meta
+        # остальные поля получают значения по умолчанию модели:
+        # в схеме базы Django их не задает
+        defaults = [
+            field for field in opts.concrete_fields
+            if not field.primary_key and field.name not in self.fields
+        ]
+        conflict = 'DO NOTHING'
+        if self.update_fields:
+            updates = [
+                quote(opts.get_field(field).column)
+                for field in self.update_fields
+            ]
+            conflict = (
+                'DO UPDATE SET {} WHERE ({}) IS DISTINCT FROM ({})'
+            ).format(
+                ', '.join(f'{column} = EXCLUDED.{column}'
+                          for column in updates),
+                ', '.join(f'{table}.{column}' for column in updates),
+                ', '.join(f'EXCLUDED.{column}' for column in updates),
+            )
+        default_columns = ''.join(
+            f', {quote(field.column)}' for field in defaults
+        )
+        placeholders = ''.join(', %s' for _ in defaults)
+        cursor.execute(
+            f'INSERT INTO {table} ({columns}{default_columns}) '
+            f'SELECT {columns}{placeholders} FROM loader_unique '
+            f'ON CONFLICT ({keys}) {conflict}',
+            [
+                field.get_db_prep_save(field.get_default(), connection)
+                for field in defaults
+            ],
+        )
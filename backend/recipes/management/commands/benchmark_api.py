@@ -0,0 +1,483 @@
+import io
+import json
+import random
+import shutil
+import tempfile
+import time
+from datetime import datetime
+from itertools import islice
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import (CaptureQueriesContext, override_settings,
+                               setup_test_environment,
+                               teardown_test_environment)
+from rest_framework.authtoken.models import Token
+
+from recipes.models import (Favorite, Follow, Ingredient, Recipe,
+                            RecipeIngredient, ShoppingCart, Tag, User)
+
+SCALES = {
+    '1k': {'users': 100, 'recipes': 1_000},
+    '100k': {'users': 5_000, 'recipes': 100_000},
+    '1m': {'users': 50_000, 'recipes': 1_000_000},
+}
+BATCH_SIZE = 5_000
+# id в сценариях пакетных эндпоинтов
+BATCH_IDS = 20
+INGREDIENTS_PER_RECIPE = 8
+TAGS_PER_RECIPE = 2
+PLACEHOLDER_IMAGE = 'recipes/images/benchmark.png'
+PLACEHOLDER_PNG = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAA'
+    'DUlEQVR42mP8z8DwHwAFBQIAX8jx0gAAAABJRU5ErkJggg=='
+)
+
+
+def batched(iterable, size):
+    """Разбивает итерируемый объект на списки длиной не больше size."""
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def percentile(values, percent):
+    """Перцентиль методом ближайшего ранга."""
+    ordered = sorted(values)
+    rank = max(0, round(percent / 100 * len(ordered) + 0.5) - 1)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+class Command(BaseCommand):
+    """
+    Нагрузочный прогон эндпоинтов API на заполненной тестовой базе.
+
+    Команда создает отдельную тестовую базу (как manage.py test),
+    заполняет ее данными выбранного масштаба и прогоняет каждый
+    эндпоинт из api/urls.py через тестовый клиент Django.
+    По каждому сценарию считаются p50/p95 задержки, число SQL-запросов
+    и размер ответа. Результат сохраняется в JSON, который можно
+    сравнить с предыдущим прогоном через --compare.
+    """
+    help = 'Прогон эндпоинтов API с отчетом по задержкам и запросам'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scale', choices=SCALES, default='1k',
+            help='Масштаб данных (количество рецептов).'
+        )
+        parser.add_argument(
+            '--follows', type=int, default=50,
+            help='Количество подписок у пользователя бенчмарка.'
+        )
+        parser.add_argument(
+            '--cart-size', type=int, default=20,
+            help='Количество рецептов в корзине и в избранном.'
+        )
+        parser.add_argument(
+            '--requests', type=int, default=30,
+            help='Количество замеров на каждый эндпоинт.'
+        )
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Зерно генератора случайных чисел.'
+        )
+        parser.add_argument(
+            '--output', help='Путь к JSON-файлу с результатами.'
+        )
+        parser.add_argument(
+            '--compare',
+            help='JSON предыдущего прогона для сравнения результатов.'
+        )
+        parser.add_argument(
+            '--threshold', type=float, default=20.0,
+            help='Допустимый рост p95 в процентах при сравнении.'
+        )
+        parser.add_argument(
+            '--keepdb', action='store_true',
+            help='Не удалять тестовую базу и не заполнять ее повторно.'
+        )
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as file:
+                baseline = json.load(file)
+        self.random = random.Random(options['seed'])
+        media_root = tempfile.mkdtemp(prefix='foodgram-benchmark-')
+        media_override = override_settings(MEDIA_ROOT=media_root)
+        media_override.enable()
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, keepdb=options['keepdb']
+        )
+        try:
+            if not Recipe.objects.exists():
+                self.seed(options)
+            report = self.run_benchmark(options)
+        finally:
+            connection.creation.destroy_test_db(
+                old_name, verbosity=0, keepdb=options['keepdb']
+            )
+            teardown_test_environment()
+            media_override.disable()
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        self.print_report(report['results'])
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+            self.stdout.write(self.style.SUCCESS(
+                f'Результаты сохранены в {options["output"]}'
+            ))
+        if baseline is not None:
+            self.compare(baseline['results'], report['results'],
+                         options['threshold'])
+
+    def seed(self, options):
+        """Заполняет тестовую базу данными выбранного масштаба."""
+        scale = SCALES[options['scale']]
+        started = time.perf_counter()
+        if not Tag.objects.exists():
+            Tag.objects.bulk_create(
+                Tag(name=f'Тег {i}', color=f'#{i:06x}', slug=f'tag-{i}')
+                for i in range(10)
+            )
+        if not Ingredient.objects.exists():
+            Ingredient.objects.bulk_create(
+                Ingredient(name=f'ингредиент {i}', measurement_unit='г')
+                for i in range(2_000)
+            )
+        tag_ids = list(Tag.objects.values_list('id', flat=True))
+        ingredient_ids = list(Ingredient.objects.values_list('id', flat=True))
+
+        for batch in batched(range(scale['users']), BATCH_SIZE):
+            User.objects.bulk_create(
+                User(username=f'bench{i}', email=f'bench{i}@example.com',
+                     first_name='Имя', last_name='Фамилия', password='!')
+                for i in batch
+            )
+        user_ids = list(User.objects.values_list('id', flat=True))
+
+        for batch in batched(range(scale['recipes']), BATCH_SIZE):
+            recipes = Recipe.objects.bulk_create(
+                Recipe(author_id=self.random.choice(user_ids),
+                       name=f'Рецепт {i}', text='Описание рецепта. ' * 10,
+                       image=PLACEHOLDER_IMAGE,
+                       cooking_time=self.random.randint(1, 180))
+                for i in batch
+            )
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe_id=recipe.id, ingredient_id=ingredient,
+                                 amount=self.random.randint(1, 500))
+                for recipe in recipes
+                for ingredient in self.random.sample(
+                    ingredient_ids,
+                    min(INGREDIENTS_PER_RECIPE, len(ingredient_ids))
+                )
+            )
+            Recipe.tags.through.objects.bulk_create(
+                Recipe.tags.through(recipe_id=recipe.id, tag_id=tag)
+                for recipe in recipes
+                for tag in self.random.sample(
+                    tag_ids, min(TAGS_PER_RECIPE, len(tag_ids))
+                )
+            )
+
+        user = User.objects.create_user(
+            username='benchmark', email='benchmark@example.com',
+            password='benchmark-password', first_name='Бенчмарк',
+            last_name='Бенчмарков'
+        )
+        Follow.objects.bulk_create(
+            Follow(user=user, author_id=author_id)
+            for author_id in self.random.sample(
+                user_ids, min(options['follows'], len(user_ids))
+            )
+        )
+        recipe_ids = list(
+            Recipe.objects.values_list('id', flat=True)[:1_000]
+        )
+        sample = self.random.sample(
+            recipe_ids, min(options['cart_size'], len(recipe_ids))
+        )
+        for model in (Favorite, ShoppingCart):
+            model.objects.bulk_create(
+                model(user=user, recipe_id=recipe_id) for recipe_id in sample
+            )
+        call_command('recount_counters', stdout=io.StringIO())
+        self.stdout.write(self.style.SUCCESS(
+            f'База заполнена ({options["scale"]}) за '
+            f'{time.perf_counter() - started:.1f} с.'
+        ))
+
+    def get_scenarios(self):
+        """
+        Сценарии для всех эндпоинтов API и их основных параметров.
+
+        Каждый сценарий — (название, метод, url, тело, подготовка, откат).
+        Подготовка и откат не замеряются и возвращают базу в исходное
+        состояние, чтобы повторные замеры были одинаковыми.
+        """
+        user = User.objects.get(username='benchmark')
+        author = Follow.objects.filter(user=user).values_list(
+            'author_id', flat=True
+        ).first()
+        strangers = list(User.objects.exclude(
+            id=user.id
+        ).exclude(following__user=user).values_list(
+            'id', flat=True
+        )[:BATCH_IDS])
+        stranger = strangers[0]
+        recipe = Recipe.objects.exclude(author=user).first()
+        free_recipes = list(Recipe.objects.exclude(
+            favorites__user=user
+        ).exclude(shopping_carts__user=user)[:BATCH_IDS])
+        free_recipe = free_recipes[0]
+        free_ids = {'ids': [free.id for free in free_recipes]}
+        search_word = recipe.name.split()[0]
+        ingredient = Ingredient.objects.first()
+        tag = Tag.objects.first()
+        recipe_body = {
+            'ingredients': [{'id': ingredient.id, 'amount': 10}],
+            'tags': [tag.id],
+            'image': PLACEHOLDER_PNG,
+            'name': 'Рецепт бенчмарка',
+            'text': 'Описание',
+            'cooking_time': 10,
+        }
+        own_recipe = {}
+
+        def create_own_recipe():
+            own_recipe['id'] = self.client.post(
+                '/api/recipes/', recipe_body, content_type='application/json'
+            ).json()['id']
+
+        def delete_own_recipe():
+            Recipe.objects.filter(author=user).delete()
+
+        def own_recipe_url():
+            return f'/api/recipes/{own_recipe["id"]}/'
+
+        def toggle(model, **kwargs):
+            return (
+                lambda: model.objects.get_or_create(user=user, **kwargs),
+                lambda: model.objects.filter(user=user, **kwargs).delete(),
+            )
+
+        def toggle_many(model, field, values):
+            def add():
+                # по одной записи: счетчики и список покупок ведут сигналы
+                for value in values:
+                    model.objects.get_or_create(user=user, **{field: value})
+            return add, lambda: model.objects.filter(
+                user=user, **{f'{field}__in': values}
+            ).delete()
+
+        links = {}
+
+        def linked_url(name, url, header):
+            """Адрес из ответа на url (курсор, версия справочника)."""
+            def get():
+                if name not in links:
+                    response = self.client.get(url)
+                    links[name] = (
+                        response.json()['next'] if header is None
+                        else response[header]
+                    )
+                return links[name]
+            return get
+
+        add_favorite, remove_favorite = toggle(Favorite, recipe=free_recipe)
+        add_cart, remove_cart = toggle(ShoppingCart, recipe=free_recipe)
+        add_follow, remove_follow = toggle(Follow, author_id=stranger)
+        add_favorites, remove_favorites = toggle_many(
+            Favorite, 'recipe', free_recipes
+        )
+        add_carts, remove_carts = toggle_many(
+            ShoppingCart, 'recipe', free_recipes
+        )
+        add_follows, remove_follows = toggle_many(
+            Follow, 'author_id', strangers
+        )
+        return [
+            ('tags-list', 'get', '/api/tags/', None, None, None),
+            ('tags-detail', 'get', f'/api/tags/{tag.id}/', None, None, None),
+            ('ingredients-list', 'get', '/api/ingredients/',
+             None, None, None),
+            ('ingredients-search', 'get',
+             f'/api/ingredients/?name={ingredient.name[:2]}',
+             None, None, None),
+            ('ingredients-detail', 'get',
+             f'/api/ingredients/{ingredient.id}/', None, None, None),
+            ('recipes-list', 'get', '/api/recipes/', None, None, None),
+            ('recipes-list-page-50', 'get', '/api/recipes/?page=50',
+             None, None, None),
+            ('recipes-list-tags', 'get',
+             f'/api/recipes/?tags={tag.slug}', None, None, None),
+            ('recipes-list-author', 'get',
+             f'/api/recipes/?author={author}', None, None, None),
+            ('recipes-list-favorited', 'get',
+             '/api/recipes/?is_favorited=1', None, None, None),
+            ('recipes-list-in-cart', 'get',
+             '/api/recipes/?is_in_shopping_cart=1', None, None, None),
+            ('recipes-list-search', 'get',
+             f'/api/recipes/?search={search_word}', None, None, None),
+            ('recipes-list-cursor', 'get', '/api/recipes/?cursor=',
+             None, None, None),
+            ('recipes-list-cursor-next', 'get',
+             linked_url('cursor', '/api/recipes/?cursor=', None),
+             None, None, None),
+            ('recipes-detail', 'get', f'/api/recipes/{recipe.id}/',
+             None, None, None),
+            ('recipes-create', 'post', '/api/recipes/', recipe_body,
+             None, delete_own_recipe),
+            ('recipes-partial-update', 'patch', own_recipe_url,
+             {'name': 'Новое название'}, create_own_recipe,
+             delete_own_recipe),
+            ('recipes-delete', 'delete', own_recipe_url, None,
+             create_own_recipe, None),
+            ('recipes-favorite-add', 'post',
+             f'/api/recipes/{free_recipe.id}/favorite/', None,
+             None, remove_favorite),
+            ('recipes-favorite-remove', 'delete',
+             f'/api/recipes/{free_recipe.id}/favorite/', None,
+             add_favorite, None),
+            ('recipes-shopping-cart-add', 'post',
+             f'/api/recipes/{free_recipe.id}/shopping_cart/', None,
+             None, remove_cart),
+            ('recipes-shopping-cart-remove', 'delete',
+             f'/api/recipes/{free_recipe.id}/shopping_cart/', None,
+             add_cart, None),
+            ('recipes-favorite-batch-add', 'post',
+             '/api/recipes/favorite/batch/', free_ids,
+             None, remove_favorites),
+            ('recipes-favorite-batch-remove', 'delete',
+             '/api/recipes/favorite/batch/', free_ids,
+             add_favorites, None),
+            ('recipes-shopping-cart-batch-add', 'post',
+             '/api/recipes/shopping_cart/batch/', free_ids,
+             None, remove_carts),
+            ('recipes-shopping-cart-batch-remove', 'delete',
+             '/api/recipes/shopping_cart/batch/', free_ids,
+             add_carts, None),
+            ('recipes-shopping-list', 'get',
+             '/api/recipes/shopping_list/', None, None, None),
+            ('recipes-download-shopping-cart', 'get',
+             '/api/recipes/download_shopping_cart/', None, None, None),
+            ('users-list', 'get', '/api/users/', None, None, None),
+            ('users-detail', 'get', f'/api/users/{author}/',
+             None, None, None),
+            ('users-me', 'get', '/api/users/me/', None, None, None),
+            ('users-subscriptions', 'get',
+             '/api/users/subscriptions/?recipes_limit=3', None, None, None),
+            ('users-subscribe', 'post',
+             f'/api/users/{stranger}/subscribe/', None, None,
+             remove_follow),
+            ('users-unsubscribe', 'delete',
+             f'/api/users/{stranger}/subscribe/', None, add_follow, None),
+            ('users-subscribe-batch', 'post', '/api/users/subscribe/batch/',
+             {'ids': strangers}, None, remove_follows),
+            ('users-unsubscribe-batch', 'delete',
+             '/api/users/subscribe/batch/', {'ids': strangers},
+             add_follows, None),
+            ('users-avatar', 'put', '/api/users/me/avatar/',
+             {'avatar': PLACEHOLDER_PNG}, None, None),
+            ('catalog-bundle-redirect', 'get', '/api/catalog/',
+             None, None, None),
+            ('catalog-bundle', 'get',
+             linked_url('catalog', '/api/catalog/', 'Location'),
+             None, None, None),
+            ('auth-token-login', 'post', '/api/auth/token/login/',
+             {'email': user.email, 'password': 'benchmark-password'},
+             None, None),
+        ]
+
+    def run_benchmark(self, options):
+        user = User.objects.get(username='benchmark')
+        token, _ = Token.objects.get_or_create(user=user)
+        self.client = Client(HTTP_AUTHORIZATION=f'Token {token.key}')
+        results = {}
+        for name, method, url, body, setup, teardown in self.get_scenarios():
+            timings, queries, sizes, statuses = [], [], [], set()
+            for _ in range(options['requests']):
+                if setup:
+                    setup()
+                path = url() if callable(url) else url
+                with CaptureQueriesContext(connection) as context:
+                    started = time.perf_counter()
+                    response = getattr(self.client, method)(
+                        path, body, content_type='application/json'
+                    ) if body is not None else getattr(
+                        self.client, method
+                    )(path)
+                    content = (
+                        b''.join(response.streaming_content)
+                        if response.streaming else response.content
+                    )
+                    timings.append((time.perf_counter() - started) * 1000)
+                queries.append(len(context))
+                sizes.append(len(content))
+                statuses.add(response.status_code)
+                if teardown:
+                    teardown()
+            results[name] = {
+                'method': method.upper(),
+                'p50_ms': round(percentile(timings, 50), 3),
+                'p95_ms': round(percentile(timings, 95), 3),
+                'queries': max(queries),
+                'bytes': max(sizes),
+                'status': sorted(statuses),
+            }
+        return {
+            'meta': {
+                'scale': options['scale'],
+                'follows': options['follows'],
+                'cart_size': options['cart_size'],
+                'requests': options['requests'],
+                'seed': options['seed'],
+                'database': connection.vendor,
+                'created': datetime.now().isoformat(timespec='seconds'),
+            },
+            'results': results,
+        }
+
+    def print_report(self, results):
+        self.stdout.write(
+            f'{"сценарий":<34}{"p50, мс":>10}{"p95, мс":>10}'
+            f'{"запросов":>10}{"байт":>10}  статус'
+        )
+        for name, row in results.items():
+            self.stdout.write(
+                f'{name:<34}{row["p50_ms"]:>10.2f}{row["p95_ms"]:>10.2f}'
+                f'{row["queries"]:>10}{row["bytes"]:>10}  '
+                f'{",".join(map(str, row["status"]))}'
+            )
+
+    def compare(self, baseline, results, threshold):
+        """Сравнивает прогон с предыдущим и падает при регрессии."""
+        regressions = []
+        for name, row in results.items():
+            old = baseline.get(name)
+            if old is None:
+                continue
+            growth = (row['p95_ms'] / old['p95_ms'] - 1) * 100 if (
+                old['p95_ms']
+            ) else 0
+            line = (
+                f'{name:<34}p95 {old["p95_ms"]:.2f} -> {row["p95_ms"]:.2f} '
+                f'({growth:+.0f}%), запросов {old["queries"]} -> '
+                f'{row["queries"]}'
+            )
+            if growth > threshold or row['queries'] > old['queries']:
+                regressions.append(name)
+                self.stdout.write(self.style.ERROR(line))
+            else:
+                self.stdout.write(line)
+        if regressions:
+            raise CommandError(
+                f'Регрессия производительности: {", ".join(regressions)}'
+            )
@@ -0,0 +1,205 @@
+import http.client
+import json
+import random
+import threading
+import time
+from datetime import datetime
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.authtoken.models import Token
+
+from recipes.models import Recipe, User
+from .benchmark_api import percentile
+
+DEFAULT_PATHS = (
+    '/api/recipes/',
+    '/api/recipes/?page=2&limit=10',
+    '/api/recipes/{recipe}/',
+    '/api/ingredients/?name=%D1%81',
+    '/s/{recipe}/',
+)
+SAMPLE_RECIPES = 1000
+
+
+class Command(BaseCommand):
+    """
+    Нагрузка на запущенный сервер запросами на чтение с заданной
+    конкурентностью.
+
+    Команда держит concurrency соединений keep-alive, в течение
+    --duration секунд шлет по ним запросы из --paths и считает
+    пропускную способность и задержки на каждом уровне конкурентности.
+    {recipe} в путях заменяется на id случайного рецепта из базы.
+    Если передано несколько адресов, например WSGI и ASGI на разных
+    портах, они прогоняются по очереди и сравниваются.
+    """
+    help = 'Прогон запущенного сервера конкурентными запросами на чтение'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'urls', nargs='+',
+            help='Адреса серверов, например http://127.0.0.1:8000.'
+        )
+        parser.add_argument(
+            '--paths', nargs='+', default=DEFAULT_PATHS,
+            help='Пути запросов; {recipe} — id случайного рецепта.'
+        )
+        parser.add_argument(
+            '--concurrency', default='1,8,32,64',
+            help='Уровни конкурентности через запятую.'
+        )
+        parser.add_argument(
+            '--duration', type=float, default=10.0,
+            help='Длительность прогона каждого уровня в секундах.'
+        )
+        parser.add_argument(
+            '--user',
+            help='Username, от имени которого идут запросы (с токеном).'
+        )
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Зерно генератора случайных чисел.'
+        )
+        parser.add_argument(
+            '--output', help='Путь к JSON-файлу с результатами.'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            levels = [
+                int(level) for level in options['concurrency'].split(',')
+            ]
+        except ValueError:
+            raise CommandError('--concurrency: числа через запятую.')
+        self.headers = {'Accept': 'application/json'}
+        if options['user']:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(
+                    f'Пользователь {options["user"]} не найден.'
+                )
+            token, _ = Token.objects.get_or_create(user=user)
+            self.headers['Authorization'] = f'Token {token.key}'
+        self.recipe_ids = list(
+            Recipe.objects.order_by('-pub_date').values_list(
+                'pk', flat=True
+            )[:SAMPLE_RECIPES]
+        )
+        if not self.recipe_ids and any(
+            '{recipe}' in path for path in options['paths']
+        ):
+            raise CommandError('В базе нет рецептов для {recipe}.')
+
+        results = []
+        for url in options['urls']:
+            for level in levels:
+                row = self.run_level(url, level, options)
+                results.append(row)
+                self.print_row(row)
+        if len(options['urls']) > 1:
+            self.compare(results, options['urls'])
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump({
+                    'meta': {
+                        'paths': list(options['paths']),
+                        'duration': options['duration'],
+                        'user': options['user'],
+                        'created': datetime.now().isoformat(
+                            timespec='seconds'
+                        ),
+                    },
+                    'results': results,
+                }, file, ensure_ascii=False, indent=2)
+            self.stdout.write(self.style.SUCCESS(
+                f'Результаты сохранены в {options["output"]}'
+            ))
+
+    def run_level(self, url, concurrency, options):
+        """Прогон одного адреса с concurrency параллельными клиентами."""
+        parts = urlsplit(url)
+        deadline = time.monotonic() + options['duration']
+        timings, errors, statuses = [], [], {}
+        lock = threading.Lock()
+        start = threading.Barrier(concurrency + 1)
+
+        def client(number):
+            generator = random.Random(options['seed'] * 1000 + number)
+            connection = http.client.HTTPConnection(
+                parts.hostname, parts.port, timeout=30
+            )
+            own_timings, own_statuses, own_errors = [], {}, 0
+            start.wait()
+            while time.monotonic() < deadline:
+                path = generator.choice(options['paths']).format(
+                    recipe=generator.choice(self.recipe_ids or [0])
+                )
+                started = time.perf_counter()
+                try:
+                    connection.request('GET', path, headers=self.headers)
+                    response = connection.getresponse()
+                    response.read()
+                except (OSError, http.client.HTTPException):
+                    own_errors += 1
+                    connection.close()
+                    continue
+                own_timings.append((time.perf_counter() - started) * 1000)
+                own_statuses[response.status] = (
+                    own_statuses.get(response.status, 0) + 1
+                )
+            connection.close()
+            with lock:
+                timings.extend(own_timings)
+                errors.append(own_errors)
+                for code, count in own_statuses.items():
+                    statuses[code] = statuses.get(code, 0) + count
+
+        threads = [
+            threading.Thread(target=client, args=(number,), daemon=True)
+            for number in range(concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        start.wait()
+        started = time.monotonic()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+        return {
+            'url': url,
+            'concurrency': concurrency,
+            'requests': len(timings),
+            'rps': round(len(timings) / elapsed, 1),
+            'p50_ms': round(percentile(timings, 50), 2) if timings else None,
+            'p95_ms': round(percentile(timings, 95), 2) if timings else None,
+            'p99_ms': round(percentile(timings, 99), 2) if timings else None,
+            'errors': sum(errors),
+            'status': {str(code): count for code, count in sorted(
+                statuses.items()
+            )},
+        }
+
+    def print_row(self, row):
+        self.stdout.write(
+            f'{row["url"]:<28}{row["concurrency"]:>6}{row["rps"]:>10.1f} '
+            f'rps  p50 {row["p50_ms"]} мс  p95 {row["p95_ms"]} мс  '
+            f'p99 {row["p99_ms"]} мс  ошибок {row["errors"]}  '
+            f'{row["status"]}'
+        )
+
+    def compare(self, results, urls):
+        """Пропускная способность остальных адресов относительно первого."""
+        baseline = {
+            row['concurrency']: row['rps']
+            for row in results if row['url'] == urls[0]
+        }
+        for row in results:
+            old = baseline.get(row['concurrency'])
+            if row['url'] == urls[0] or not old:
+                continue
+            self.stdout.write(
+                f'{row["url"]} / {urls[0]} при {row["concurrency"]}: '
+                f'{row["rps"] / old:.2f}x rps'
+            )
@@ -0,0 +1,98 @@
+import json
+import sys
+
+from django.core.management.base import BaseCommand
+
+from recipes.catalog import catalog
+from recipes.models import Recipe, RecipeIngredient
+
+RECIPE_FIELDS = (
+    'pk', 'name', 'text', 'cooking_time', 'pub_date', 'image',
+    'author__email', 'author__username', 'author__first_name',
+    'author__last_name',
+)
+
+
+class Command(BaseCommand):
+    """
+    Выгрузка рецептов в NDJSON: одна строка — один рецепт.
+
+    Автор, теги и ингредиенты записываются естественными ключами
+    (email, слаг, название с единицей измерения), картинка — путем
+    относительно MEDIA_ROOT. Рецепты читаются пачками по первичному
+    ключу, теги и ингредиенты берутся из справочника в памяти.
+    """
+    help = 'Выгрузка рецептов в NDJSON для import_recipes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?', default='-',
+            help='Файл для выгрузки, по умолчанию стандартный вывод.'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=2_000,
+            help='Количество рецептов, читаемых за один запрос.'
+        )
+
+    def handle(self, *args, **options):
+        if options['path'] == '-':
+            exported = self.export(sys.stdout, options['batch_size'])
+        else:
+            with open(options['path'], 'w', encoding='utf-8') as file:
+                exported = self.export(file, options['batch_size'])
+        self.stderr.write(self.style.SUCCESS(
+            f'Выгружено рецептов: {exported}.'
+        ))
+
+    def export(self, file, batch_size):
+        tags = catalog.tags.by_id
+        ingredients = catalog.ingredients.by_id
+        exported = 0
+        last_pk = 0
+        while True:
+            recipes = list(
+                Recipe.objects.filter(pk__gt=last_pk).order_by(
+                    'pk'
+                ).values_list(*RECIPE_FIELDS)[:batch_size]
+            )
+            if not recipes:
+                return exported
+            last_pk = recipes[-1][0]
+            pks = [recipe[0] for recipe in recipes]
+            recipe_tags = {pk: [] for pk in pks}
+            for recipe_id, tag_id in Recipe.tags.through.objects.filter(
+                recipe_id__in=pks
+            ).values_list('recipe_id', 'tag_id'):
+                recipe_tags[recipe_id].append(tags[tag_id]['slug'])
+            recipe_ingredients = {pk: [] for pk in pks}
+            for recipe_id, ingredient_id, amount in (
+                RecipeIngredient.objects.filter(
+                    recipe_id__in=pks
+                ).values_list('recipe_id', 'ingredient_id', 'amount')
+            ):
+                ingredient = ingredients[ingredient_id]
+                recipe_ingredients[recipe_id].append({
+                    'name': ingredient['name'],
+                    'measurement_unit': ingredient['measurement_unit'],
+                    'amount': amount,
+                })
+            file.writelines(
+                json.dumps({
+                    'name': name,
+                    'text': text,
+                    'cooking_time': cooking_time,
+                    'pub_date': pub_date.isoformat(),
+                    'image': image,
+                    'author': {
+                        'email': email,
+                        'username': username,
+                        'first_name': first_name,
+                        'last_name': last_name,
+                    },
+                    'tags': recipe_tags[pk],
+                    'ingredients': recipe_ingredients[pk],
+                }, ensure_ascii=False) + '\n'
+                for (pk, name, text, cooking_time, pub_date, image, email,
+                     username, first_name, last_name) in recipes
+            )
+            exported += len(recipes)
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+
+from recipes.image_variants import IMAGE_FIELDS, executor, run_build_variants
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    """Построение недостающих копий картинок для уже загруженных данных."""
+    help = 'Строит уменьшенные WebP-копии картинок рецептов и аватаров'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Перестроить копии, даже если они актуальны.'
+        )
+        parser.add_argument(
+            '--recipes-from', type=int, metavar='PK',
+            help='Только рецепты с pk не меньше PK (после import_recipes).'
+        )
+
+    def handle(self, *args, **options):
+        for model, (field, _) in IMAGE_FIELDS.items():
+            rows = model.objects.exclude(**{field: ''}).exclude(
+                **{f'{field}__isnull': True}
+            )
+            if options['recipes_from'] is not None:
+                if model is not Recipe:
+                    continue
+                rows = rows.filter(pk__gte=options['recipes_from'])
+            rows = rows.values_list('pk', field, f'{field}_variants')
+            futures = [
+                executor.submit(run_build_variants, model, pk, name)
+                for pk, name, variants in rows.iterator()
+                if options['force'] or variants.get('source') != name
+            ]
+            # подробности ошибок run_build_variants пишет в лог
+            failed = sum(not future.result() for future in futures)
+            self.stdout.write(self.style.SUCCESS(
+                f'{model.__name__}: построено {len(futures) - failed}, '
+                f'ошибок {failed}.'
+            ))
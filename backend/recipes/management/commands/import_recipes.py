@@ -0,0 +1,393 @@
+import json
+import multiprocessing
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, wait
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Case, DateTimeField, Value, When
+from django.utils import timezone
+
+from recipes.catalog import catalog
+from recipes.counters import change_counters
+from recipes.files import copy_media_file, is_safe_name
+from recipes.models import (CatalogVersion, Ingredient, Recipe,
+                            RecipeIngredient, Tag, User)
+from recipes.search import recipes_changed
+
+
+class Command(BaseCommand):
+    """
+    Загрузка рецептов из NDJSON в формате export_recipes.
+
+    Рецепты, их ингредиенты и теги вставляются пачками через bulk_create,
+    авторы, теги и ингредиенты находятся по естественным ключам в словарях
+    в памяти. Сигналы при этом не срабатывают, поэтому счетчики рецептов
+    у авторов, тегов и ингредиентов меняются явно.
+
+    После каждой пачки позиция в файле сохраняется в файл контрольной
+    точки, и прерванная загрузка продолжается с нее. Рецепт, у которого
+    уже есть двойник с тем же автором, названием и датой публикации
+    (без даты — с тем же автором и названием), пропускается, поэтому
+    повторная загрузка пачки ничего не дублирует.
+
+    Файл приходит извне, поэтому имя картинки должно быть относительным
+    путем внутри медиакаталога, иначе запись пропускается. Картинки
+    копируются из --media-root в пуле процессов. Копии картинок после
+    загрузки строятся только для рецептов, начиная с первого
+    загруженного (его pk хранится в контрольной точке).
+    """
+    help = 'Загрузка рецептов из NDJSON, выгруженного export_recipes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл NDJSON с рецептами.')
+        parser.add_argument(
+            '--batch-size', type=int, default=1_000,
+            help='Количество рецептов в одной транзакции.'
+        )
+        parser.add_argument(
+            '--media-root',
+            help='Каталог, из которого копировать картинки рецептов.'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help='Количество процессов для копирования картинок.'
+        )
+        parser.add_argument(
+            '--checkpoint',
+            help='Файл контрольной точки, по умолчанию <path>.checkpoint.'
+        )
+        parser.add_argument(
+            '--restart', action='store_true',
+            help='Начать с начала файла, не читая контрольную точку.'
+        )
+        parser.add_argument(
+            '--create-missing', action='store_true',
+            help='Создавать отсутствующие ингредиенты.'
+        )
+        parser.add_argument(
+            '--skip-variants', action='store_true',
+            help='Не строить уменьшенные копии картинок после загрузки.'
+        )
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        if not path.is_file():
+            raise CommandError(f'Файл {path} не найден.')
+        checkpoint = Path(options['checkpoint'] or f'{path}.checkpoint')
+        state = {'offset': 0, 'line': 0, 'imported': 0, 'skipped': 0}
+        if checkpoint.exists() and not options['restart']:
+            state.update(json.loads(checkpoint.read_text()))
+            self.stdout.write(
+                f'Продолжение загрузки со строки {state["line"] + 1}.'
+            )
+        self.create_missing = options['create_missing']
+        self.authors = {}
+        self.tags = {
+            slug: tag['id'] for slug, tag in catalog.tags.by_slug.items()
+        }
+        self.ingredients = {
+            (name, measurement_unit): pk
+            for pk, name, measurement_unit in Ingredient.objects.values_list(
+                'id', 'name', 'measurement_unit'
+            )
+        }
+        self.created_ingredients = 0
+        pool = None
+        if options['media_root']:
+            pool = ProcessPoolExecutor(
+                max_workers=options['workers'],
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        imported = skipped = failed = 0
+        pending = None
+        started = time.perf_counter()
+        try:
+            with path.open('rb') as file:
+                file.seek(state['offset'])
+                while batch := self.read_batch(
+                    file, state, options['batch_size']
+                ):
+                    with transaction.atomic():
+                        recipes, batch_skipped = self.import_batch(batch)
+                    images = [recipe.image.name for recipe in recipes]
+                    if recipes and state.get('first_pk') is None:
+                        state['first_pk'] = min(
+                            recipe.pk for recipe in recipes
+                        )
+                    imported += len(images)
+                    skipped += batch_skipped
+                    state['offset'] = file.tell()
+                    state['imported'] += len(images)
+                    state['skipped'] += batch_skipped
+                    copies = []
+                    if pool is not None:
+                        copies = [
+                            pool.submit(
+                                copy_media_file, options['media_root'],
+                                settings.MEDIA_ROOT, image
+                            )
+                            for image in images
+                        ]
+                    # точка сохраняется, когда скопированы картинки пачки:
+                    # копирование идет параллельно с загрузкой следующей
+                    failed += self.finish(pending, checkpoint)
+                    pending = (dict(state), copies)
+                    if options['verbosity'] > 1:
+                        self.stdout.write(
+                            f'Строка {state["line"]}: загружено {imported}.'
+                        )
+            failed += self.finish(pending, checkpoint)
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+        if self.created_ingredients:
+            CatalogVersion.bump(Ingredient)
+            catalog.invalidate()
+        if imported:
+            # bulk_create не вызывает сигналы рецептов
+            recipes_changed()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Загружено рецептов: {imported} за {elapsed:.1f} с '
+            f'({imported / elapsed if elapsed else 0:.0f} в секунду), '
+            f'пропущено {skipped}, новых ингредиентов '
+            f'{self.created_ingredients}.'
+        ))
+        if failed:
+            self.stdout.write(self.style.ERROR(
+                f'Не удалось скопировать картинок: {failed}.'
+            ))
+        if state.get('first_pk') is not None and not options[
+            'skip_variants'
+        ]:
+            call_command(
+                'generate_image_variants', recipes_from=state['first_pk']
+            )
+
+    def read_batch(self, file, state, batch_size):
+        batch = []
+        while len(batch) < batch_size:
+            line = file.readline()
+            if not line:
+                break
+            state['line'] += 1
+            if not line.strip():
+                continue
+            try:
+                batch.append((state['line'], json.loads(line)))
+            except ValueError as error:
+                raise CommandError(f'Строка {state["line"]}: {error}')
+        return batch
+
+    def finish(self, pending, checkpoint):
+        """
+        Дожидается копирования картинок пачки и сохраняет ее контрольную
+        точку. Возвращает число неудачных копирований.
+        """
+        if pending is None:
+            return 0
+        state, copies = pending
+        wait(copies)
+        failed = 0
+        for future in copies:
+            if future.exception() is not None:
+                failed += 1
+                self.stderr.write(f'Картинка: {future.exception()}')
+        temporary = checkpoint.with_name(f'{checkpoint.name}.part')
+        temporary.write_text(json.dumps(state))
+        os.replace(temporary, checkpoint)
+        return failed
+
+    def skip(self, line, reason):
+        self.stderr.write(f'Строка {line} пропущена: {reason}.')
+
+    def resolve_authors(self, batch):
+        """Находит авторов по email, недостающих создает."""
+        authors = {
+            record['author']['email']: record['author']
+            for _, record in batch
+            if isinstance(record.get('author'), dict)
+            and record['author'].get('email')
+        }
+        missing = set(authors) - set(self.authors)
+        if not missing:
+            return
+        self.authors.update(
+            User.objects.filter(email__in=missing).values_list('email', 'id')
+        )
+        missing -= set(self.authors)
+        if not missing:
+            return
+        password = make_password(None)
+        User.objects.bulk_create(
+            (
+                User(
+                    email=email,
+                    username=authors[email].get('username') or email,
+                    first_name=authors[email].get('first_name', ''),
+                    last_name=authors[email].get('last_name', ''),
+                    password=password,
+                )
+                for email in missing
+            ),
+            ignore_conflicts=True,
+        )
+        self.authors.update(
+            User.objects.filter(email__in=missing).values_list('email', 'id')
+        )
+
+    def resolve_ingredients(self, batch):
+        """Создает отсутствующие ингредиенты, если это разрешено."""
+        if not self.create_missing:
+            return
+        missing = {
+            (item['name'], item['measurement_unit'])
+            for _, record in batch
+            for item in record.get('ingredients') or ()
+            if isinstance(item, dict)
+            and (item.get('name'), item.get('measurement_unit'))
+            not in self.ingredients
+            and item.get('name') and item.get('measurement_unit')
+        }
+        if not missing:
+            return
+        Ingredient.objects.bulk_create(
+            (Ingredient(name=name, measurement_unit=measurement_unit)
+             for name, measurement_unit in missing),
+            ignore_conflicts=True,
+        )
+        names = {name for name, _ in missing}
+        for pk, name, measurement_unit in Ingredient.objects.filter(
+            name__in=names
+        ).values_list('id', 'name', 'measurement_unit'):
+            key = (name, measurement_unit)
+            if key in missing and key not in self.ingredients:
+                self.ingredients[key] = pk
+                self.created_ingredients += 1
+
+    def parse(self, record):
+        """Рецепт, id тегов и {id ингредиента: количество} из записи."""
+        author_id = self.authors[record['author']['email']]
+        cooking_time = int(record['cooking_time'])
+        if cooking_time < 1:
+            raise ValueError('время приготовления меньше 1')
+        if not record['name'] or not record['image']:
+            raise ValueError('нет названия или картинки')
+        if not is_safe_name(record['image']):
+            raise ValueError(
+                f'недопустимое имя картинки {record["image"]!r}'
+            )
+        pub_date = record.get('pub_date')
+        if pub_date:
+            pub_date = datetime.fromisoformat(pub_date)
+            if timezone.is_naive(pub_date):
+                pub_date = timezone.make_aware(pub_date)
+        tag_ids = {self.tags[slug] for slug in record['tags']}
+        ingredients = Counter()
+        for item in record['ingredients']:
+            amount = int(item['amount'])
+            if amount < 1:
+                raise ValueError('количество ингредиента меньше 1')
+            ingredients[
+                self.ingredients[(item['name'], item['measurement_unit'])]
+            ] += amount
+        if not tag_ids or not ingredients:
+            raise ValueError('нет тегов или ингредиентов')
+        recipe = Recipe(
+            author_id=author_id,
+            name=record['name'],
+            text=record['text'],
+            cooking_time=cooking_time,
+            image=record['image'],
+        )
+        return recipe, pub_date, tag_ids, ingredients
+
+    def import_batch(self, batch):
+        """
+        Загружает пачку в текущей транзакции. Возвращает загруженные
+        рецепты и число пропущенных записей.
+        """
+        self.resolve_authors(batch)
+        self.resolve_ingredients(batch)
+        parsed = []
+        for line, record in batch:
+            try:
+                parsed.append(self.parse(record))
+            except KeyError as error:
+                self.skip(line, f'не найдено {error}')
+            except (TypeError, ValueError) as error:
+                self.skip(line, error)
+        existing = set()
+        for author_id, name, pub_date in Recipe.objects.filter(
+            author_id__in={recipe.author_id for recipe, *_ in parsed},
+            name__in={recipe.name for recipe, *_ in parsed},
+        ).values_list('author_id', 'name', 'pub_date'):
+            existing.add((author_id, name, pub_date))
+            existing.add((author_id, name))
+        new = []
+        for recipe, pub_date, tag_ids, ingredients in parsed:
+            # без даты публикации двойник — любой рецепт автора
+            # с тем же названием
+            key = (recipe.author_id, recipe.name) + (
+                (pub_date,) if pub_date is not None else ()
+            )
+            if key in existing:
+                continue
+            existing.add(key)
+            existing.add(key[:2])
+            new.append((recipe, pub_date, tag_ids, ingredients))
+        skipped = len(batch) - len(new)
+        if not new:
+            return [], skipped
+
+        recipes = Recipe.objects.bulk_create(recipe for recipe, *_ in new)
+        # auto_now_add подставил текущее время: возвращаем даты из файла
+        dated = {
+            recipe.pk: pub_date
+            for recipe, (_, pub_date, *_) in zip(recipes, new)
+            if pub_date is not None
+        }
+        if dated:
+            Recipe.objects.filter(pk__in=dated).update(pub_date=Case(
+                *(When(pk=pk, then=Value(pub_date))
+                  for pk, pub_date in dated.items()),
+                output_field=DateTimeField(),
+            ))
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(
+                recipe_id=recipe.pk, ingredient_id=ingredient_id,
+                amount=amount
+            )
+            for recipe, (_, _, _, ingredients) in zip(recipes, new)
+            for ingredient_id, amount in ingredients.items()
+        )
+        Recipe.tags.through.objects.bulk_create(
+            Recipe.tags.through(recipe_id=recipe.pk, tag_id=tag_id)
+            for recipe, (_, _, tag_ids, _) in zip(recipes, new)
+            for tag_id in tag_ids
+        )
+        change_counters(
+            User, 'recipes_count',
+            Counter(recipe.author_id for recipe in recipes)
+        )
+        change_counters(
+            Tag, 'recipes_count',
+            Counter(tag_id for _, _, tag_ids, _ in new for tag_id in tag_ids)
+        )
+        change_counters(
+            Ingredient, 'recipes_count',
+            Counter(
+                ingredient_id
+                for _, _, _, ingredients in new
+                for ingredient_id in ingredients
+            )
+        )
+        return recipes, skipped
@@ -4,7 +4,11 @@ from .base_loader import BaseLoader
 
 
 class Command(BaseLoader):
-    """Загрузка ингредиентов из JSON файла."""
+    """Загрузка ингредиентов из JSON, NDJSON или CSV файла."""
     model = Ingredient
     file_path = 'data/ingredients.json'
+    fields = ('name', 'measurement_unit')
+    # ключ — все поля записи, обновлять нечего: загрузка только добавляет
+    # новые ингредиенты (ON CONFLICT DO NOTHING), существующие не меняет
+    unique_fields = ('name', 'measurement_unit')
     help = 'Загрузка ингредиентов из data/ingredients.json'
@@ -4,7 +4,11 @@ from .base_loader import BaseLoader
 
 
 class Command(BaseLoader):
-    """Загрузка тегов из JSON файла."""
+    """Загрузка тегов из JSON, NDJSON или CSV файла."""
     model = Tag
     file_path = 'data/tags.json'
+    fields = ('name', 'color', 'slug')
+    # name и color тоже уникальны: их конфликты с другими слагами
+    # проверяет BaseLoader.check_conflicts до записи
+    unique_fields = ('slug',)
     help = 'Загрузка тегов из data/tags.json'
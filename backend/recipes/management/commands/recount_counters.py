@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+
+from recipes.counters import COUNTERS, recount
+from recipes.shopping_list import rebuild_shopping_lists
+
+
+class Command(BaseCommand):
+    """
+    Пересчет денормализованных счетчиков и сводных списков покупок
+    с исправлением расхождений.
+    """
+    help = (
+        'Пересчитывает счетчики рецептов, подписок и избранного '
+        'и сводные списки покупок'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=5_000,
+            help='Количество строк, проверяемых за один запрос.'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать расхождения, ничего не исправляя.'
+        )
+
+    def handle(self, *args, **options):
+        total = 0
+        for model, field, source, source_field in COUNTERS:
+            fixed = recount(
+                model, field, source, source_field,
+                options['batch_size'], options['dry_run']
+            )
+            total += fixed
+            self.stdout.write(
+                f'{model.__name__}.{field}: расхождений {fixed}'
+            )
+        fixed = rebuild_shopping_lists(
+            options['batch_size'], options['dry_run']
+        )
+        total += fixed
+        self.stdout.write(f'Сводные списки покупок: расхождений {fixed}')
+        action = 'Найдено' if options['dry_run'] else 'Исправлено'
+        self.stdout.write(self.style.SUCCESS(
+            f'{action} расхождений: {total}.'
+        ))
@@ -0,0 +1,437 @@
+import io
+import json
+import random
+import time
+from datetime import timedelta
+from itertools import accumulate, islice
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from PIL import Image, ImageDraw
+
+from recipes.constants import MAX_LENGTH_RECIPE_NAME
+from recipes.counters import COUNTERS, recount
+from recipes.image_variants import build_variants
+from recipes.models import (Favorite, Follow, Ingredient, Recipe,
+                            RecipeIngredient, ShoppingCart, ShoppingListItem,
+                            Tag, User)
+from recipes.search import recipes_changed
+from recipes.shopping_list import aggregate_carts
+
+FIRST_NAMES = (
+    'Анна', 'Иван', 'Мария', 'Петр', 'Ольга', 'Сергей', 'Елена', 'Андрей',
+    'Наталья', 'Дмитрий', 'Татьяна', 'Алексей', 'Ирина', 'Михаил',
+)
+LAST_NAMES = (
+    'Иванов', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев', 'Петров',
+    'Соколов', 'Михайлов', 'Новиков', 'Федоров', 'Морозов', 'Волков',
+)
+DISHES = (
+    'Салат', 'Суп', 'Запеканка', 'Пирог', 'Рагу', 'Паста', 'Омлет',
+    'Каша', 'Жаркое', 'Соус', 'Десерт', 'Смузи',
+)
+STEPS = (
+    'Подготовьте все ингредиенты.',
+    'Нарежьте овощи небольшими кусочками.',
+    'Разогрейте сковороду с маслом.',
+    'Перемешайте и доведите до кипения.',
+    'Готовьте на среднем огне, помешивая.',
+    'Дайте блюду настояться несколько минут.',
+    'Подавайте горячим.',
+)
+INGREDIENTS_PER_RECIPE = (3, 12)
+TAGS_PER_RECIPE = (1, 3)
+# попыток добрать различные элементы при выборке с весами
+SAMPLE_ATTEMPTS = 10
+COPY_ESCAPES = str.maketrans({
+    '\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r',
+})
+
+
+def power_law(count, exponent):
+    """Накопленные веса закона Ципфа для рангов 1..count."""
+    return list(accumulate(1 / rank ** exponent
+                           for rank in range(1, count + 1)))
+
+
+def sample(rng, population, cum_weights, size):
+    """До size различных элементов population, выбранных с весами."""
+    size = min(size, len(population))
+    chosen = set()
+    for _ in range(SAMPLE_ATTEMPTS):
+        chosen.update(rng.choices(
+            population, cum_weights=cum_weights, k=size - len(chosen)
+        ))
+        if len(chosen) >= size:
+            break
+    return chosen
+
+
+def copy_value(value):
+    """Значение в текстовом формате COPY."""
+    if value is None:
+        return r'\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value, ensure_ascii=False)
+    return str(value).translate(COPY_ESCAPES)
+
+
+def insert_rows(model, fields, rows):
+    """
+    Вставка кортежей без создания объектов моделей: COPY на PostgreSQL,
+    executemany на остальных базах. Поля модели, которых нет в fields,
+    кроме первичного ключа, получают значения по умолчанию.
+    """
+    quote = connection.ops.quote_name
+    opts = model._meta
+    defaults = [
+        field for field in opts.concrete_fields
+        if not field.primary_key and field.name not in fields
+    ]
+    columns = ', '.join(
+        quote(field.column)
+        for field in [*map(opts.get_field, fields), *defaults]
+    )
+    table = quote(opts.db_table)
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            tail = ''.join(
+                '\t' + copy_value(field.get_default()) for field in defaults
+            )
+            buffer = io.StringIO()
+            buffer.writelines(
+                '\t'.join(map(copy_value, row)) + tail + '\n'
+                for row in rows
+            )
+            buffer.seek(0)
+            cursor.copy_expert(
+                f'COPY {table} ({columns}) FROM STDIN', buffer
+            )
+        else:
+            tail = tuple(
+                field.get_db_prep_save(field.get_default(), connection)
+                for field in defaults
+            )
+            placeholders = ', '.join(['%s'] * (len(fields) + len(tail)))
+            cursor.executemany(
+                f'INSERT INTO {table} ({columns}) VALUES ({placeholders})',
+                [row + tail for row in rows],
+            )
+
+
+def next_pk(model):
+    return (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+
+
+class Command(BaseCommand):
+    """
+    Заполнение базы синтетическими данными для нагрузочных тестов.
+
+    Рецепты собираются из ингредиентов и тегов справочников, популярность
+    авторов, рецептов и ингредиентов подчиняется закону Ципфа: немногие
+    авторы собирают большую часть подписчиков, немногие рецепты — большую
+    часть избранного и корзин. Данные вставляются пачками, связи — COPY
+    на PostgreSQL и executemany на SQLite, счетчики и сводные списки
+    покупок считаются в конце. При одинаковом --seed на одинаковой
+    исходной базе получаются одинаковые данные.
+    """
+    help = 'Заполняет базу синтетическими пользователями и рецептами'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users', type=int, default=1_000,
+            help='Количество пользователей.'
+        )
+        parser.add_argument(
+            '--recipes', type=int, default=10_000,
+            help='Количество рецептов.'
+        )
+        parser.add_argument(
+            '--follows', type=int, default=20,
+            help='Среднее количество подписок у пользователя.'
+        )
+        parser.add_argument(
+            '--favorites', type=int, default=30,
+            help='Среднее количество рецептов в избранном.'
+        )
+        parser.add_argument(
+            '--cart', type=int, default=5,
+            help='Среднее количество рецептов в корзине.'
+        )
+        parser.add_argument(
+            '--exponent', type=float, default=1.1,
+            help='Показатель степени в законе Ципфа для популярности.'
+        )
+        parser.add_argument(
+            '--days', type=int, default=365,
+            help='За сколько последних дней распределить публикации.'
+        )
+        parser.add_argument(
+            '--images', type=int, default=8,
+            help='Количество картинок-заглушек для рецептов.'
+        )
+        parser.add_argument(
+            '--prefix', default='seed',
+            help='Префикс имен и почты создаваемых пользователей.'
+        )
+        parser.add_argument(
+            '--password', default='seed-password',
+            help='Пароль всех создаваемых пользователей.'
+        )
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Зерно генератора случайных чисел.'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=10_000,
+            help='Количество строк в одной вставке.'
+        )
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.exponent = options['exponent']
+        prefix = options['prefix']
+        if User.objects.filter(username__startswith=f'{prefix}-').exists():
+            raise CommandError(
+                f'Пользователи с префиксом {prefix} уже есть, '
+                'укажите другой --prefix.'
+            )
+        self.ingredient_ids = list(
+            Ingredient.objects.order_by('pk').values_list('pk', flat=True)
+        )
+        self.tag_ids = list(
+            Tag.objects.order_by('pk').values_list('pk', flat=True)
+        )
+        if not self.ingredient_ids or not self.tag_ids:
+            raise CommandError(
+                'Справочники пусты, выполните load_ingredients и load_tags.'
+            )
+        self.ingredient_names = dict(
+            Ingredient.objects.values_list('pk', 'name')
+        )
+        started = time.perf_counter()
+        with transaction.atomic():
+            user_ids = self.create_users(options)
+            images = self.create_images(prefix, options['images'])
+            recipe_ids = self.create_recipes(user_ids, images, options)
+            links = self.create_follows(user_ids, options['follows'])
+            for model, mean in (
+                (Favorite, options['favorites']),
+                (ShoppingCart, options['cart']),
+            ):
+                links += self.create_user_recipes(
+                    model, user_ids, recipe_ids, mean
+                )
+            # первичные ключи заданы явно: сдвигаем последовательности
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(
+                    no_style(), [User, Recipe]
+                ):
+                    cursor.execute(sql)
+            for model, field, source, source_field in COUNTERS:
+                recount(
+                    model, field, source, source_field, self.batch_size
+                )
+            self.create_shopping_lists(user_ids)
+            # рецепты созданы без сигналов: индекс поиска перестроится
+            recipes_changed()
+        self.build_image_variants(images)
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано пользователей {len(user_ids)}, рецептов '
+            f'{len(recipe_ids)}, связей {links} за '
+            f'{time.perf_counter() - started:.1f} с.'
+        ))
+
+    def ranked(self, ids):
+        """Элементы в случайном порядке популярности и их веса."""
+        ids = list(ids)
+        self.random.shuffle(ids)
+        return ids, power_law(len(ids), self.exponent)
+
+    def create_users(self, options):
+        prefix = options['prefix']
+        password = make_password(options['password'])
+        first = next_pk(User)
+        self.insert_batches(
+            User,
+            ('id', 'username', 'email', 'first_name', 'last_name',
+             'password'),
+            (
+                (
+                    first + number,
+                    f'{prefix}-{number}',
+                    f'{prefix}-{number}@example.com',
+                    self.random.choice(FIRST_NAMES),
+                    self.random.choice(LAST_NAMES),
+                    password,
+                )
+                for number in range(options['users'])
+            ),
+        )
+        return list(range(first, first + options['users']))
+
+    def create_images(self, prefix, count):
+        """Картинки-заглушки: тарелка на цветном фоне."""
+        storage = Recipe._meta.get_field('image').storage
+        names = []
+        for number in range(count):
+            background = tuple(self.random.randrange(256) for _ in range(3))
+            plate = tuple(self.random.randrange(128, 256) for _ in range(3))
+            image = Image.new('RGB', (1280, 960), background)
+            ImageDraw.Draw(image).ellipse((240, 80, 1040, 880), fill=plate)
+            buffer = io.BytesIO()
+            image.save(buffer, 'JPEG', quality=85)
+            # заглушки перезаписываются, чтобы имена не зависели от
+            # предыдущих запусков
+            name = f'recipes/images/{prefix}-{number}.jpg'
+            storage.delete(name)
+            names.append(storage.save(name, ContentFile(buffer.getvalue())))
+        return names
+
+    def create_recipes(self, user_ids, images, options):
+        authors, author_weights = self.ranked(user_ids)
+        ingredients, ingredient_weights = self.ranked(self.ingredient_ids)
+        tags, tag_weights = self.ranked(self.tag_ids)
+        pub_date = Recipe._meta.get_field('pub_date')
+        now = timezone.now()
+        period = timedelta(days=options['days']).total_seconds()
+        first = next_pk(Recipe)
+        recipe_ids = range(first, first + options['recipes'])
+        for batch in (
+            recipe_ids[start:start + self.batch_size]
+            for start in range(0, len(recipe_ids), self.batch_size)
+        ):
+            compositions = {
+                pk: (
+                    sample(
+                        self.random, ingredients, ingredient_weights,
+                        self.random.randint(*INGREDIENTS_PER_RECIPE)
+                    ),
+                    sample(
+                        self.random, tags, tag_weights,
+                        self.random.randint(*TAGS_PER_RECIPE)
+                    ),
+                )
+                for pk in batch
+            }
+            insert_rows(
+                Recipe,
+                ('id', 'author', 'name', 'text', 'cooking_time', 'image',
+                 'pub_date'),
+                [
+                    (
+                        pk,
+                        self.random.choices(
+                            authors, cum_weights=author_weights
+                        )[0],
+                        self.recipe_name(recipe_ingredients),
+                        ' '.join(self.random.choices(
+                            STEPS, k=self.random.randint(2, 8)
+                        )),
+                        self.random.randint(5, 180),
+                        self.random.choice(images),
+                        pub_date.get_db_prep_save(
+                            now - timedelta(
+                                seconds=self.random.uniform(0, period)
+                            ),
+                            connection,
+                        ),
+                    )
+                    for pk, (recipe_ingredients, _) in compositions.items()
+                ],
+            )
+            insert_rows(
+                RecipeIngredient, ('recipe', 'ingredient', 'amount'),
+                [
+                    (pk, ingredient_id, self.amount())
+                    for pk, (recipe_ingredients, _) in compositions.items()
+                    for ingredient_id in sorted(recipe_ingredients)
+                ],
+            )
+            insert_rows(
+                Recipe.tags.through, ('recipe', 'tag'),
+                [
+                    (pk, tag_id)
+                    for pk, (_, recipe_tags) in compositions.items()
+                    for tag_id in sorted(recipe_tags)
+                ],
+            )
+        return list(recipe_ids)
+
+    def recipe_name(self, ingredient_ids):
+        main = self.ingredient_names[min(ingredient_ids)]
+        return f'{self.random.choice(DISHES)}: {main}'[
+            :MAX_LENGTH_RECIPE_NAME
+        ]
+
+    def amount(self):
+        """Количество ингредиента: обычно десятки, изредка тысячи."""
+        return max(1, min(5_000, round(self.random.lognormvariate(4, 1))))
+
+    def degree(self, mean, limit):
+        """Число связей пользователя: экспоненциальное со средним mean."""
+        if mean <= 0:
+            return 0
+        return min(limit, int(self.random.expovariate(1 / mean)))
+
+    def insert_batches(self, model, fields, rows):
+        """Вставляет строки пачками, возвращает их количество."""
+        total = 0
+        rows = iter(rows)
+        while batch := list(islice(rows, self.batch_size)):
+            insert_rows(model, fields, batch)
+            total += len(batch)
+        return total
+
+    def create_follows(self, user_ids, mean):
+        authors, weights = self.ranked(user_ids)
+        links = (
+            (user_id, author_id)
+            for user_id in user_ids
+            for author_id in sorted(sample(
+                self.random, authors, weights,
+                self.degree(mean, len(authors))
+            ) - {user_id})
+        )
+        return self.insert_batches(Follow, ('user', 'author'), links)
+
+    def create_user_recipes(self, model, user_ids, recipe_ids, mean):
+        recipes, weights = self.ranked(recipe_ids)
+        links = (
+            (user_id, recipe_id)
+            for user_id in user_ids
+            for recipe_id in sorted(sample(
+                self.random, recipes, weights,
+                self.degree(mean, len(recipes))
+            ))
+        )
+        return self.insert_batches(model, ('user', 'recipe'), links)
+
+    def create_shopping_lists(self, user_ids):
+        """Сводные списки новых пользователей прямо из их корзин."""
+        for start in range(0, len(user_ids), self.batch_size):
+            insert_rows(
+                ShoppingListItem,
+                ('user', 'ingredient', 'total_amount', 'recipe_count'),
+                list(aggregate_carts(user_ids[start:start + self.batch_size])),
+            )
+
+    def build_image_variants(self, images):
+        """Копии строятся один раз на заглушку и проставляются всем."""
+        for name in images:
+            recipe = Recipe.objects.filter(image=name).only('pk').first()
+            if recipe is None:
+                continue
+            build_variants(Recipe, recipe.pk, name)
+            recipe.refresh_from_db(fields=['image_variants'])
+            Recipe.objects.filter(image=name).update(
+                image_variants=recipe.image_variants
+            )
@@ -0,0 +1,45 @@
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.operations import TrigramExtension
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+
+SEARCH_INDEXES = (
+    GinIndex(
+        SearchVector('name', weight='A', config='russian')
+        + SearchVector('text', weight='B', config='russian'),
+        name='recipe_search_vector_idx',
+    ),
+    GinIndex(
+        OpClass('name', name='gin_trgm_ops'),
+        name='recipe_name_trgm_idx',
+    ),
+)
+
+
+def add_search_indexes(apps, schema_editor):
+    """Индексы полнотекстового поиска нужны только на PostgreSQL."""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    recipe = apps.get_model('recipes', 'Recipe')
+    for index in SEARCH_INDEXES:
+        schema_editor.add_index(recipe, index)
+
+
+def remove_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    recipe = apps.get_model('recipes', 'Recipe')
+    for index in SEARCH_INDEXES:
+        schema_editor.remove_index(recipe, index)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0003_catalogversion'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.RunPython(add_search_indexes, remove_search_indexes),
+    ]
@@ -0,0 +1,45 @@
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.db import migrations
+from django.db.models import Index
+from django.db.models.functions import Upper
+
+# icontains и istartswith на PostgreSQL сравнивают UPPER(поле) LIKE
+# UPPER(шаблон), поэтому индексы строятся по UPPER(поле)
+ADMIN_SEARCH_INDEXES = (
+    ('Recipe', GinIndex(
+        OpClass(Upper('name'), name='gin_trgm_ops'),
+        name='recipe_name_upper_trgm_idx',
+    )),
+    ('Ingredient', Index(
+        OpClass(Upper('name'), name='text_pattern_ops'),
+        name='ingredient_name_upper_like_idx',
+    )),
+)
+
+
+def add_search_indexes(apps, schema_editor):
+    """Индексы нужны только на PostgreSQL."""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for model_name, index in ADMIN_SEARCH_INDEXES:
+        schema_editor.add_index(apps.get_model('recipes', model_name), index)
+
+
+def remove_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for model_name, index in ADMIN_SEARCH_INDEXES:
+        schema_editor.remove_index(
+            apps.get_model('recipes', model_name), index
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_image_variants'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_search_indexes, remove_search_indexes),
+    ]
@@ -1,6 +1,8 @@
 from django.contrib.auth.models import AbstractUser
 from django.core.validators import MinValueValidator, RegexValidator
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Exists, F, OuterRef
+from django.utils import timezone
 
 from .constants import (MAX_LENGTH_INGREDIENT_NAME, MAX_LENGTH_INGREDIENT_UNIT,
                         MAX_LENGTH_RECIPE_NAME, MAX_LENGTH_TAG_NAME,
@@ -33,9 +35,26 @@ class User(AbstractUser):
         blank=True,
         null=True
     )
+    avatar_variants = models.JSONField(
+        'Копии аватара', default=dict, blank=True, editable=False
+    )
+    recipes_count = models.PositiveIntegerField(
+        'Рецептов', default=0, editable=False
+    )
+    followers_count = models.PositiveIntegerField(
+        'Подписчиков', default=0, editable=False
+    )
+    following_count = models.PositiveIntegerField(
+        'Подписок', default=0, editable=False
+    )
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username', 'first_name', 'last_name']
+    # меняются только UPDATE-запросами (счетчики, сборка копий аватара)
+    DERIVED_FIELDS = frozenset((
+        'avatar_variants', 'recipes_count', 'followers_count',
+        'following_count',
+    ))
 
     class Meta:
         verbose_name = 'Пользователь'
@@ -45,6 +64,22 @@ class User(AbstractUser):
     def __str__(self):
         return self.username
 
+    def save(self, *args, **kwargs):
+        """
+        Полное сохранение существующего пользователя не пишет
+        DERIVED_FIELDS: request.user берется из кэша токенов
+        (api/authentication.py) и может хранить устаревшие значения.
+        """
+        if (not self._state.adding and not args
+                and not kwargs.get('force_insert')
+                and kwargs.get('update_fields') is None):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.DERIVED_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
 
 class Follow(models.Model):
     """Модель для подписок пользователей друг на друга."""
@@ -80,6 +115,9 @@ class Tag(models.Model):
     slug = models.SlugField(
         'Уникальный слаг', max_length=MAX_LENGTH_TAG_SLUG, unique=True
     )
+    recipes_count = models.PositiveIntegerField(
+        'В рецептах', default=0, editable=False
+    )
 
     class Meta:
         verbose_name = 'Тег'
@@ -98,6 +136,9 @@ class Ingredient(models.Model):
     measurement_unit = models.CharField(
         'Единица измерения', max_length=MAX_LENGTH_INGREDIENT_UNIT
     )
+    recipes_count = models.PositiveIntegerField(
+        'В рецептах', default=0, editable=False
+    )
 
     class Meta:
         verbose_name = 'Ингредиент'
@@ -114,6 +155,64 @@ class Ingredient(models.Model):
         return f'{self.name}, {self.measurement_unit}'
 
 
+class RecipeQuerySet(models.QuerySet):
+    """Выборка рецептов с признаками, зависящими от пользователя."""
+
+    def with_user_flags(self, user):
+        """
+        Добавляет is_favorited, is_in_shopping_cart и is_author_subscribed
+        подзапросами EXISTS, чтобы сериализатор не ходил в базу
+        за каждым рецептом.
+        """
+        if not user.is_authenticated:
+            return self
+        return self.annotate(
+            is_favorited=Exists(Favorite.objects.filter(
+                user=user, recipe=OuterRef('pk')
+            )),
+            is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                user=user, recipe=OuterRef('pk')
+            )),
+            is_author_subscribed=Exists(Follow.objects.filter(
+                user=user, author=OuterRef('author')
+            )),
+        )
+
+    def bump_version(self):
+        """Сбрасывает закэшированные представления выбранных рецептов."""
+        return self.update(version=F('version') + 1)
+
+
+class PendingVersions(set):
+    """pk рецептов, версии которых поменяются после коммита."""
+
+    def __call__(self):
+        if self:
+            Recipe.objects.filter(pk__in=self).bump_version()
+
+
+def bump_recipe_versions(pks):
+    """
+    Меняет версии рецептов один раз за транзакцию. Запись рецепта
+    задевает несколько сигналов (сам рецепт, ингредиенты, теги), поэтому
+    внутри транзакции pk копятся и после коммита версии меняются одним
+    UPDATE. Вне транзакции версии меняются сразу.
+    """
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        Recipe.objects.filter(pk__in=pks).bump_version()
+        return
+    pending = getattr(connection, 'pending_recipe_versions', None)
+    # колбэк выброшен при откате транзакции или точки сохранения
+    # или уже выполнен: начинается новый набор
+    if pending is None or not any(
+        callback[1] is pending for callback in connection.run_on_commit
+    ):
+        pending = connection.pending_recipe_versions = PendingVersions()
+        transaction.on_commit(pending)
+    pending.update(pks)
+
+
 class Recipe(models.Model):
     """Модель рецепта."""
     author = models.ForeignKey(
@@ -124,6 +223,9 @@ class Recipe(models.Model):
     )
     name = models.CharField('Название', max_length=MAX_LENGTH_RECIPE_NAME)
     image = models.ImageField('Картинка', upload_to='recipes/images/')
+    image_variants = models.JSONField(
+        'Копии картинки', default=dict, blank=True, editable=False
+    )
     text = models.TextField('Описание')
     ingredients = models.ManyToManyField(
         Ingredient,
@@ -146,6 +248,17 @@ class Recipe(models.Model):
     pub_date = models.DateTimeField(
         'Дата публикации', auto_now_add=True, db_index=True
     )
+    version = models.PositiveIntegerField(
+        'Версия', default=0, editable=False
+    )
+    favorites_count = models.PositiveIntegerField(
+        'В избранном', default=0, editable=False
+    )
+    in_carts_count = models.PositiveIntegerField(
+        'В списках покупок', default=0, editable=False
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Рецепт'
@@ -224,3 +337,80 @@ class ShoppingCart(UserRecipeList):
         default_related_name = 'shopping_carts'
         verbose_name = 'Список покупок'
         verbose_name_plural = 'Списки покупок'
+
+
+class ShoppingListItem(models.Model):
+    """
+    Строка сводного списка покупок: сколько ингредиента нужно
+    пользователю по всем рецептам из его корзины. Поддерживается
+    сигналами при изменении корзины и состава рецептов.
+    """
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, verbose_name='Пользователь'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient, on_delete=models.CASCADE, verbose_name='Ингредиент'
+    )
+    total_amount = models.PositiveIntegerField('Количество', default=0)
+    recipe_count = models.PositiveIntegerField('Рецептов', default=0)
+
+    class Meta:
+        default_related_name = 'shopping_list_items'
+        verbose_name = 'Строка списка покупок'
+        verbose_name_plural = 'Сводные списки покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_shopping_list_item',
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.ingredient} — {self.total_amount}'
+
+
+class CatalogVersion(models.Model):
+    """
+    Версия справочника (тегов или ингредиентов) или рецептов.
+
+    Увеличивается при каждом изменении справочника, по ней процессы
+    сбрасывают свои копии справочников в памяти. Версия рецептов
+    нужна поисковому индексу SQLite (recipes/search.py).
+    """
+    name = models.CharField('Справочник', max_length=32, unique=True)
+    version = models.PositiveIntegerField('Версия', default=0)
+    updated_at = models.DateTimeField('Дата изменения', default=timezone.now)
+
+    class Meta:
+        verbose_name = 'Версия справочника'
+        verbose_name_plural = 'Версии справочников'
+
+    def __str__(self):
+        return f'{self.name} v{self.version}'
+
+    @classmethod
+    def bump(cls, model):
+        """Отмечает изменение справочника для модели model."""
+        name = model._meta.model_name
+        cls.objects.get_or_create(name=name)
+        cls.objects.filter(name=name).update(
+            version=F('version') + 1, updated_at=timezone.now()
+        )
+
+
+class RecipeChange(models.Model):
+    """
+    Рецепт, измененный в версии recipe таблицы CatalogVersion. По этому
+    журналу индекс поиска SQLite (recipes/search.py) обновляет только
+    измененные рецепты. Первичный ключ рецепта хранится без внешнего
+    ключа: запись об удалении рецепта должна остаться.
+    """
+    version = models.PositiveIntegerField('Версия', db_index=True)
+    recipe_id = models.PositiveBigIntegerField('Рецепт')
+
+    class Meta:
+        verbose_name = 'Изменение рецепта'
+        verbose_name_plural = 'Изменения рецептов'
+
+    def __str__(self):
+        return f'{self.recipe_id} v{self.version}'
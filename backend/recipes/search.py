@@ -0,0 +1,263 @@
+"""
+Полнотекстовый поиск рецептов по названию и описанию.
+
+На PostgreSQL используется tsvector (конфигурация russian) с GIN-индексом
+и триграммное сходство названия для опечаток. На SQLite — инвертированный
+индекс в памяти процесса. Сохранение и удаление рецепта в любом процессе
+увеличивает версию recipe в таблице CatalogVersion и записывает
+рецепт в журнал RecipeChange. При первом поиске после смены версии
+индекс перечитывает только рецепты из журнала; целиком он
+перестраивается при первом поиске в процессе, после массовых
+изменений без журнала (импорт, генерация данных) и если журнал
+за пропущенные версии уже очищен.
+
+На SQLite выдача ограничена SEARCH_RESULTS_LIMIT лучшими рецептами:
+count в ответе и страницы считаются только по ним. На PostgreSQL
+ограничения нет.
+"""
+import re
+import threading
+from bisect import bisect_left, insort
+from collections import defaultdict
+
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector,
+                                            TrigramWordSimilarity)
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Case, FloatField, Q, Value, When
+
+from .models import CatalogVersion, Recipe, RecipeChange
+
+SEARCH_CONFIG = 'russian'
+SEARCH_VECTOR = (
+    SearchVector('name', weight='A', config=SEARCH_CONFIG)
+    + SearchVector('text', weight='B', config=SEARCH_CONFIG)
+)
+# только для индекса SQLite, см. описание модуля
+SEARCH_RESULTS_LIMIT = 500
+NAME_WEIGHT = 1.0
+TEXT_WEIGHT = 0.4
+PREFIX_QUALITY = 0.8
+FUZZY_QUALITY = 0.6
+FUZZY_THRESHOLD = 0.4
+MIN_STEM_LENGTH = 3
+# сколько последних версий хранит журнал RecipeChange
+RECIPE_CHANGES_KEPT = 1000
+
+
+def tokenize(text):
+    return re.findall(r'\w+', text.casefold().replace('ё', 'е'))
+
+
+def trigrams(token):
+    padded = f'  {token} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class RecipeSearchIndex:
+    """Инвертированный индекс рецептов для поиска без PostgreSQL."""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.version = None
+        self.clear()
+
+    def clear(self):
+        self.postings = defaultdict(dict)
+        self.documents = {}
+        self.vocabulary = []
+        self.trigrams = defaultdict(set)
+
+    def build(self):
+        """
+        Обновляет индекс, если версия рецептов сменилась. Версия
+        читается до журнала и рецептов: изменение между чтениями
+        приведет к лишнему обновлению при следующем поиске, но не
+        к устаревшему индексу.
+        """
+        version = current_version()
+        with self.lock:
+            if version == self.version:
+                return
+            changed = self.changed_since(version)
+            recipes = Recipe.objects.values_list('id', 'name', 'text')
+            if changed is None:
+                self.clear()
+            else:
+                recipes = recipes.filter(id__in=changed)
+                for recipe_id in changed:
+                    self.remove(recipe_id)
+            for recipe_id, name, text in recipes.iterator():
+                self.add(recipe_id, name, text)
+            self.version = version
+
+    def changed_since(self, version):
+        """
+        Рецепты, измененные после версии индекса до version, или None,
+        если журнал покрывает не все эти версии.
+        """
+        if (self.version is None
+                or not 0 < version - self.version <= RECIPE_CHANGES_KEPT):
+            return None
+        versions = set()
+        changed = set()
+        for change_version, recipe_id in RecipeChange.objects.filter(
+            version__gt=self.version, version__lte=version
+        ).values_list('version', 'recipe_id'):
+            versions.add(change_version)
+            changed.add(recipe_id)
+        if len(versions) != version - self.version:
+            return None
+        return changed
+
+    def add(self, recipe_id, name, text):
+        with self.lock:
+            self.remove(recipe_id)
+            weights = defaultdict(float)
+            for token in tokenize(name):
+                weights[token] += NAME_WEIGHT
+            for token in tokenize(text):
+                weights[token] += TEXT_WEIGHT
+            for token, weight in weights.items():
+                if token not in self.postings:
+                    insort(self.vocabulary, token)
+                    for trigram in trigrams(token):
+                        self.trigrams[trigram].add(token)
+                self.postings[token][recipe_id] = weight
+            self.documents[recipe_id] = set(weights)
+
+    def remove(self, recipe_id):
+        with self.lock:
+            for token in self.documents.pop(recipe_id, ()):
+                postings = self.postings[token]
+                postings.pop(recipe_id, None)
+                if postings:
+                    continue
+                del self.postings[token]
+                del self.vocabulary[bisect_left(self.vocabulary, token)]
+                for trigram in trigrams(token):
+                    self.trigrams[trigram].discard(token)
+
+    def match(self, word):
+        """
+        Слова словаря, подходящие к слову запроса, с качеством совпадения:
+        точное, по общей основе (грубая замена стемминга) или похожее
+        по триграммам, если ничего другого не нашлось.
+        """
+        matches = {}
+        if word in self.postings:
+            matches[word] = 1.0
+        stem = word[:max(MIN_STEM_LENGTH, len(word) - 2)]
+        position = bisect_left(self.vocabulary, stem)
+        for token in self.vocabulary[position:]:
+            if not token.startswith(stem):
+                break
+            matches.setdefault(token, PREFIX_QUALITY)
+        if matches:
+            return matches
+        word_trigrams = trigrams(word)
+        candidates = set().union(
+            *(self.trigrams.get(trigram, ()) for trigram in word_trigrams)
+        )
+        for token in candidates:
+            token_trigrams = trigrams(token)
+            similarity = (
+                len(word_trigrams & token_trigrams)
+                / len(word_trigrams | token_trigrams)
+            )
+            if similarity >= FUZZY_THRESHOLD:
+                matches[token] = FUZZY_QUALITY * similarity
+        return matches
+
+    def search(self, query, limit=SEARCH_RESULTS_LIMIT):
+        """Список (id рецепта, релевантность), лучшие первыми."""
+        self.build()
+        words = tokenize(query)
+        if not words:
+            return []
+        scores = None
+        with self.lock:
+            for word in words:
+                word_scores = defaultdict(float)
+                for token, quality in self.match(word).items():
+                    for recipe_id, weight in self.postings[token].items():
+                        word_scores[recipe_id] = max(
+                            word_scores[recipe_id], quality * weight
+                        )
+                if scores is None:
+                    scores = word_scores
+                else:
+                    scores = {
+                        recipe_id: score + word_scores[recipe_id]
+                        for recipe_id, score in scores.items()
+                        if recipe_id in word_scores
+                    }
+        return sorted(
+            scores.items(), key=lambda item: (-item[1], -item[0])
+        )[:limit]
+
+
+search_index = RecipeSearchIndex()
+
+
+def current_version():
+    return CatalogVersion.objects.filter(
+        name=Recipe._meta.model_name
+    ).values_list('version', flat=True).first() or 0
+
+
+def recipes_changed(recipe_ids=None):
+    """
+    Отмечает изменение рецептов recipe_ids для индексов всех процессов;
+    без recipe_ids индексы перестроятся целиком. На PostgreSQL индекс
+    в памяти не используется, и запись не нужна.
+    """
+    if connections[DEFAULT_DB_ALIAS].vendor == 'postgresql':
+        return
+    if recipe_ids is not None:
+        recipe_ids = set(recipe_ids)
+        if not recipe_ids:
+            return
+    # версия и журнал видны другим процессам только вместе
+    with transaction.atomic():
+        CatalogVersion.bump(Recipe)
+        if recipe_ids is None:
+            return
+        version = current_version()
+        RecipeChange.objects.bulk_create(
+            RecipeChange(version=version, recipe_id=recipe_id)
+            for recipe_id in recipe_ids
+        )
+        if version % RECIPE_CHANGES_KEPT == 0:
+            RecipeChange.objects.filter(
+                version__lte=version - RECIPE_CHANGES_KEPT
+            ).delete()
+
+
+def search_recipes(queryset, query):
+    """Отбирает рецепты по запросу и сортирует их по релевантности."""
+    if connections[queryset.db].vendor == 'postgresql':
+        search_query = SearchQuery(
+            query, config=SEARCH_CONFIG, search_type='websearch'
+        )
+        return queryset.alias(
+            search=SEARCH_VECTOR
+        ).annotate(
+            relevance=(
+                SearchRank(SEARCH_VECTOR, search_query)
+                + TrigramWordSimilarity(query, 'name')
+            )
+        ).filter(
+            Q(search=search_query) | Q(name__trigram_word_similar=query)
+        ).order_by('-relevance', '-pub_date')
+    results = search_index.search(query)
+    return queryset.filter(
+        id__in=[recipe_id for recipe_id, _ in results]
+    ).annotate(
+        relevance=Case(
+            *(When(id=recipe_id, then=Value(score))
+              for recipe_id, score in results),
+            default=Value(0.0),
+            output_field=FloatField(),
+        )
+    ).order_by('-relevance', '-pub_date')
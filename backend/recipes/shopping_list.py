@@ -0,0 +1,319 @@
+"""
+Сводный список покупок и его выгрузка в форматах txt, csv, json и md.
+
+Сводный список (ShoppingListItem) хранит для каждого пользователя сумму
+по каждому ингредиенту из рецептов его корзины и меняется сигналами
+на приращения: добавление рецепта в корзину, удаление из нее и правку
+состава рецептов, которые лежат в чьих-то корзинах. Поэтому чтение
+списка стоит O(разных ингредиентов), а не O(рецептов × ингредиентов).
+
+Строки читаются из базы итератором (на PostgreSQL это серверный курсор)
+и уходят клиенту частями, поэтому память воркера не зависит от размера
+корзины. Готовый файл кешируется по версии корзины: она меняется при
+добавлении и удалении рецептов, правке их состава, переименовании
+ингредиентов и со сменой даты в заголовке.
+"""
+import csv
+import hashlib
+import io
+import json
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import (Case, Count, F, IntegerField, QuerySet, Sum,
+                              Value, When)
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from django.utils.text import capfirst
+
+from .catalog import catalog
+from .models import (Ingredient, Recipe, RecipeIngredient, ShoppingCart,
+                     ShoppingListItem, User)
+
+MONTHS_RU = {
+    1: "января", 2: "февраля", 3: "марта", 4: "апреля", 5: "мая",
+    6: "июня", 7: "июля", 8: "августа", 9: "сентября", 10: "октября",
+    11: "ноября", 12: "декабря"
+}
+ITERATOR_CHUNK_SIZE = 2000
+STREAM_BUFFER_SIZE = 16 * 1024
+
+
+def cart_users(recipe_id):
+    """Подзапрос с id пользователей, у которых рецепт в корзине."""
+    return ShoppingCart.objects.filter(
+        recipe_id=recipe_id
+    ).values_list('user_id', flat=True)
+
+
+def recipe_changes(recipe_id, sign=1):
+    """
+    Изменения сводного списка от добавления рецепта в корзину (sign=1)
+    или удаления из нее (sign=-1).
+    """
+    return {
+        ingredient_id: (sign * amount, sign)
+        for ingredient_id, amount in RecipeIngredient.objects.filter(
+            recipe_id=recipe_id
+        ).values_list('ingredient_id', 'amount')
+    }
+
+
+def recipes_changes(recipe_ids, sign=1):
+    """То же для нескольких рецептов сразу, одним запросом с GROUP BY."""
+    return {
+        ingredient_id: (sign * amount, sign * count)
+        for ingredient_id, amount, count in RecipeIngredient.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values('ingredient_id').annotate(
+            amount=Sum('amount'), count=Count('recipe')
+        ).values_list('ingredient_id', 'amount', 'count').order_by()
+    }
+
+
+def delta(changes, position):
+    return Case(
+        *(When(ingredient_id=pk, then=Value(change[position]))
+          for pk, change in changes.items()),
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+
+
+def change_shopping_lists(user_ids, changes):
+    """
+    Применяет к сводным спискам пользователей user_ids (список или
+    подзапрос) изменения вида
+    {id ингредиента: (изменение количества, изменение числа рецептов)}.
+    """
+    changes = {pk: change for pk, change in changes.items() if any(change)}
+    if not changes:
+        return
+    added = [pk for pk, (_, count) in changes.items() if count > 0]
+    if added:
+        users = (
+            user_ids.iterator(chunk_size=ITERATOR_CHUNK_SIZE)
+            if isinstance(user_ids, QuerySet) else iter(user_ids)
+        )
+        while batch := list(islice(users, ITERATOR_CHUNK_SIZE)):
+            ShoppingListItem.objects.bulk_create(
+                (ShoppingListItem(user_id=user_id, ingredient_id=pk)
+                 for user_id in batch for pk in added),
+                ignore_conflicts=True,
+            )
+    items = ShoppingListItem.objects.filter(
+        user_id__in=user_ids, ingredient_id__in=list(changes)
+    )
+    items.update(
+        total_amount=Greatest(F('total_amount') + delta(changes, 0), 0),
+        recipe_count=Greatest(F('recipe_count') + delta(changes, 1), 0),
+    )
+    if any(count < 0 for _, count in changes.values()):
+        items.filter(recipe_count=0).delete()
+
+
+def aggregate_carts(user_ids):
+    """Сводные списки, посчитанные заново по корзинам."""
+    return RecipeIngredient.objects.filter(
+        recipe__shopping_carts__user__in=user_ids
+    ).values_list(
+        'recipe__shopping_carts__user', 'ingredient'
+    ).annotate(
+        total_amount=Sum('amount'), recipe_count=Count('recipe')
+    ).order_by()
+
+
+def rebuild_shopping_lists(batch_size, dry_run=False):
+    """
+    Сверяет сводные списки с корзинами пачками пользователей и
+    пересобирает разошедшиеся. Возвращает число исправленных списков.
+    """
+    fixed = 0
+    last_pk = None
+    while True:
+        users = User.objects.order_by('pk')
+        if last_pk is not None:
+            users = users.filter(pk__gt=last_pk)
+        pks = list(users.values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return fixed
+        last_pk = pks[-1]
+        actual = set(aggregate_carts(pks))
+        stored = set(ShoppingListItem.objects.filter(
+            user_id__in=pks
+        ).values_list('user_id', 'ingredient_id', 'total_amount',
+                      'recipe_count'))
+        drifted = {row[0] for row in actual ^ stored}
+        if drifted and not dry_run:
+            with transaction.atomic():
+                ShoppingListItem.objects.filter(
+                    user_id__in=drifted
+                ).delete()
+                ShoppingListItem.objects.bulk_create(
+                    ShoppingListItem(
+                        user_id=user_id,
+                        ingredient_id=ingredient_id,
+                        total_amount=total_amount,
+                        recipe_count=recipe_count,
+                    )
+                    for user_id, ingredient_id, total_amount, recipe_count
+                    in actual
+                    if user_id in drifted
+                )
+        fixed += len(drifted)
+
+
+def render_txt(date, ingredients, recipes):
+    yield f'Список покупок от {date}\n\nИНГРЕДИЕНТЫ:\n'
+    for name, measurement_unit, amount in ingredients:
+        yield f'- {capfirst(name)} ({measurement_unit}) — {amount}\n'
+    yield '\nРЕЦЕПТЫ В СПИСКЕ:\n'
+    for name, author in recipes:
+        yield f'- {name} (автор: {author})\n'
+
+
+def render_md(date, ingredients, recipes):
+    yield f'# Список покупок от {date}\n\n## Ингредиенты\n\n'
+    for name, measurement_unit, amount in ingredients:
+        yield f'- [ ] {capfirst(name)} ({measurement_unit}) — {amount}\n'
+    yield '\n## Рецепты\n\n'
+    for name, author in recipes:
+        yield f'- {name} (автор: {author})\n'
+
+
+def render_csv(date, ingredients, recipes):
+    """Только ингредиенты: CSV — одна таблица."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(('Ингредиент', 'Единица измерения', 'Количество'))
+    for name, measurement_unit, amount in ingredients:
+        writer.writerow((capfirst(name), measurement_unit, amount))
+        if buffer.tell() >= STREAM_BUFFER_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def render_json(date, ingredients, recipes):
+    dumps = json.JSONEncoder(ensure_ascii=False).encode
+    yield '{"date": %s, "ingredients": [' % dumps(date)
+    separator = ''
+    for name, measurement_unit, amount in ingredients:
+        yield separator + dumps({
+            'name': name,
+            'measurement_unit': measurement_unit,
+            'amount': amount,
+        })
+        separator = ', '
+    yield '], "recipes": ['
+    separator = ''
+    for name, author in recipes:
+        yield separator + dumps({'name': name, 'author': author})
+        separator = ', '
+    yield ']}'
+
+
+# формат: (Content-Type, функция отрисовки)
+EXPORT_FORMATS = {
+    'txt': ('text/plain; charset=utf-8', render_txt),
+    'csv': ('text/csv; charset=utf-8', render_csv),
+    'json': ('application/json', render_json),
+    'md': ('text/markdown; charset=utf-8', render_md),
+}
+
+
+def get_cart_version(user, date):
+    """
+    Версия корзины: хеш от id и версий рецептов в ней, версии справочника
+    ингредиентов и даты. Читает только одну узкую таблицу.
+    """
+    digest = hashlib.md5(usedforsecurity=False)
+    digest.update(
+        f'{date}:{catalog.get_version(Ingredient)[0]}'.encode()
+    )
+    rows = ShoppingCart.objects.filter(user=user).order_by(
+        'recipe_id'
+    ).values_list('recipe_id', 'recipe__version')
+    for recipe_id, version in rows.iterator(chunk_size=ITERATOR_CHUNK_SIZE):
+        digest.update(f':{recipe_id}.{version}'.encode())
+    return digest.hexdigest()
+
+
+class ShoppingList:
+    """Список покупок пользователя в одном из EXPORT_FORMATS."""
+
+    def __init__(self, user, export_format='txt'):
+        self.user = user
+        self.format = export_format
+        self.content_type, self.render = EXPORT_FORMATS[export_format]
+        self.filename = f'shopping_list.{export_format}'
+        today = timezone.localdate()
+        self.date = f'{today.day} {MONTHS_RU[today.month]} {today.year}'
+        self.version = get_cart_version(user, self.date)
+
+    @property
+    def etag(self):
+        return f'"cart-{self.version}-{self.format}"'
+
+    @property
+    def cache_key(self):
+        return f'shopping-list:{self.user.pk}:{self.format}:{self.version}'
+
+    def get_ingredients(self):
+        return ShoppingListItem.objects.filter(
+            user=self.user
+        ).values_list(
+            'ingredient__name', 'ingredient__measurement_unit',
+            'total_amount'
+        ).order_by(
+            'ingredient__name', 'ingredient__measurement_unit'
+        ).iterator(chunk_size=ITERATOR_CHUNK_SIZE)
+
+    def get_recipes(self):
+        return Recipe.objects.filter(
+            shopping_carts__user=self.user
+        ).order_by('name', 'id').values_list(
+            'name', 'author__username'
+        ).iterator(chunk_size=ITERATOR_CHUNK_SIZE)
+
+    def get_cached(self):
+        return cache.get(self.cache_key)
+
+    def stream(self):
+        """
+        Отдает файл частями по STREAM_BUFFER_SIZE байт и кладет его в кеш,
+        если он уложился в SHOPPING_LIST_CACHE_MAX_SIZE.
+        """
+        parts, size = [], 0
+        for chunk in self.encode(
+            self.render(self.date, self.get_ingredients(), self.get_recipes())
+        ):
+            size += len(chunk)
+            if parts is not None:
+                if size <= settings.SHOPPING_LIST_CACHE_MAX_SIZE:
+                    parts.append(chunk)
+                else:
+                    parts = None
+            yield chunk
+        if parts is not None:
+            cache.set(
+                self.cache_key,
+                b''.join(parts),
+                settings.SHOPPING_LIST_CACHE_TIMEOUT,
+            )
+
+    @staticmethod
+    def encode(pieces):
+        buffer, size = [], 0
+        for piece in pieces:
+            piece = piece.encode()
+            buffer.append(piece)
+            size += len(piece)
+            if size >= STREAM_BUFFER_SIZE:
+                yield b''.join(buffer)
+                buffer, size = [], 0
+        if buffer:
+            yield b''.join(buffer)
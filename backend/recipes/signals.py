@@ -0,0 +1,223 @@
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+
+from .catalog import catalog
+from .counters import change_counter
+from .image_variants import schedule_variants
+from .models import (CatalogVersion, Favorite, Follow, Ingredient, Recipe,
+                     RecipeIngredient, ShoppingCart, Tag, User,
+                     bump_recipe_versions)
+from .search import recipes_changed
+from .shopping_list import cart_users, change_shopping_lists, recipe_changes
+from .user_lists import LIST_COUNTERS
+
+USER_SERVICE_FIELDS = frozenset(('last_login', 'password'))
+SEARCH_FIELDS = frozenset(('name', 'text'))
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def bump_catalog_version(sender, **kwargs):
+    """Сбрасывает справочники во всех процессах при изменении записи."""
+    CatalogVersion.bump(sender)
+    transaction.on_commit(catalog.invalidate)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=User)
+def build_image_variants(sender, instance, raw=False, **kwargs):
+    if not raw:
+        schedule_variants(instance)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def bump_search_version(sender, instance, raw=False, update_fields=None,
+                        **kwargs):
+    """Индексу поиска нужны только название и описание рецепта."""
+    if raw:
+        return
+    if update_fields and not SEARCH_FIELDS.intersection(update_fields):
+        return
+    recipes_changed([instance.pk])
+
+
+@receiver(post_save, sender=Recipe)
+def bump_recipe_version(sender, instance, raw=False, **kwargs):
+    """Меняет версию рецепта, чтобы не отдать устаревший кэш."""
+    if not raw:
+        bump_recipe_versions([instance.pk])
+
+
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+def bump_recipe_version_on_ingredients(sender, instance, raw=False,
+                                       **kwargs):
+    if not raw:
+        bump_recipe_versions([instance.recipe_id])
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(sender, instance, action, reverse, model, pk_set,
+                        **kwargs):
+    """Версии рецептов и счетчики тегов при изменении связей."""
+    if action == 'pre_clear':
+        instance._cleared_pks = list(
+            (Recipe if reverse else Tag).objects.filter(
+                **{'tags' if reverse else 'recipes': instance}
+            ).values_list('pk', flat=True)
+        )
+    if not action.startswith('post_'):
+        return
+    pks = pk_set if action != 'post_clear' else instance._cleared_pks
+    if not pks:
+        return
+    delta = 1 if action == 'post_add' else -1
+    if reverse:
+        bump_recipe_versions(pks)
+        change_counter(Tag, 'recipes_count', delta * len(pks),
+                       pk=instance.pk)
+    else:
+        bump_recipe_versions([instance.pk])
+        change_counter(Tag, 'recipes_count', delta, pk__in=pks)
+
+
+@receiver(post_save, sender=User)
+def bump_author_recipes_version(sender, instance, created, raw=False,
+                                update_fields=None, **kwargs):
+    """Профиль автора входит в представление каждого его рецепта."""
+    if created or raw:
+        return
+    if update_fields and USER_SERVICE_FIELDS.issuperset(update_fields):
+        return
+    Recipe.objects.filter(author=instance).bump_version()
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+def recipe_added_to_list(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        change_counter(Recipe, LIST_COUNTERS[sender], 1,
+                       pk=instance.recipe_id)
+
+
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=ShoppingCart)
+def recipe_removed_from_list(sender, instance, **kwargs):
+    change_counter(Recipe, LIST_COUNTERS[sender], -1, pk=instance.recipe_id)
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        change_counter(User, 'followers_count', 1, pk=instance.author_id)
+        change_counter(User, 'following_count', 1, pk=instance.user_id)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    change_counter(User, 'followers_count', -1, pk=instance.author_id)
+    change_counter(User, 'following_count', -1, pk=instance.user_id)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        change_counter(User, 'recipes_count', 1, pk=instance.author_id)
+
+
+@receiver(pre_delete, sender=Recipe)
+def recipe_tags_deleted(sender, instance, **kwargs):
+    """Связи с тегами удаляются без m2m_changed, счетчики правим заранее."""
+    change_counter(Tag, 'recipes_count', -1, recipes=instance)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    change_counter(User, 'recipes_count', -1, pk=instance.author_id)
+
+
+@receiver(post_save, sender=RecipeIngredient)
+def recipe_ingredient_created(sender, instance, created, raw=False,
+                              **kwargs):
+    if created and not raw:
+        change_counter(Ingredient, 'recipes_count', 1,
+                       pk=instance.ingredient_id)
+
+
+@receiver(post_delete, sender=RecipeIngredient)
+def recipe_ingredient_deleted(sender, instance, **kwargs):
+    change_counter(Ingredient, 'recipes_count', -1,
+                   pk=instance.ingredient_id)
+
+
+def is_direct_delete(sender, origin):
+    """Удаляют сами записи sender, а не каскадом от другой модели."""
+    return (
+        isinstance(origin, sender)
+        or getattr(origin, 'model', None) is sender
+    )
+
+
+@receiver(post_save, sender=ShoppingCart)
+def recipe_added_to_cart(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        change_shopping_lists(
+            [instance.user_id], recipe_changes(instance.recipe_id)
+        )
+
+
+@receiver(pre_delete, sender=ShoppingCart)
+def recipe_removed_from_cart(sender, instance, origin=None, **kwargs):
+    """
+    При удалении рецепта его корзины обрабатывает recipe_deleted_from_carts,
+    при удалении пользователя его сводный список удаляется каскадом.
+    """
+    if is_direct_delete(sender, origin):
+        change_shopping_lists(
+            [instance.user_id], recipe_changes(instance.recipe_id, -1)
+        )
+
+
+@receiver(pre_delete, sender=Recipe)
+def recipe_deleted_from_carts(sender, instance, **kwargs):
+    """До удаления, пока состав рецепта еще в базе."""
+    change_shopping_lists(
+        cart_users(instance.pk), recipe_changes(instance.pk, -1)
+    )
+
+
+@receiver(pre_save, sender=RecipeIngredient)
+def remember_recipe_ingredient(sender, instance, raw=False, **kwargs):
+    if not raw and not instance._state.adding:
+        instance._previous = RecipeIngredient.objects.filter(
+            pk=instance.pk
+        ).values_list('ingredient_id', 'amount').first()
+
+
+@receiver(post_save, sender=RecipeIngredient)
+def recipe_ingredient_saved(sender, instance, raw=False, **kwargs):
+    """Правка состава рецепта меняет списки всех, у кого он в корзине."""
+    if raw:
+        return
+    changes = {instance.ingredient_id: (instance.amount, 1)}
+    previous = getattr(instance, '_previous', None)
+    if previous is not None:
+        ingredient_id, amount = previous
+        amount_change, count_change = changes.get(ingredient_id, (0, 0))
+        changes[ingredient_id] = (amount_change - amount, count_change - 1)
+    change_shopping_lists(cart_users(instance.recipe_id), changes)
+
+
+@receiver(pre_delete, sender=RecipeIngredient)
+def recipe_ingredient_deleted_from_carts(sender, instance, origin=None,
+                                         **kwargs):
+    if is_direct_delete(sender, origin):
+        change_shopping_lists(
+            cart_users(instance.recipe_id),
+            {instance.ingredient_id: (-instance.amount, -1)},
+        )
@@ -0,0 +1,38 @@
+import io
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+
+from recipes import image_variants
+from recipes.models import Recipe, User
+
+
+class RunBuildVariantsTests(SimpleTestCase):
+
+    def test_build_errors_are_logged(self):
+        with mock.patch.object(
+            image_variants, 'build_variants', side_effect=OSError('broken')
+        ), self.assertLogs('recipes.image_variants', 'ERROR') as logs:
+            built = image_variants.run_build_variants(
+                Recipe, 1, 'recipes/x.jpg'
+            )
+        self.assertFalse(built)
+        self.assertIn('broken', logs.output[0])
+
+
+class GenerateImageVariantsTests(TestCase):
+
+    def test_failures_are_counted(self):
+        author = User.objects.create_user(
+            username='author', email='author@example.com',
+            password='Pass-12345!', first_name='A', last_name='B',
+        )
+        Recipe.objects.bulk_create([Recipe(
+            author=author, name='Суп', image='recipes/images/missing.png',
+            text='Суп', cooking_time=1,
+        )])
+        output = io.StringIO()
+        with self.assertLogs('recipes.image_variants', 'ERROR'):
+            call_command('generate_image_variants', stdout=output)
+        self.assertIn('Recipe: построено 0, ошибок 1.', output.getvalue())
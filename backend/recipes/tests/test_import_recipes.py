@@ -0,0 +1,80 @@
+import io
+import json
+import os
+import tempfile
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+
+from recipes.catalog import catalog
+from recipes.files import media_path
+from recipes.models import Ingredient, Recipe, Tag
+
+
+def record(name, image='recipes/images/soup.png', **fields):
+    return {
+        'name': name, 'text': name, 'cooking_time': 10, 'image': image,
+        'author': {'email': 'author@example.com', 'username': 'author'},
+        'tags': ['lunch'],
+        'ingredients': [
+            {'name': 'соль', 'measurement_unit': 'г', 'amount': 5},
+        ],
+        **fields,
+    }
+
+
+@mock.patch('recipes.management.commands.import_recipes.call_command')
+class ImportRecipesTests(TestCase):
+
+    def setUp(self):
+        Tag.objects.create(name='Обед', color='#49B64E', slug='lunch')
+        Ingredient.objects.create(name='соль', measurement_unit='г')
+        catalog.invalidate()
+        self.addCleanup(catalog.invalidate)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'recipes.ndjson')
+
+    def load(self, records):
+        with open(self.path, 'w', encoding='utf-8') as file:
+            for item in records:
+                file.write(json.dumps(item, ensure_ascii=False) + '\n')
+        call_command(
+            'import_recipes', self.path, '--restart',
+            stdout=io.StringIO(), stderr=io.StringIO(),
+        )
+
+    def test_unsafe_image_names_are_skipped(self, call_command):
+        self.load([
+            record('Суп'),
+            record('Щи', image='../../etc/passwd'),
+            record('Борщ', image='/etc/passwd'),
+        ])
+        self.assertEqual(
+            list(Recipe.objects.values_list('name', flat=True)), ['Суп']
+        )
+
+    def test_records_without_pub_date_are_not_duplicated(self, call_command):
+        self.load([record('Суп')])
+        self.load([record('Суп')])
+        self.assertEqual(Recipe.objects.filter(name='Суп').count(), 1)
+
+    def test_variants_only_for_imported_recipes(self, call_command):
+        self.load([record('Суп'), record('Щи')])
+        first = Recipe.objects.order_by('pk').first()
+        call_command.assert_called_once_with(
+            'generate_image_variants', recipes_from=first.pk
+        )
+
+
+class MediaPathTests(SimpleTestCase):
+
+    def test_names_outside_root_are_rejected(self):
+        for name in ('../x.png', '/etc/passwd', 'a/../../x.png', 'a\\..\\x'):
+            with self.subTest(name=name), self.assertRaises(ValueError):
+                media_path('/srv/media', name)
+        self.assertEqual(
+            media_path('/srv/media', 'recipes/images/a.png'),
+            os.path.realpath('/srv/media/recipes/images/a.png'),
+        )
@@ -0,0 +1,47 @@
+import io
+import json
+import os
+import tempfile
+
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+
+from recipes.models import Ingredient, Tag
+
+
+class LoaderTests(TestCase):
+
+    def load(self, command, rows):
+        file = tempfile.NamedTemporaryFile(
+            'w', suffix='.json', delete=False, encoding='utf-8'
+        )
+        self.addCleanup(os.remove, file.name)
+        with file:
+            json.dump(rows, file, ensure_ascii=False)
+        call_command(command, file.name, stdout=io.StringIO())
+
+    def test_tags_update_by_slug(self):
+        Tag.objects.create(name='Завтрак', color='#E26C2D', slug='breakfast')
+        self.load('load_tags', [
+            {'name': 'Утро', 'color': '#E26C2D', 'slug': 'breakfast'},
+        ])
+        self.assertEqual(Tag.objects.get(slug='breakfast').name, 'Утро')
+
+    def test_tag_with_taken_name_fails_without_changes(self):
+        Tag.objects.create(name='Завтрак', color='#E26C2D', slug='breakfast')
+        with self.assertRaisesMessage(CommandError, 'Завтрак'):
+            self.load('load_tags', [
+                {'name': 'Обед', 'color': '#49B64E', 'slug': 'lunch'},
+                {'name': 'Завтрак', 'color': '#8775D2', 'slug': 'morning'},
+            ])
+        self.assertEqual(
+            list(Tag.objects.values_list('slug', flat=True)), ['breakfast']
+        )
+
+    def test_ingredients_are_only_added(self):
+        Ingredient.objects.create(name='соль', measurement_unit='г')
+        self.load('load_ingredients', [
+            {'name': 'соль', 'measurement_unit': 'г'},
+            {'name': 'соль', 'measurement_unit': 'щепотка'},
+        ])
+        self.assertEqual(Ingredient.objects.filter(name='соль').count(), 2)
@@ -0,0 +1,64 @@
+from django.test import TestCase
+
+from recipes.models import CatalogVersion, Recipe, RecipeChange, User
+from recipes.search import RecipeSearchIndex, recipes_changed
+
+
+class RecipeSearchIndexTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com',
+            password='Pass-12345!', first_name='A', last_name='B',
+        )
+
+    def create_recipe(self, name, **kwargs):
+        return Recipe(
+            author=self.author, name=name, image='recipes/images/test.png',
+            text=name, cooking_time=1, **kwargs
+        )
+
+    def found(self, index, query):
+        return [recipe_id for recipe_id, _ in index.search(query)]
+
+    def test_rebuilds_when_another_process_changes_recipes(self):
+        index = RecipeSearchIndex()
+        self.assertEqual(self.found(index, 'борщ'), [])
+        # bulk_create без сигналов: как запись из другого процесса
+        [recipe] = Recipe.objects.bulk_create([self.create_recipe('Борщ')])
+        self.assertEqual(self.found(index, 'борщ'), [])
+        CatalogVersion.bump(Recipe)
+        self.assertEqual(self.found(index, 'борщ'), [recipe.pk])
+
+    def test_save_and_delete_bump_version(self):
+        index = RecipeSearchIndex()
+        recipe = self.create_recipe('Солянка')
+        recipe.save()
+        self.assertEqual(self.found(index, 'солянка'), [recipe.pk])
+        recipe.delete()
+        self.assertEqual(self.found(index, 'солянка'), [])
+
+    def test_applies_logged_changes_without_rebuild(self):
+        index = RecipeSearchIndex()
+        index.search('щи')
+        [unlogged] = Recipe.objects.bulk_create([self.create_recipe('Щи')])
+        recipe = self.create_recipe('Окрошка')
+        recipe.save()
+        with self.assertNumQueries(3):
+            self.assertEqual(self.found(index, 'окрошка'), [recipe.pk])
+        # полной перестройки не было: рецепт без записи в журнале
+        # в индекс не попал
+        self.assertEqual(self.found(index, 'щи'), [])
+        recipes_changed()
+        self.assertEqual(self.found(index, 'щи'), [unlogged.pk])
+
+    def test_rebuilds_when_log_is_incomplete(self):
+        index = RecipeSearchIndex()
+        index.search('уха')
+        recipe, logged = Recipe.objects.bulk_create(
+            [self.create_recipe('Уха'), self.create_recipe('Плов')]
+        )
+        recipes_changed([logged.pk])
+        RecipeChange.objects.all().delete()
+        self.assertEqual(self.found(index, 'уха'), [recipe.pk])
@@ -0,0 +1,79 @@
+from django.db.models.signals import post_delete, pre_delete
+from django.test import TestCase
+
+from recipes.models import Favorite, Follow, Recipe, User
+from recipes.user_lists import (ADDED, ALREADY_ADDED, NOT_FOUND, SELF,
+                                add_recipes, follow_authors, raw_delete)
+
+
+def create_user(username):
+    return User.objects.create_user(
+        username=username, email=f'{username}@example.com',
+        first_name=username, last_name=username, password='password',
+    )
+
+
+def create_recipe(author, name):
+    return Recipe.objects.create(
+        author=author, name=name, image='recipes/images/test.png',
+        text=name, cooking_time=1,
+    )
+
+
+class UserListsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('user')
+        cls.author = create_user('author')
+        cls.recipe = create_recipe(cls.author, 'Суп')
+
+    def test_add_recipes_counts_only_new_entries(self):
+        Favorite.objects.create(user=self.user, recipe=self.recipe)
+        other = create_recipe(self.author, 'Каша')
+        results = add_recipes(
+            Favorite, self.user, [self.recipe.pk, other.pk, 0]
+        )
+        self.assertEqual(results, {
+            self.recipe.pk: ALREADY_ADDED, other.pk: ADDED, 0: NOT_FOUND,
+        })
+        self.recipe.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 1)
+        self.assertEqual(other.favorites_count, 1)
+
+    def test_follow_authors(self):
+        results = follow_authors(self.user, [self.author.pk, self.user.pk])
+        self.assertEqual(
+            results, {self.author.pk: ADDED, self.user.pk: SELF}
+        )
+        self.assertEqual(
+            follow_authors(self.user, [self.author.pk]),
+            {self.author.pk: ALREADY_ADDED},
+        )
+        self.author.refresh_from_db()
+        self.user.refresh_from_db()
+        self.assertEqual(self.author.followers_count, 1)
+        self.assertEqual(self.user.following_count, 1)
+
+    def test_raw_delete_is_one_query_without_signals(self):
+        """raw_delete опирается на закрытый QuerySet._raw_delete."""
+        Follow.objects.create(user=self.user, author=self.author)
+        Follow.objects.create(user=self.author, author=self.user)
+        received = []
+
+        def receiver(sender, **kwargs):
+            received.append(sender)
+
+        pre_delete.connect(receiver, sender=Follow)
+        post_delete.connect(receiver, sender=Follow)
+        self.addCleanup(pre_delete.disconnect, receiver, sender=Follow)
+        self.addCleanup(post_delete.disconnect, receiver, sender=Follow)
+        with self.assertNumQueries(1):
+            deleted = raw_delete(Follow.objects.filter(user=self.user))
+        self.assertEqual(deleted, 1)
+        self.assertEqual(received, [])
+        self.assertEqual(
+            list(Follow.objects.values_list('user', flat=True)),
+            [self.author.pk],
+        )
@@ -0,0 +1,130 @@
+"""
+Пакетное добавление и удаление рецептов в избранном и корзине
+и подписок на авторов.
+
+Объекты блокируются одним SELECT ... FOR UPDATE, их наличие в списке
+проверяется одним запросом, новые связи вставляются одним bulk_create,
+удаляются одним DELETE. Сигналы при этом не срабатывают, поэтому
+счетчики и сводные списки покупок меняются здесь же, по одному запросу
+на все связи. Функции вызываются в транзакции и возвращают
+{id: статус}.
+"""
+from .counters import change_counter
+from .models import Favorite, Follow, Recipe, ShoppingCart, User
+from .shopping_list import change_shopping_lists, recipes_changes
+
+ADDED = 'added'
+ALREADY_ADDED = 'already_added'
+REMOVED = 'removed'
+NOT_IN_LIST = 'not_in_list'
+NOT_FOUND = 'not_found'
+SELF = 'self'
+
+LIST_COUNTERS = {
+    Favorite: 'favorites_count',
+    ShoppingCart: 'in_carts_count',
+}
+
+
+def raw_delete(queryset):
+    """
+    Один DELETE без сигналов и без выборки удаляемых строк.
+    Публичного способа для этого у QuerySet нет, поведение закрытого
+    _raw_delete проверяет recipes/tests/test_user_lists.py.
+    """
+    return queryset._raw_delete(queryset.db)
+
+
+def lock(model, pks):
+    """
+    Блокирует строки рецептов или авторов до конца транзакции
+    и возвращает найденные pk. Вставка связи проверяет внешний ключ
+    через FOR KEY SHARE и ждет этой блокировки, поэтому параллельное
+    добавление той же связи, пакетное или поштучное, не попадет между
+    проверкой и вставкой и не будет посчитано в счетчиках дважды.
+    """
+    return set(
+        model.objects.select_for_update().filter(pk__in=pks).order_by(
+            'pk'
+        ).values_list('pk', flat=True)
+    )
+
+
+def add_recipes(model, user, recipe_ids):
+    """Добавляет рецепты в список model (Favorite или ShoppingCart)."""
+    found = lock(Recipe, recipe_ids)
+    listed = set(
+        model.objects.filter(user=user, recipe_id__in=found).values_list(
+            'recipe_id', flat=True
+        )
+    )
+    new = [pk for pk in found if pk not in listed]
+    if new:
+        model.objects.bulk_create(
+            model(user=user, recipe_id=pk) for pk in new
+        )
+        change_counter(Recipe, LIST_COUNTERS[model], 1, pk__in=new)
+        if model is ShoppingCart:
+            change_shopping_lists([user.pk], recipes_changes(new))
+    return {
+        pk: NOT_FOUND if pk not in found
+        else ALREADY_ADDED if pk in listed else ADDED
+        for pk in recipe_ids
+    }
+
+
+def remove_recipes(model, user, recipe_ids):
+    """Удаляет рецепты из списка model."""
+    entries = model.objects.filter(user=user, recipe_id__in=recipe_ids)
+    listed = list(
+        entries.select_for_update().values_list('recipe_id', flat=True)
+    )
+    if listed:
+        if model is ShoppingCart:
+            # до удаления, пока рецепты еще в корзине
+            change_shopping_lists([user.pk], recipes_changes(listed, -1))
+        raw_delete(entries)
+        change_counter(Recipe, LIST_COUNTERS[model], -1, pk__in=listed)
+    listed = set(listed)
+    return {
+        pk: REMOVED if pk in listed else NOT_IN_LIST for pk in recipe_ids
+    }
+
+
+def follow_authors(user, author_ids):
+    """Подписывает пользователя на авторов."""
+    found = lock(User, author_ids)
+    followed = set(
+        Follow.objects.filter(user=user, author_id__in=found).values_list(
+            'author_id', flat=True
+        )
+    )
+    new = [pk for pk in found if pk not in followed and pk != user.pk]
+    if new:
+        Follow.objects.bulk_create(
+            Follow(user=user, author_id=pk) for pk in new
+        )
+        change_counter(User, 'followers_count', 1, pk__in=new)
+        change_counter(User, 'following_count', len(new), pk=user.pk)
+    return {
+        pk: NOT_FOUND if pk not in found
+        else SELF if pk == user.pk
+        else ALREADY_ADDED if pk in followed else ADDED
+        for pk in author_ids
+    }
+
+
+def unfollow_authors(user, author_ids):
+    """Отписывает пользователя от авторов."""
+    follows = Follow.objects.filter(user=user, author_id__in=author_ids)
+    followed = list(
+        follows.select_for_update().values_list('author_id', flat=True)
+    )
+    if followed:
+        raw_delete(follows)
+        change_counter(User, 'followers_count', -1, pk__in=followed)
+        change_counter(User, 'following_count', -len(followed), pk=user.pk)
+    followed = set(followed)
+    return {
+        pk: REMOVED if pk in followed else NOT_IN_LIST for pk in author_ids
+    }
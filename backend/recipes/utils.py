@@ -1,32 +1,46 @@
-from datetime import datetime
-from django.db.models import Sum
-from django.template.loader import render_to_string
-
-from .models import Recipe, RecipeIngredient
-
-MONTHS_RU = {
-    1: "января", 2: "февраля", 3: "марта", 4: "апреля", 5: "мая",
-    6: "июня", 7: "июля", 8: "августа", 9: "сентября", 10: "октября",
-    11: "ноября", 12: "декабря"
-}
-
-
-def format_shopping_list(user):
-    """Форматирует список покупок для пользователя."""
-    ingredients = RecipeIngredient.objects.filter(
-        recipe__shopping_carts__user=user
-    ).values(
-        "ingredient__name", "ingredient__measurement_unit"
-    ).annotate(total_amount=Sum("amount")).order_by("ingredient__name")
-
-    recipes = Recipe.objects.filter(
-        shopping_carts__user=user
-    ).select_related('author')
-
-    now = datetime.now()
-    context = {
-        "date": f"{now.day} {MONTHS_RU[now.month]} {now.year}",
-        "ingredients": ingredients,
-        "recipes": recipes,
-    }
-    return render_to_string("shopping_list.txt", context)
+import json
+
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+ESTIMATED_COUNT_THRESHOLD = 100_000
+
+
+def estimated_count(queryset):
+    """
+    Оценка числа строк выборки по статистике PostgreSQL.
+
+    Для выборки без фильтров берется pg_class.reltuples, для остальных —
+    оценка планировщика из EXPLAIN. Возвращает None, если база не
+    PostgreSQL или строк мало и точный COUNT(*) дешевле неточной оценки.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    if queryset.query.has_filters():
+        plan = json.loads(queryset.explain(format='json'))
+        estimate = plan[0]['Plan']['Plan Rows']
+    else:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                [queryset.model._meta.db_table]
+            )
+            row = cursor.fetchone()
+        estimate = row[0] if row else 0
+    if estimate < ESTIMATED_COUNT_THRESHOLD:
+        return None
+    return int(estimate)
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Пагинатор, который для больших выборок берет оценку числа строк
+    из статистики PostgreSQL вместо COUNT(*).
+    """
+
+    @cached_property
+    def count(self):
+        estimate = estimated_count(self.object_list)
+        return super().count if estimate is None else estimate